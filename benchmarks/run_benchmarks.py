@@ -0,0 +1,429 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+from synthetic import SIZES, ensure_scene
+
+# Usage: PYTHONPATH=. python benchmarks/run_benchmarks.py [--sizes 1k 4k] [--benchmarks create_heatmap ...]
+# Every case runs in its own process so that peak memory and one-off costs
+# (imports, LUT builds) are measured per function, not per suite.
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT_DIR = BENCH_DIR.parent
+RESULTS_DIR = BENCH_DIR / "results"
+BASELINE = BENCH_DIR / "baseline.json"
+
+DEFAULT_SIZES = ["1k", "4k"]
+DEFAULT_THRESHOLD = 0.10   # 10% slower / larger than the baseline is a regression
+MIN_SECONDS = 0.005        # timings below this are too noisy to compare
+
+# setup(image, path) -> arguments of run(); setup is not timed.
+# max_size skips cases that would not fit in memory or take minutes.
+Benchmark = namedtuple("Benchmark", ["setup", "run", "dtypes", "max_size"])
+
+
+def _fire():
+    from fire_detection.config import FIRE_PARAMS
+    from fire_detection.utils.fire_detection import create_heatmap
+    return Benchmark(lambda image, path: (image, FIRE_PARAMS), create_heatmap, ("uint8",), None)
+
+
+def _drought():
+    from drought_detection.config import DROUGHT_PARAMS
+    from drought_detection.utils.drought_detection import detect_drought
+    return Benchmark(lambda image, path: (image, DROUGHT_PARAMS), detect_drought, ("uint8",), None)
+
+
+def _cascade():
+    from drought_detection.config import DROUGHT_PARAMS
+    from fire_detection.config import FIRE_PARAMS
+    from utils.cascade import overview_coarse, run_cascade
+    from utils.cog_reader import open_cog
+
+    def run(path):
+        with open_cog(path) as reader:
+            run_cascade(reader, FIRE_PARAMS, DROUGHT_PARAMS, coarse=overview_coarse(reader))
+    return Benchmark(lambda image, path: (path,), run, ("uint8",), None)
+
+
+def _packed_open():
+    from drought_detection.config import DROUGHT_PARAMS
+    from drought_detection.utils.drought_detection import detect_drought_mask
+    from utils.packed_mask import PackedMask
+
+    def setup(image, path):
+        return (PackedMask.pack(detect_drought_mask(image, DROUGHT_PARAMS)),)
+    return Benchmark(setup, lambda mask: mask.open(DROUGHT_PARAMS["kernel_size"]), ("uint8",), None)
+
+
+def _ndvi():
+    from drought_detection.utils.drought_detection import calculate_ndvi_approximation
+    return Benchmark(lambda image, path: (image,), calculate_ndvi_approximation, ("uint8", "uint16"), None)
+
+
+def _gray(image):
+    from image_enhancement.utils.image_processing import convert_to_grayscale
+    return convert_to_grayscale(image)
+
+
+def _gray_float(image):
+    gray = _gray(image)
+    return gray.astype(np.float32) / np.iinfo(gray.dtype).max
+
+
+def _carbon_regions():
+    from carbon_detection.config import CARBON_DETECTION
+    from carbon_detection.utils.carbon_detection import detect_carbon_regions
+
+    def setup(image, path):
+        return _gray_float(image), CARBON_DETECTION["threshold"], CARBON_DETECTION["min_area"]
+    return Benchmark(setup, detect_carbon_regions, ("uint8",), None)
+
+
+def _carbon_classes(method, max_size=None):
+    def factory():
+        from carbon_detection.config import CARBON_DETECTION
+        from carbon_detection.utils.carbon_detection import classify_carbon_regions, detect_carbon_regions
+
+        def setup(image, path):
+            mask, _ = detect_carbon_regions(_gray_float(image), CARBON_DETECTION["threshold"],
+                                            CARBON_DETECTION["min_area"])
+            return mask, CARBON_DETECTION["n_clusters"], method
+        return Benchmark(setup, classify_carbon_regions, ("uint8",), max_size)
+    return factory
+
+
+def _denoise(method, max_size=None):
+    def factory():
+        from image_enhancement.config import DENOISE_PARAMS
+        from image_enhancement.utils.image_processing import denoise_image
+        params = {key: value for key, value in DENOISE_PARAMS.items() if key != "method"}
+        kwargs = params if method == "wavelet" else {}
+
+        def run(gray):
+            return denoise_image(gray, method, **dict(kwargs))
+        return Benchmark(lambda image, path: (_gray(image),), run, ("uint8",), max_size)
+    return factory
+
+
+def _upscale():
+    from image_enhancement.config import ENHANCEMENT_PARAMS
+    from image_enhancement.utils.image_processing import upscale_image
+    factor = ENHANCEMENT_PARAMS["upscale_factor"]
+    return Benchmark(lambda image, path: (_gray_float(image), factor), upscale_image, ("uint8",), 4096)
+
+
+def _sr_upscaler(arch):
+    def factory():
+        from image_enhancement.config import ENHANCEMENT_PARAMS, UPSCALER_PARAMS
+        from image_enhancement.models.sr_engine import create_upscaler
+        # Random weights: throughput does not depend on them, so the case runs offline
+        params = dict(UPSCALER_PARAMS, backend="random", arch=arch)
+        upscaler = create_upscaler(params, ENHANCEMENT_PARAMS["upscale_factor"])
+        return Benchmark(lambda image, path: (_gray_float(image),), upscaler.upscale, ("uint8",), 1024)
+    return factory
+
+
+def _sharpen():
+    from image_enhancement.config import ENHANCEMENT_PARAMS
+    from image_enhancement.utils.image_processing import sharpen_image
+    kernel = ENHANCEMENT_PARAMS["sharpening_kernel"]
+    return Benchmark(lambda image, path: (_gray_float(image), kernel), sharpen_image, ("uint8",), None)
+
+
+def _tiff_enhancer():
+    from image_enhancement.models.tiff_enhancer import TIFFEnhancer
+    enhancer = TIFFEnhancer()
+    return Benchmark(lambda image, path: (image,), enhancer.enhance_tiff, ("uint8", "uint16"), 4096)
+
+
+def _tiff_enhancer_tiled():
+    from collections import deque
+    from image_enhancement.models.tiff_enhancer import TIFFEnhancer
+    enhancer = TIFFEnhancer()
+
+    def run(image):
+        deque(enhancer.enhance_tiles(image), maxlen=0)
+    return Benchmark(lambda image, path: (image,), run, ("uint8", "uint16"), None)
+
+
+def _convert_png():
+    from utils.convert_to_png import convert_tiff_to_png
+    output = Path(tempfile.gettempdir()) / f"benchmark_{os.getpid()}.png"
+    return Benchmark(lambda image, path: (path, output), convert_tiff_to_png, ("uint8", "uint16"), None)
+
+
+# Name -> factory; factories import lazily so a case only loads what it uses
+BENCHMARKS = {
+    "create_heatmap": _fire,
+    "detect_drought": _drought,
+    "run_cascade": _cascade,
+    "PackedMask.open": _packed_open,
+    "calculate_ndvi_approximation": _ndvi,
+    "detect_carbon_regions": _carbon_regions,
+    "classify_carbon_regions": _carbon_classes("histogram"),
+    "classify_carbon_regions[kmeans]": _carbon_classes("kmeans", max_size=1024),
+    "denoise_image[wavelet]": _denoise("wavelet"),
+    "denoise_image[nlmeans]": _denoise("nlmeans", max_size=4096),
+    "upscale_image": _upscale,
+    "SRUpscaler[fsrcnn]": _sr_upscaler("fsrcnn"),
+    "SRUpscaler[esrgan]": _sr_upscaler("esrgan"),
+    "sharpen_image": _sharpen,
+    "TIFFEnhancer.enhance_tiff": _tiff_enhancer,
+    "TIFFEnhancer.enhance_tiles": _tiff_enhancer_tiled,
+    "convert_tiff_to_png": _convert_png,
+}
+
+
+def _status_kb(field):
+    """A VmRSS/VmHWM value from /proc/self/status, or None off Linux."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """Reset VmHWM to the current RSS (Linux >= 4.0); False where unsupported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _max_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    scale = 1024 ** 2 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def measure(name, size, dtype, repeat=3):
+    """Time one case and record its peak memory (run inside the case's own process)."""
+    from utils.cog_reader import read_image
+
+    benchmark = BENCHMARKS[name]()
+    path = ensure_scene(size, dtype)
+    image = read_image(path)
+    args = benchmark.setup(image, path)
+
+    # The first call carries one-off costs (LUT builds, lazy imports)
+    start = time.perf_counter()
+    benchmark.run(*args)
+    first = time.perf_counter() - start
+
+    seconds = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        benchmark.run(*args)
+        seconds.append(time.perf_counter() - start)
+
+    # Memory is measured on a separate call: tracemalloc slows allocations down
+    gc.collect()
+    rss_before = _status_kb("VmRSS")
+    peak_reset = _reset_peak_rss()
+    tracemalloc.start()
+    benchmark.run(*args)
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_peak = _status_kb("VmHWM")
+
+    return {
+        "name": name,
+        "size": size,
+        "dtype": dtype,
+        "repeat": repeat,
+        "first_seconds": first,
+        "min_seconds": min(seconds),
+        "median_seconds": statistics.median(seconds),
+        "peak_traced_mb": traced_peak / 1024 ** 2,
+        "peak_rss_mb": (rss_peak - rss_before) / 1024 if peak_reset and rss_before is not None else None,
+        "max_rss_mb": _max_rss_mb(),
+    }
+
+
+def run_case(name, size, dtype, repeat=3, timeout=None):
+    """Run one case in a fresh interpreter; failures are recorded, not raised."""
+    ensure_scene(size, dtype)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(ROOT_DIR), env.get("PYTHONPATH")]))
+    # A fixed glibc mmap threshold hands freed arrays back to the OS, so a
+    # call's peak RSS is not hidden by heap memory left over from the warm-up
+    env.setdefault("MALLOC_MMAP_THRESHOLD_", str(1024 ** 2))
+    with tempfile.TemporaryDirectory() as tmp:
+        result_path = Path(tmp) / "result.json"
+        command = [sys.executable, str(Path(__file__).resolve()), "--child", name, str(size), dtype,
+                   "--repeat", str(repeat), "--child-output", str(result_path)]
+        try:
+            completed = subprocess.run(command, env=env, cwd=ROOT_DIR, capture_output=True, text=True,
+                                       timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return {"name": name, "size": size, "dtype": dtype, "error": f"timed out after {timeout}s"}
+        if completed.returncode != 0 or not result_path.exists():
+            error = (completed.stderr.strip().splitlines() or ["exit code %d" % completed.returncode])[-1]
+            return {"name": name, "size": size, "dtype": dtype, "error": error}
+        return json.loads(result_path.read_text())
+
+
+def case_key(result):
+    return f"{result['name']}/{result['size']}/{result['dtype']}"
+
+
+def machine_info():
+    import cv2
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+    }
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare results against a baseline report.
+    Returns (rows, regressions); a case regresses when its best time or
+    peak memory grows by more than `threshold` (a fraction).
+    """
+    previous = {case_key(result): result for result in baseline.get("results", []) if "error" not in result}
+    rows, regressions = [], []
+    for result in results:
+        old = previous.get(case_key(result))
+        if old is None or "error" in result:
+            continue
+        for metric in ("min_seconds", "peak_rss_mb", "peak_traced_mb"):
+            before, after = old.get(metric), result.get(metric)
+            if before is None or after is None:
+                continue
+            if metric == "min_seconds" and before < MIN_SECONDS:
+                continue
+            if metric != "min_seconds" and before < 1:
+                continue
+            change = after / before - 1
+            row = (case_key(result), metric, before, after, change)
+            rows.append(row)
+            if change > threshold:
+                regressions.append(row)
+    return rows, regressions
+
+
+def print_results(results):
+    print(f"{'case':52s} {'min s':>9s} {'median s':>9s} {'first s':>9s} {'rss MB':>9s} "
+          f"{'traced MB':>10s}")
+    for result in results:
+        if "error" in result:
+            print(f"{case_key(result):52s} ERROR: {result['error']}")
+            continue
+        rss = result["peak_rss_mb"] if result["peak_rss_mb"] is not None else float("nan")
+        print(f"{case_key(result):52s} {result['min_seconds']:9.4f} {result['median_seconds']:9.4f} "
+              f"{result['first_seconds']:9.4f} {rss:9.1f} {result['peak_traced_mb']:10.1f}")
+
+
+def print_comparison(rows, threshold):
+    print(f"\nBaseline comparison (regression threshold {threshold:.0%}):")
+    for key, metric, before, after, change in rows:
+        flag = "  REGRESSION" if change > threshold else ""
+        print(f"  {key:52s} {metric:15s} {before:10.4f} -> {after:10.4f} ({change:+.1%}){flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the hot paths on synthetic scenes and compare to a baseline.")
+    parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS), metavar="NAME",
+                        help="Benchmarks to run (default: all)")
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="1k, 4k, 10k or pixel counts")
+    parser.add_argument("--dtypes", nargs="+", default=["uint8", "uint16"])
+    parser.add_argument("--repeat", type=int, default=3, help="Timed calls per case (after a warm-up call)")
+    parser.add_argument("--no-limits", action="store_true", help="Also run cases above their max_size")
+    parser.add_argument("--timeout", type=float, default=None, help="Seconds before a case is abandoned")
+    parser.add_argument("--output", help="Results JSON (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--baseline", default=str(BASELINE), help="Baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed slowdown/memory growth as a fraction (default: 0.10)")
+    parser.add_argument("--save-baseline", action="store_true", help="Also write the results as the new baseline")
+    parser.add_argument("--list", action="store_true", help="List the benchmarks and exit")
+    parser.add_argument("--child", nargs=3, metavar=("NAME", "SIZE", "DTYPE"), help=argparse.SUPPRESS)
+    parser.add_argument("--child-output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        name, size, dtype = args.child
+        result = measure(name, int(size), dtype, args.repeat)
+        Path(args.child_output).write_text(json.dumps(result))
+        return
+
+    if args.list:
+        for name, factory in BENCHMARKS.items():
+            benchmark = factory()
+            limit = f"up to {benchmark.max_size}px" if benchmark.max_size else "all sizes"
+            print(f"{name:34s} {', '.join(benchmark.dtypes):14s} {limit}")
+        return
+
+    sizes = [SIZES.get(size) or int(size) for size in args.sizes]
+    results = []
+    for name in args.benchmarks or BENCHMARKS:
+        benchmark = BENCHMARKS[name]()
+        for size in sizes:
+            if benchmark.max_size and size > benchmark.max_size and not args.no_limits:
+                print(f"[INFO] Skipping {name} at {size}px (above {benchmark.max_size}px, see --no-limits)")
+                continue
+            for dtype in args.dtypes:
+                if dtype not in benchmark.dtypes:
+                    continue
+                print(f"[INFO] Running {name} on {size}px {dtype}")
+                results.append(run_case(name, size, dtype, args.repeat, args.timeout))
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "machine": machine_info(),
+        "results": results,
+    }
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{datetime.now():%Y%m%d_%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print_results(results)
+    print(f"\nResults saved as: {output}")
+
+    regressions = []
+    baseline_path = Path(args.baseline)
+    if baseline_path.exists() and not args.save_baseline:
+        baseline = json.loads(baseline_path.read_text())
+        if baseline.get("machine") != report["machine"]:
+            print("[WARN] Baseline was recorded on a different machine or library versions.")
+        rows, regressions = compare(results, baseline, args.threshold)
+        print_comparison(rows, args.threshold)
+        print(f"{len(regressions)} regression(s) against {baseline_path}")
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(report, indent=2))
+        print(f"Baseline saved as: {baseline_path}")
+
+    if regressions or any("error" in result for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
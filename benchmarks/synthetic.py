@@ -0,0 +1,110 @@
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from utils.cog_writer import write_cog
+
+DATA_DIR = Path(__file__).resolve().parent / "data"
+SIZES = {"1k": 1024, "4k": 4096, "10k": 10240}
+
+# 8-bit RGB colours of the patch types (scaled up for uint16 scenes)
+BACKGROUND = (70, 95, 60)      # vegetation
+FIRE = (250, 70, 20)           # flames: red dominates green and blue
+DROUGHT = (200, 150, 60)       # dry soil: brown/yellow hue, bright
+DARK = (25, 22, 20)            # burn scars / water
+BRIGHT = (245, 245, 240)       # bright surfaces (carbon detector threshold)
+
+BLOCK_ROWS = 1024
+
+
+def _add_patches(labels, coverage, label, rng, max_radius):
+    """Paint random discs of `label` until about `coverage` of the scene is covered."""
+    if coverage <= 0:
+        return
+    size = labels.shape[0]
+    target = coverage * labels.size
+    painted = 0
+    while painted < target:
+        radius = int(rng.integers(max(max_radius // 8, 2), max_radius + 1))
+        row, col = rng.integers(0, size, 2)
+        r0, r1 = max(row - radius, 0), min(row + radius + 1, size)
+        c0, c1 = max(col - radius, 0), min(col + radius + 1, labels.shape[1])
+        rows, cols = np.ogrid[r0:r1, c0:c1]
+        disc = (rows - row) ** 2 + (cols - col) ** 2 <= radius ** 2
+        labels[r0:r1, c0:c1][disc] = label
+        painted += disc.sum()
+
+
+def scene_labels(size, fire=0.01, drought=0.05, dark=0.05, bright=0.02, seed=0):
+    """(size, size) uint8 patch labels: 0 background, 1 fire, 2 drought, 3 dark, 4 bright."""
+    rng = np.random.default_rng(seed)
+    labels = np.zeros((size, size), dtype=np.uint8)
+    max_radius = max(size // 40, 4)
+    for label, coverage in enumerate((fire, drought, dark, bright), start=1):
+        _add_patches(labels, coverage, label, rng, max_radius)
+    return labels
+
+
+def synthetic_scene(size, dtype=np.uint8, fire=0.01, drought=0.05, dark=0.05, bright=0.02, noise=12, seed=0):
+    """A (size, size, 3) RGB scene of noisy vegetation with fire, drought, dark and bright patches.
+
+    Coverages are fractions of the scene area. uint16 scenes hold the same
+    content scaled to the full 16-bit range.
+    """
+    dtype = np.dtype(dtype)
+    labels = scene_labels(size, fire, drought, dark, bright, seed)
+    palette = np.array([BACKGROUND, FIRE, DROUGHT, DARK, BRIGHT], dtype=np.int16)
+    scale = 257 if dtype == np.uint16 else 1
+    rng = np.random.default_rng(seed + 1)
+    image = np.empty((size, size, 3), dtype=dtype)
+    for row in range(0, size, BLOCK_ROWS):
+        block = palette[labels[row:row + BLOCK_ROWS]]
+        block = block + rng.integers(-noise, noise + 1, block.shape, dtype=np.int16)
+        image[row:row + BLOCK_ROWS] = np.clip(block, 0, 255).astype(np.uint16) * scale
+    return image
+
+
+def scene_path(size, dtype=np.uint8, data_dir=DATA_DIR):
+    return Path(data_dir) / f"scene_{size}_{np.dtype(dtype).name}.tiff"
+
+
+def write_synthetic_cog(path, size, dtype=np.uint8, **patches):
+    """Write a synthetic scene as a tiled, compressed COG (as the real TCI assets are)."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    write_cog(path, synthetic_scene(size, dtype, **patches))
+    return path
+
+
+def ensure_scene(size, dtype=np.uint8, data_dir=DATA_DIR):
+    """Path of the synthetic scene for (size, dtype), generating it on first use."""
+    path = scene_path(size, dtype, data_dir)
+    if not path.exists():
+        print(f"[INFO] Generating {path.name}")
+        write_synthetic_cog(path, size, dtype)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic tiled TIFF scenes for the benchmarks.")
+    parser.add_argument("--sizes", nargs="+", default=list(SIZES), help="1k, 4k, 10k or pixel counts")
+    parser.add_argument("--dtypes", nargs="+", default=["uint8", "uint16"])
+    parser.add_argument("--fire", type=float, default=0.01, help="Fraction of the scene covered by fire")
+    parser.add_argument("--drought", type=float, default=0.05)
+    parser.add_argument("--dark", type=float, default=0.05)
+    parser.add_argument("--bright", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output-dir", default=str(DATA_DIR))
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        pixels = SIZES.get(size) or int(size)
+        for dtype in args.dtypes:
+            path = scene_path(pixels, dtype, args.output_dir)
+            write_synthetic_cog(path, pixels, dtype, fire=args.fire, drought=args.drought,
+                                dark=args.dark, bright=args.bright, seed=args.seed)
+            print(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
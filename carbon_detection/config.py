@@ -1,6 +1,8 @@
 import os
 from pathlib import Path
 
+from utils.stage_cache import CACHE_DEFAULTS
+
 # Directory paths
 BASE_DIR = Path(__file__).parent
 FIGURES_DIR = BASE_DIR.parent / "figures"
@@ -20,5 +22,9 @@ CARBON_DETECTION = {
     "threshold": 0.7,         # Classification threshold
     "min_area": 100,          # Minimum area for carbon detection (pixels)
     "n_clusters": 2,          # Number of clusters for K-means
+    "clustering_method": "histogram",  # "histogram" (exact 1-D, per-bin) or "kmeans" (per-pixel); labels ordered by centre
     "heatmap_colormap": "YlOrBr"  # Colormap for heatmap visualization
-}
\ No newline at end of file
+}
+
+# Stage cache (defaults in utils/stage_cache.py; override keys here)
+CACHE_PARAMS = dict(CACHE_DEFAULTS)
\ No newline at end of file
@@ -1,20 +1,26 @@
 import os
-import numpy as np
 from pathlib import Path
 from config import *
-from utils.carbon_detection import (
-    load_image,
-    save_image,
-    process_image,
-    create_carbon_heatmap
-)
-from utils.load_project_data import load_project_data
+from utils.worker_service import print_result, run_remote
 
-def main():
-    # Load project data from API
-    project_data = load_project_data()
-    if project_data is not None:
-        print("[INFO] Project data loaded from project_data.json. Keys:", list(project_data.keys()))
+def run_local():
+    # Detector imports are deferred so the worker service client path stays light
+    import numpy as np
+    from utils.carbon_detection import (
+        load_image,
+        save_image,
+        process_image,
+        create_carbon_heatmap
+    )
+    from utils.cog_writer import read_georef
+    from utils.stac_catalog import open_catalog
+    from utils.stage_cache import StageCache
+
+    # Open the local STAC catalog built from project_data.json
+    with open_catalog() as catalog:
+        feature_count = catalog.count()
+    if feature_count:
+        print(f"[INFO] STAC catalog loaded from project_data.json: {feature_count} features")
     else:
         print("[WARN] Project data not available. Proceeding without API data.")
 
@@ -29,15 +35,18 @@ def main():
     input_path = FIGURES_DIR / INPUT_IMAGE
     print(f"Loading enhanced image from {input_path}")
     image = load_image(input_path)
+    georef = read_georef(input_path)
+    cache = StageCache(**CACHE_PARAMS)
+    image_key = cache.file_key(input_path) if cache.enabled else None
     
     # Process image for carbon detection
     print("Processing image for carbon detection...")
-    classified, mask, image_norm, original_image = process_image(image, CARBON_DETECTION)
+    classified, mask, image_norm, original_image = process_image(image, CARBON_DETECTION, cache, image_key)
     
     # Save carbon mask
     output_path = FIGURES_DIR / CARBON_MASK
     print(f"Saving carbon mask to {output_path}")
-    save_image(classified, output_path)
+    save_image(classified, output_path, georef)
     
     # Create and save carbon heatmap (similar to drought severity heatmap)
     heatmap_path = png_dir / "carbon_heatmap.png"
@@ -47,7 +56,7 @@ def main():
     # Save raw mask for visualization
     mask_path = png_dir / "carbon_mask.png"
     print(f"Saving carbon mask to {mask_path}")
-    save_image(mask, mask_path)
+    save_image(mask, mask_path, georef)
     
     # Calculate carbon coverage statistics
     carbon_pixels = np.sum(mask > 0)
@@ -58,6 +67,25 @@ def main():
     print(f"Carbon coverage: {carbon_percentage:.2f}% of the image")
     print(f"Carbon mask saved to {output_path}")
     print(f"Carbon heatmap saved to {heatmap_path}")
+    cache.report()
+
+def main():
+    # Hand the job to the warm worker service if one is running
+    # (PYTHONPATH=. python utils/worker_service.py serve), otherwise process here
+    input_path = FIGURES_DIR / INPUT_IMAGE
+    record = None
+    if input_path.exists():
+        record = run_remote({
+            "enhanced": str(input_path.resolve()),
+            "outputs": ["carbon_mask", "carbon_heatmap", "carbon_raw_mask"],
+            "params": {"carbon": CARBON_DETECTION},
+            "output_dir": str(FIGURES_DIR.resolve())
+        })
+    if record is None:
+        run_local()
+        return
+    print("Carbon detection complete!")
+    print_result(record)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,17 +1,39 @@
+import tempfile
 import numpy as np
-from skimage import measure
 from sklearn.cluster import KMeans
 import tifffile
-import matplotlib.pyplot as plt
 import cv2
+from utils.cog_reader import read_image
+from utils.colormap import render_heatmap
+from utils.cog_writer import write_cog
+from utils.instrumentation import instrument
+from utils.stage_cache import StageCache, code_version
+from . import histogram_clustering, region_engine
+from .histogram_clustering import HistogramAccumulator, has_exact_bins, histogram_kmeans
+from .region_engine import filter_regions, filter_regions_tiled
+
+# Memory-mapped images (the upscaled scene does not fit in RAM) are
+# processed in blocks of this many rows into memory-mapped results
+BLOCK_ROWS = 1024
+
+def _row_blocks(image):
+    for row in range(0, image.shape[0], BLOCK_ROWS):
+        yield slice(row, row + BLOCK_ROWS)
+
+def _disk_array(shape, dtype):
+    """Scratch array backed by an anonymous temporary file."""
+    return np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode='w+', shape=shape)
 
 def load_image(image_path):
-    """Load image using tifffile for TIFF images."""
-    return tifffile.imread(image_path)
+    """Load image through the shared COG reader."""
+    return read_image(image_path)
 
-def save_image(image, output_path):
-    """Save image using tifffile for TIFF images."""
-    tifffile.imwrite(output_path, image)
+def save_image(image, output_path, georef=None):
+    """Save TIFFs as tiled, compressed COGs (nearest overviews for label images)."""
+    if str(output_path).lower().endswith(('.tif', '.tiff')):
+        write_cog(output_path, image, resampling='nearest', georef=georef)
+    else:
+        tifffile.imwrite(output_path, image)
 
 def extract_spectral_features(image, spectral_bands):
     """Extract spectral features from the image."""
@@ -35,34 +57,82 @@ def extract_spectral_features(image, spectral_bands):
     
     return np.array(features)
 
-def detect_carbon_regions(image, threshold=0.5, min_area=50):
-    """Detect carbon-rich regions in the image."""
+def _normalize_blocks(image):
+    """normalize_image of a memory-mapped image, block by block, with the same values."""
+    if image.ndim == 3:
+        mean = _disk_array(image.shape[:2], np.mean(image[:1], axis=2).dtype)
+        for block in _row_blocks(image):
+            mean[block] = np.mean(image[block], axis=2)
+        image = mean
+    low = min(np.min(image[block]) for block in _row_blocks(image))
+    high = max(np.max(image[block]) for block in _row_blocks(image))
+    out = _disk_array(image.shape, ((image[:1] - low) / (high - low)).dtype)
+    for block in _row_blocks(image):
+        out[block] = (image[block] - low) / (high - low)
+    return out
+
+def normalize_image(image):
+    """Average the channels and stretch the image to the 0-1 range."""
+    if isinstance(image, np.memmap):
+        return _normalize_blocks(image)
     # Convert image to appropriate format if needed
     if len(image.shape) == 3:
         image = np.mean(image, axis=2)
     
     # Normalize image
-    image_norm = (image - np.min(image)) / (np.max(image) - np.min(image))
+    return (image - np.min(image)) / (np.max(image) - np.min(image))
+
+def threshold_regions(image_norm, threshold=0.5, min_area=50):
+    """Threshold the normalized image and keep regions of at least min_area pixels."""
+    if isinstance(image_norm, np.memmap):
+        # Label tile by tile (merged across seams) into a memory-mapped mask
+        def read_tile(row, col, height, width):
+            return image_norm[row:row + height, col:col + width] > threshold, None
+        out = _disk_array(image_norm.shape, np.uint8)
+        return filter_regions_tiled(read_tile, image_norm.shape, min_area=min_area, out=out)[0]
     
     # Apply threshold
     binary = image_norm > threshold
     
-    # Find connected components
-    labels = measure.label(binary)
-    
-    # Filter regions by area
-    regions = measure.regionprops(labels)
-    valid_regions = [r for r in regions if r.area >= min_area]
-    
-    # Create mask
-    mask = np.zeros_like(image, dtype=np.uint8)
-    for region in valid_regions:
-        mask[labels == region.label] = 255
+    return filter_regions(binary, min_area=min_area)
+
+def detect_carbon_regions(image, threshold=0.5, min_area=50):
+    """Detect carbon-rich regions in the image."""
+    image_norm = normalize_image(image)
+    mask = threshold_regions(image_norm, threshold, min_area)
     
     return mask, image_norm  # Return normalized image for heatmap
 
-def classify_carbon_regions(image, n_clusters=3):
-    """Classify regions using K-means clustering."""
+def _histogram_kmeans_blocks(image, n_clusters):
+    """histogram_kmeans of a memory-mapped image: accumulate, fit and label block by block."""
+    value_range = None
+    if not has_exact_bins(image.dtype):
+        value_range = (float(min(image[block].min() for block in _row_blocks(image))),
+                       float(max(image[block].max() for block in _row_blocks(image))))
+    accumulator = HistogramAccumulator(image.dtype, value_range)
+    for block in _row_blocks(image):
+        accumulator.update(image[block])
+    clusters = accumulator.fit(n_clusters)
+    labels = _disk_array(image.shape, clusters.lut.dtype)
+    for block in _row_blocks(image):
+        labels[block] = clusters.apply(image[block])
+    return labels
+
+def classify_carbon_regions(image, n_clusters=3, method='histogram'):
+    """
+    Classify regions by clustering pixel values.
+    'histogram' runs exact 1-D k-means on the value histogram and labels pixels
+    through a lookup table; 'kmeans' fits sklearn KMeans on every pixel.
+    Either way label 0 is the cluster with the lowest centre, 1 the next and
+    so on, so saved class masks mean the same for both methods.
+    """
+    if method == 'histogram':
+        if isinstance(image, np.memmap):
+            return _histogram_kmeans_blocks(image, n_clusters)
+        return histogram_kmeans(image, n_clusters=n_clusters)
+    elif method != 'kmeans':
+        raise ValueError(f"Unknown clustering method: {method}")
+    
     # Reshape image for clustering
     h, w = image.shape[:2]
     X = image.reshape(-1, 1)
@@ -71,9 +141,14 @@ def classify_carbon_regions(image, n_clusters=3):
     kmeans = KMeans(n_clusters=n_clusters, random_state=42)
     labels = kmeans.fit_predict(X)
     
+    # Number clusters by centre, as the histogram method does
+    rank = np.empty(n_clusters, dtype=labels.dtype)
+    rank[np.argsort(kmeans.cluster_centers_[:, 0])] = np.arange(n_clusters)
+    
     # Reshape back to image
-    return labels.reshape(h, w)
+    return rank[labels].reshape(h, w)
 
+@instrument('carbon.heatmap')
 def create_carbon_heatmap(image_norm, mask, output_path, colormap='YlOrBr'):
     """
     Create a standalone heatmap visualization of carbon regions,
@@ -81,37 +156,57 @@ def create_carbon_heatmap(image_norm, mask, output_path, colormap='YlOrBr'):
     """
     # Create a heatmap where the intensity is based on the normalized image values
     # but only in regions where the mask is positive
-    heatmap_data = np.zeros_like(image_norm)
-    heatmap_data[mask > 0] = image_norm[mask > 0]
-    
-    # Create the heatmap visualization
-    plt.figure(figsize=(10, 8))
-    plt.imshow(heatmap_data, cmap=colormap)
-    plt.colorbar(label='Carbon Intensity')
-    plt.title('Carbon Concentration Heatmap')
-    plt.axis('off')  # Hide axes for cleaner visualization
-    plt.tight_layout()
-    plt.savefig(output_path, dpi=300, bbox_inches='tight')
-    plt.close()
+    if isinstance(image_norm, np.memmap):
+        heatmap_data = _disk_array(image_norm.shape, image_norm.dtype)
+        for block in _row_blocks(image_norm):
+            heatmap_data[block] = np.where(mask[block] > 0, image_norm[block], 0)
+    else:
+        heatmap_data = np.zeros_like(image_norm)
+        heatmap_data[mask > 0] = image_norm[mask > 0]
+    
+    # Render the heatmap at full resolution through the colormap LUT,
+    # with the colour bar written next to it
+    render_heatmap(heatmap_data, output_path, colormap, legend_label='Carbon Intensity')
     
     return heatmap_data
 
-def process_image(image, params):
-    """Complete carbon detection pipeline."""
-    # Extract spectral features
-    features = extract_spectral_features(image, params['spectral_bands'])
+@instrument('carbon.detect')
+def process_image(image, params, cache=None, image_key=None):
+    """
+    Complete carbon detection pipeline.
+    With a StageCache and the key of the input image, the normalized image,
+    the region mask and the classes are reused while their inputs and
+    parameters are unchanged (a threshold sweep only reruns the last two).
+    """
+    if cache is None or image_key is None:
+        cache = StageCache(enabled=False)
+    
+    # Normalize the image
+    image_norm, norm_key = cache.run(
+        'carbon_normalize',
+        lambda: normalize_image(image),
+        inputs=[image_key],
+        version=code_version(normalize_image, _normalize_blocks)
+    )
     
     # Detect carbon regions
-    mask, image_norm = detect_carbon_regions(
-        image,
-        threshold=params['threshold'],
-        min_area=params['min_area']
+    region_params = {'threshold': params['threshold'], 'min_area': params['min_area']}
+    mask, mask_key = cache.run(
+        'carbon_regions',
+        lambda: threshold_regions(image_norm, **region_params),
+        inputs=[norm_key],
+        params=region_params,
+        version=code_version(threshold_regions, region_engine)
     )
     
     # Classify regions
-    classified = classify_carbon_regions(
-        mask,
-        n_clusters=params['n_clusters']
+    class_params = {'n_clusters': params['n_clusters'], 'method': params.get('clustering_method', 'histogram')}
+    classified, _ = cache.run(
+        'carbon_classes',
+        lambda: classify_carbon_regions(mask, **class_params),
+        inputs=[mask_key],
+        params=class_params,
+        version=code_version(classify_carbon_regions, histogram_clustering)
     )
     
     return classified, mask, image_norm, image  # Return original image too
\ No newline at end of file
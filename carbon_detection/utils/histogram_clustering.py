@@ -0,0 +1,152 @@
+import numpy as np
+
+def has_exact_bins(dtype):
+    """True for dtypes histogrammed with one bin per possible value."""
+    dtype = np.dtype(dtype)
+    return dtype == np.bool_ or (np.issubdtype(dtype, np.integer) and dtype.itemsize <= 2)
+
+def _bin_layout(dtype, value_range=None, bins=4096):
+    """Return (offset, bin width, number of bins) used to histogram a dtype."""
+    dtype = np.dtype(dtype)
+    if dtype == np.bool_:
+        return 0, 1, 2
+    if has_exact_bins(dtype):
+        info = np.iinfo(dtype)
+        return int(info.min), 1, int(info.max) - int(info.min) + 1
+    if value_range is None:
+        raise ValueError("value_range is required to histogram float or wide integer data")
+    low, high = value_range
+    return low, (high - low) / bins if high > low else 1.0, bins
+
+class HistogramAccumulator:
+    """
+    Accumulate the value histogram of an image tile by tile.
+    8/16-bit and boolean inputs use one exact bin per value; other dtypes
+    need a value_range and are quantised into `bins` equal-width bins.
+    """
+    def __init__(self, dtype, value_range=None, bins=4096):
+        self.dtype = np.dtype(dtype)
+        self.exact = has_exact_bins(self.dtype)
+        self.offset, self.width, self.bins = _bin_layout(self.dtype, value_range, bins)
+        self.counts = np.zeros(self.bins, dtype=np.int64)
+
+    def bin_index(self, tile):
+        """Map pixel values to histogram bin indices."""
+        if self.exact:
+            if self.dtype == np.bool_:
+                return tile.view(np.uint8)
+            if self.offset == 0:
+                return tile
+            return tile.astype(np.int32) - self.offset
+        index = ((tile - self.offset) / self.width).astype(np.int64)
+        return np.clip(index, 0, self.bins - 1)
+
+    def update(self, tile):
+        """Add a tile to the histogram."""
+        index = self.bin_index(np.asarray(tile)).ravel()
+        self.counts += np.bincount(index, minlength=self.bins)[:self.bins]
+        return self
+
+    def bin_values(self):
+        """Representative value of each bin (the value itself for exact bins)."""
+        if self.exact:
+            return self.offset + np.arange(self.bins, dtype=np.float64)
+        return self.offset + (np.arange(self.bins) + 0.5) * self.width
+
+    def fit(self, n_clusters):
+        """Cluster the accumulated histogram; returns a ClusterLUT."""
+        return ClusterLUT.fit(self, n_clusters)
+
+def _segment_costs(prefix_w, prefix_s, prefix_q, starts, end):
+    """Within-cluster sum of squares of bins [start, end) for many starts."""
+    w = prefix_w[end] - prefix_w[starts]
+    s = prefix_s[end] - prefix_s[starts]
+    q = prefix_q[end] - prefix_q[starts]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cost = q - np.where(w > 0, s * s / w, 0)
+    return np.maximum(cost, 0)
+
+def optimal_kmeans_1d(values, weights, n_clusters):
+    """
+    Globally optimal 1-D k-means over weighted, sorted values (dynamic programming
+    with divide-and-conquer optimisation, O(k * B log B) for B bins).
+    Returns (cluster index per value, cluster centres), clusters ordered by centre.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    n_bins = len(values)
+    n_clusters = max(1, min(n_clusters, n_bins))
+
+    # Centre the values to keep the prefix sums well conditioned
+    mean = np.average(values, weights=weights)
+    centred = values - mean
+    prefix_w = np.concatenate([[0.0], np.cumsum(weights)])
+    prefix_s = np.concatenate([[0.0], np.cumsum(weights * centred)])
+    prefix_q = np.concatenate([[0.0], np.cumsum(weights * centred * centred)])
+
+    # cost[i] = best cost of splitting the first i bins into the current number of clusters
+    cost = _segment_costs(prefix_w, prefix_s, prefix_q, np.zeros(n_bins + 1, dtype=np.int64), np.arange(n_bins + 1))
+    splits = np.zeros((n_clusters, n_bins + 1), dtype=np.int64)
+    for k in range(1, n_clusters):
+        new_cost = np.full(n_bins + 1, np.inf)
+        stack = [(k + 1, n_bins, k, n_bins - 1)]
+        while stack:
+            lo, hi, opt_lo, opt_hi = stack.pop()
+            if lo > hi:
+                continue
+            mid = (lo + hi) // 2
+            starts = np.arange(opt_lo, min(mid - 1, opt_hi) + 1)
+            candidates = cost[starts] + _segment_costs(prefix_w, prefix_s, prefix_q, starts, mid)
+            best = int(np.argmin(candidates))
+            new_cost[mid] = candidates[best]
+            splits[k, mid] = starts[best]
+            stack.append((lo, mid - 1, opt_lo, starts[best]))
+            stack.append((mid + 1, hi, starts[best], opt_hi))
+        cost = new_cost
+
+    # Backtrack the cluster boundaries
+    assignment = np.empty(n_bins, dtype=np.int32)
+    end = n_bins
+    for k in range(n_clusters - 1, -1, -1):
+        start = splits[k, end] if k > 0 else 0
+        assignment[start:end] = k
+        end = start
+
+    centres = np.array([
+        np.average(values[assignment == k], weights=weights[assignment == k])
+        if weights[assignment == k].sum() > 0 else values[assignment == k].mean()
+        for k in range(n_clusters)
+    ])
+    return assignment, centres
+
+class ClusterLUT:
+    """Per-bin cluster labels, applied to images by table lookup."""
+    def __init__(self, accumulator, lut, centres):
+        self.accumulator = accumulator
+        self.lut = lut
+        self.centres = centres
+
+    @classmethod
+    def fit(cls, accumulator, n_clusters):
+        occupied = np.flatnonzero(accumulator.counts)
+        values = accumulator.bin_values()[occupied]
+        assignment, centres = optimal_kmeans_1d(values, accumulator.counts[occupied], n_clusters)
+
+        # Empty bins take the nearest centre, like KMeans.predict would
+        midpoints = (centres[1:] + centres[:-1]) / 2
+        lut = np.searchsorted(midpoints, accumulator.bin_values()).astype(np.int32)
+        lut[occupied] = assignment
+        return cls(accumulator, lut, centres)
+
+    def apply(self, tile):
+        """Label a tile (or whole image) through the lookup table."""
+        return self.lut[self.accumulator.bin_index(np.asarray(tile))]
+
+def histogram_kmeans(image, n_clusters=3, bins=4096):
+    """Cluster the pixel values of an image on its histogram; returns labels ordered by centre."""
+    image = np.asarray(image)
+    value_range = None
+    if not has_exact_bins(image.dtype):
+        value_range = (float(image.min()), float(image.max()))
+    accumulator = HistogramAccumulator(image.dtype, value_range, bins).update(image)
+    return accumulator.fit(n_clusters).apply(image)
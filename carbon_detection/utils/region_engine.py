@@ -0,0 +1,178 @@
+import numpy as np
+from scipy import ndimage
+from skimage import measure
+
+def region_stats(labels, num_labels, intensity=None):
+    """
+    Per-label statistics computed with bincount-style reductions.
+    Returns a dict of arrays indexed by label - 1: area, bbox
+    (min_row, min_col, max_row, max_col; max exclusive) and mean_intensity.
+    """
+    flat = labels.ravel()
+    area = np.bincount(flat, minlength=num_labels + 1)[1:]
+    bbox = np.zeros((num_labels, 4), dtype=np.int64)
+    for index, slices in enumerate(ndimage.find_objects(labels, max_label=num_labels)):
+        if slices is not None:
+            bbox[index] = (slices[0].start, slices[1].start, slices[0].stop, slices[1].stop)
+    stats = {"area": area, "bbox": bbox}
+    if intensity is not None:
+        sums = np.bincount(flat, weights=intensity.ravel(), minlength=num_labels + 1)[1:]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            stats["mean_intensity"] = np.where(area > 0, sums / area, 0.0)
+    return stats
+
+def filter_regions(binary, min_area=50, intensity=None, return_stats=False):
+    """
+    Keep connected components of at least min_area pixels as a 0/255 mask,
+    in one labelling pass plus a lookup-table gather.
+    """
+    labels, num_labels = measure.label(binary, return_num=True)
+    areas = np.bincount(labels.ravel(), minlength=num_labels + 1)
+    keep = areas >= min_area
+    keep[0] = False
+    lut = np.where(keep, 255, 0).astype(np.uint8)
+    mask = lut[labels]
+    if not return_stats:
+        return mask
+    stats = region_stats(labels, num_labels, intensity)
+    kept = keep[1:]
+    return mask, {name: values[kept] for name, values in stats.items()}
+
+class UnionFind:
+    """Growable union-find over integer ids."""
+    def __init__(self):
+        self.parent = np.zeros(1, dtype=np.int64)
+
+    def grow(self, size):
+        if size > len(self.parent):
+            self.parent = np.concatenate([self.parent, np.arange(len(self.parent), size, dtype=np.int64)])
+
+    def find(self, item):
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union_pairs(self, a, b):
+        for x, y in set(zip(a.tolist(), b.tolist())):
+            root_x, root_y = self.find(x), self.find(y)
+            if root_x != root_y:
+                self.parent[max(root_x, root_y)] = min(root_x, root_y)
+
+    def roots(self):
+        """Fully compressed root of every id."""
+        parent = self.parent.copy()
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                return parent
+            parent = grand
+
+def _seam_pairs(first, second):
+    """Label pairs connected (8-connectivity) across a seam between two border lines."""
+    pairs_a, pairs_b = [], []
+    for shift in (-1, 0, 1):
+        if shift < 0:
+            a, b = first[:shift], second[-shift:]
+        elif shift > 0:
+            a, b = first[shift:], second[:-shift]
+        else:
+            a, b = first, second
+        both = (a > 0) & (b > 0)
+        pairs_a.append(a[both])
+        pairs_b.append(b[both])
+    return np.concatenate(pairs_a), np.concatenate(pairs_b)
+
+def _tile_grid(shape, tile_size):
+    height, width = shape
+    for row in range(0, height, tile_size):
+        for col in range(0, width, tile_size):
+            yield row, col, min(tile_size, height - row), min(tile_size, width - col)
+
+def filter_regions_tiled(read_tile, shape, min_area=50, tile_size=1024, out=None):
+    """
+    Out-of-core version of filter_regions.
+
+    read_tile(row, col, height, width) must return (binary, intensity) for the
+    window, intensity may be None. Tiles are labelled independently, components
+    touching across tile borders are merged with union-find, and a second pass
+    re-labels each tile and writes the filtered 0/255 mask into `out` (which
+    may be a np.memmap). Returns (mask, stats) with stats for the kept regions.
+    """
+    height, width = shape
+    if out is None:
+        out = np.zeros(shape, dtype=np.uint8)
+    forest = UnionFind()
+    areas, sums, bboxes = [], [], []
+    offsets = {}
+    next_id = 1
+    bottom_rows = np.zeros(width, dtype=np.int64)  # labels of the last row of the previous tile row
+    current_bottom = np.zeros(width, dtype=np.int64)
+    has_intensity = False
+
+    # Pass 1: label tiles, collect per-label stats and merge across seams
+    previous_right = None
+    for row, col, tile_h, tile_w in _tile_grid(shape, tile_size):
+        binary, intensity = read_tile(row, col, tile_h, tile_w)
+        labels, num_labels = measure.label(binary, return_num=True)
+        offsets[(row, col)] = next_id - 1
+        stats = region_stats(labels, num_labels, intensity)
+        has_intensity = intensity is not None
+        areas.append(stats["area"])
+        sums.append(stats["area"] * stats["mean_intensity"] if has_intensity else np.zeros(num_labels))
+        bboxes.append(stats["bbox"] + [row, col, row, col])
+
+        global_labels = np.where(labels > 0, labels + (next_id - 1), 0)
+        forest.grow(next_id + num_labels)
+        next_id += num_labels
+
+        if row > 0:
+            forest.union_pairs(*_seam_pairs(bottom_rows[col:col + tile_w], global_labels[0]))
+            # Diagonal neighbours across the column seam on the row seam
+            if col > 0 and bottom_rows[col - 1] > 0 and global_labels[0, 0] > 0:
+                forest.union_pairs(bottom_rows[col - 1:col], global_labels[0, :1])
+            if col + tile_w < width and bottom_rows[col + tile_w] > 0 and global_labels[0, -1] > 0:
+                forest.union_pairs(bottom_rows[col + tile_w:col + tile_w + 1], global_labels[0, -1:])
+        if col > 0 and previous_right is not None:
+            forest.union_pairs(*_seam_pairs(previous_right, global_labels[:, 0]))
+        previous_right = global_labels[:, -1]
+        current_bottom[col:col + tile_w] = global_labels[-1]
+        if col + tile_w >= width:
+            bottom_rows, current_bottom = current_bottom, bottom_rows
+            previous_right = None
+
+    # Resolve components and their statistics
+    roots = forest.roots()[:next_id]
+    area = np.concatenate([[0]] + areas).astype(np.int64)
+    total_area = np.bincount(roots, weights=area, minlength=next_id).astype(np.int64)
+    keep_root = total_area >= min_area
+    keep_root[0] = False
+    keep = keep_root[roots]
+
+    kept_roots = np.flatnonzero(keep_root)
+    bbox = np.concatenate([np.zeros((1, 4), dtype=np.int64)] + bboxes)
+    mins = np.full((next_id, 2), np.iinfo(np.int64).max)
+    maxs = np.full((next_id, 2), -1)
+    ids = np.arange(1, next_id)
+    np.minimum.at(mins, roots[ids], bbox[ids, :2])
+    np.maximum.at(maxs, roots[ids], bbox[ids, 2:])
+    region = {
+        "area": total_area[kept_roots],
+        "bbox": np.hstack([mins[kept_roots], maxs[kept_roots]]),
+    }
+    if has_intensity:
+        total_sum = np.bincount(roots, weights=np.concatenate([[0.0]] + sums), minlength=next_id)
+        region["mean_intensity"] = total_sum[kept_roots] / total_area[kept_roots]
+
+    # Pass 2: relabel each tile and write the filtered mask
+    lut = np.where(keep, 255, 0).astype(np.uint8)
+    for row, col, tile_h, tile_w in _tile_grid(shape, tile_size):
+        binary, _ = read_tile(row, col, tile_h, tile_w)
+        labels = measure.label(binary)
+        offset = offsets[(row, col)]
+        tile_lut = lut[offset:offset + labels.max() + 1].copy()
+        tile_lut[0] = 0
+        out[row:row + tile_h, col:col + tile_w] = tile_lut[labels]
+    return out, region
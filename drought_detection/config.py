@@ -1,6 +1,8 @@
 import os
 from pathlib import Path
 
+from utils.stage_cache import CACHE_DEFAULTS
+
 # Directory paths
 BASE_DIR = Path(__file__).parent
 FIGURES_DIR = BASE_DIR.parent / "figures"
@@ -10,18 +12,30 @@ INPUT_IMAGE = "TCI_COG.tiff"
 
 # Drought detection parameters
 DROUGHT_PARAMS = {
-    "ndvi_threshold": 0.3,       # Threshold for low vegetation (potential drought)
+    "ndvi_threshold": 0.3,       # Threshold for low vegetation (potential drought), true NDVI of band stacks
+    "ndre_threshold": 0.2,       # Same for NDRE (red edge saturates less in dense canopies)
+    "vegetation_index": "ndvi",  # Index of band stacks: "ndvi" (NIR, red) or "ndre" (NIR, red edge)
     "color_weight": 0.3,         # Weight for color-based detection
     "ndvi_weight": 0.7,          # Weight for NDVI-based detection
     "drought_threshold": 0.6,    # Threshold for classifying as drought
+    "kernel_size": 5,            # Morphological open/close kernel size
+    "cascade_margin": 0.17,      # Coarse-pass slack in cascade mode, as a fraction of the drought threshold
     "visualization_alpha": 0.6   # Transparency for visualization overlay
 }
 
-# If we had multispectral data, we would use these bands
-# But for RGB-only images, we'll use approximations
+# Stage cache (defaults in utils/stage_cache.py; override keys here)
+CACHE_PARAMS = dict(CACHE_DEFAULTS)
+
+# Channels of RGB (TCI) images, which only allow a pseudo-NDVI approximation
 BAND_INDICES = {
     "red": 0,
     "green": 1,
     "blue": 2,
-    # NIR would be here if available
+}
+
+# Band stack (utils/band_stack.py): single-band COG assets, by STAC common name or asset key
+SPECTRAL_BANDS = {
+    "red": "red",
+    "nir": "nir",
+    "rededge": "RE1",
 }
\ No newline at end of file
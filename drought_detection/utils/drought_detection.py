@@ -0,0 +1,157 @@
+import cv2
+import numpy as np
+from utils import spectral_lut
+from utils.instrumentation import instrument
+from utils.spectral_lut import drought_raw_mask, drought_visualization, supports_lut
+from utils.spectral_lut import drought_severity as calculate_drought_severity_lut
+from utils.stage_cache import StageCache, code_version
+
+def calculate_ndvi_approximation(image):
+    """
+    Calculate an approximation of NDVI using RGB channels.
+    This is a simplified approach since true NDVI requires NIR band.
+    """
+    # Extract channels
+    red_channel = image[:, :, 0].astype(float)
+    green_channel = image[:, :, 1].astype(float)
+    blue_channel = image[:, :, 2].astype(float)
+    
+    # Calculate pseudo-NDVI (using green as NIR approximation)
+    # True NDVI = (NIR - Red) / (NIR + Red)
+    # Pseudo-NDVI = (Green - Red) / (Green + Red)
+    epsilon = 1e-10  # Avoid division by zero
+    pseudo_ndvi = (green_channel - red_channel) / (green_channel + red_channel + epsilon)
+    
+    # Normalize to 0-1 range
+    pseudo_ndvi = (pseudo_ndvi + 1) / 2
+    
+    return pseudo_ndvi
+
+def normalized_difference(a, b):
+    """(a - b) / (a + b) as float32 in [-1, 1]; NaN where both are zero or either is NaN (nodata)."""
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    total = a + b
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(total != 0, (a - b) / total, np.float32(np.nan))
+
+def calculate_ndvi(nir, red):
+    """True NDVI = (NIR - Red) / (NIR + Red) from calibrated radiance."""
+    return normalized_difference(nir, red)
+
+def calculate_ndre(nir, rededge):
+    """Normalized difference red-edge index, more sensitive than NDVI in dense canopies."""
+    return normalized_difference(nir, rededge)
+
+def vegetation_drought_mask(index, threshold=0.3, kernel_size=5):
+    """Drought mask from a true vegetation index: sparse vegetation below the threshold (nodata excluded)."""
+    with np.errstate(invalid='ignore'):
+        drought_mask = (index < threshold).astype(np.uint8)
+    return clean_mask(drought_mask, kernel_size)
+
+def calculate_drought_severity(image, params):
+    """
+    Combine pseudo-NDVI and a brown/yellow color index into a drought severity map.
+    """
+    # Calculate pseudo-NDVI
+    pseudo_ndvi = calculate_ndvi_approximation(image)
+    
+    # Calculate color-based dryness index
+    img_hsv = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
+    hue = img_hsv[:, :, 0].astype(float) / 179.0  # Normalize to 0-1
+    saturation = img_hsv[:, :, 1].astype(float) / 255.0
+    value = img_hsv[:, :, 2].astype(float) / 255.0
+    
+    # Brown/yellow colors have hue around 0.05-0.15 (normalized)
+    # High value, medium-low saturation indicates dry soil/vegetation
+    brown_mask = ((hue >= 0.05) & (hue <= 0.15) & (saturation >= 0.2) & (value >= 0.4))
+    
+    # Combine indices for drought detection
+    # Low NDVI and brown/yellow color indicates potential drought
+    return (1 - pseudo_ndvi) * params["ndvi_weight"] + brown_mask.astype(float) * params["color_weight"]
+
+def detect_drought_regions(drought_severity, threshold=0.6, kernel_size=5):
+    """Threshold the severity map and clean up the drought mask."""
+    # Threshold for drought areas
+    drought_mask = drought_severity > threshold
+    return clean_mask(drought_mask.astype(np.uint8), kernel_size)
+
+def detect_drought_mask(image, params):
+    """Drought mask straight from the image, by table lookup for 8-bit RGB."""
+    if supports_lut(image):
+        return clean_mask(drought_raw_mask(image, params), params["kernel_size"])
+    return detect_drought_regions(
+        calculate_drought_severity(image, params),
+        threshold=params["drought_threshold"],
+        kernel_size=params["kernel_size"]
+    )
+
+def clean_mask(drought_mask, kernel_size=5):
+    """Apply morphological opening and closing to clean up a 0/1 mask."""
+    kernel = np.ones((kernel_size, kernel_size), np.uint8)
+    drought_mask = cv2.morphologyEx(drought_mask, cv2.MORPH_OPEN, kernel)
+    return cv2.morphologyEx(drought_mask, cv2.MORPH_CLOSE, kernel)
+
+def drought_severity_map(image, params):
+    """Drought severity of the image; float32 by table lookup for 8-bit RGB."""
+    if supports_lut(image):
+        return calculate_drought_severity_lut(image, params)
+    return calculate_drought_severity(image, params)
+
+def visualize_drought(image, drought_severity, params):
+    """Yellow-to-brown colouring of the drought severity."""
+    if supports_lut(image):
+        return drought_visualization(image, params)
+    
+    # Create drought visualization
+    drought_viz = np.zeros_like(image)
+    
+    # Use a color gradient from yellow to brown for severity
+    drought_viz[:, :, 0] = np.clip(150 + 105 * drought_severity, 0, 255)  # R
+    drought_viz[:, :, 1] = np.clip(150 - 150 * drought_severity, 0, 255)  # G
+    drought_viz[:, :, 2] = np.zeros_like(drought_severity)  # B
+    return drought_viz
+
+@instrument('drought.detect')
+def detect_drought(image, params, cache=None, image_key=None):
+    """
+    Detect potential drought areas based on vegetation indices and color analysis.
+    Returns a drought severity map and mask of potential drought areas.
+    With a StageCache and the key of the input image, the severity map and its
+    visualization are reused when only the threshold or kernel size change.
+    """
+    if cache is None or image_key is None:
+        cache = StageCache(enabled=False)
+    weights = {"ndvi_weight": params["ndvi_weight"], "color_weight": params["color_weight"]}
+    version = code_version(calculate_ndvi_approximation, calculate_drought_severity, spectral_lut)
+    
+    drought_mask, _ = cache.run(
+        "drought_mask",
+        lambda: detect_drought_mask(image, params),
+        inputs=[image_key],
+        params=dict(weights, drought_threshold=params["drought_threshold"], kernel_size=params["kernel_size"]),
+        version=code_version(detect_drought_mask, detect_drought_regions, clean_mask, version)
+    )
+    drought_severity, _ = cache.run(
+        "drought_severity",
+        lambda: drought_severity_map(image, params),
+        inputs=[image_key],
+        params=weights,
+        version=version
+    )
+    drought_viz, _ = cache.run(
+        "drought_visualization",
+        lambda: visualize_drought(image, drought_severity, params),
+        inputs=[image_key],
+        params=weights,
+        version=code_version(visualize_drought, version)
+    )
+    
+    # Blend original image with drought visualization
+    alpha = params["visualization_alpha"]
+    result = cv2.addWeighted(image, 1 - alpha, drought_viz.astype(np.uint8), alpha, 0)
+    
+    # Highlight severe drought areas
+    result[drought_mask > 0] = [165, 42, 42]  # Mark detected severe drought in brown
+    
+    return result, drought_severity, drought_mask
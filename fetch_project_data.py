@@ -1,16 +1,24 @@
 import os
 import json
+import argparse
 import requests
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from utils.load_project_data import asset_local_path
 
-# Usage: python fetch_project_data.py <TOKEN>
+# Usage: python fetch_project_data.py [TOKEN] [--download --assets TCI --workers 4]
 # Or set the environment variable OC_API_TOKEN
 
-def get_token():
+SEARCH_URL = "https://app.open-cosmos.com/api/data/v0/scenario/scenario/aa55c71b-f73a-4401-a0be-b7ba662f2c98/search"
+CHUNK_SIZE = 1 << 20  # 1 MiB per streamed write
+
+def get_token(token=None):
     # Default token (replace with your own if needed)
     default_token = "eyJhbGciOiJSUzI1NiIsInR5cCI6IkpXVCIsImtpZCI6IlJEVTFPRFExTURZd09VWXpOMFV6UTBWRE5EZEJRVFJHTUVZMk1FTkdNa0pHUmtZMVJqQkdPQSJ9.eyJpc3MiOiJodHRwczovL2xvZ2luLm9wZW4tY29zbW9zLmNvbS8iLCJzdWIiOiJhdXRoMHw2ODAyMDg4NmQ3YzA0Yjk3NDBiMDczNGEiLCJhdWQiOlsiaHR0cHM6Ly9iZWVhcHAub3Blbi1jb3Ntb3MuY29tIiwiaHR0cHM6Ly9vcGVuY29zbW9zLmV1LmF1dGgwLmNvbS91c2VyaW5mbyJdLCJpYXQiOjE3NDUwNDYwNzEsImV4cCI6MTc0NTEzMjQ3MSwic2NvcGUiOiJvcGVuaWQgcHJvZmlsZSBlbWFpbCBtc2Qgb3BzIGRhdGEgaGlsIHBvcnRhbCB1c2VyIHN1YmplY3QgcmVsYXRpb25zaGlwIHJvbGUgbWlzc2lvbiBwcm9ncmFtbWUgb3JnYW5pc2F0aW9uIGVwaGVtZXJpcyBvZmZsaW5lX2FjY2VzcyIsImF6cCI6InR0Zm1qdXV4QTNaWUs0SmtVeTRjRUluNDhrZnFrckV6In0.SfYwqJRgm3nbzURGhwLTcoSQC7lY09C0RMMpu8oYNpZhbm6hrzvodiobt1FYf7Z0x-Q-X-yT1OibG2wqWBI12-txrEju2D2OFWsARU6ZDxI20embWT9QVljG3p27F0wnp9h3fbDRqCzBzB2cTkYN2GNA789txTMSnFREXNKc_mvER-jjFhDnwAU_YYs3P03XmxXqHyGAkVcF6S7XYFIEBSHdDcY3hYHJB1uc4AwmO8uc6BmcYd-zcHKM2t8oPBYNQqIN2M8iCpP7MlGNtHqvS7DtJ137TyCxhqYOXbFajxT8CjiGysj4raMFxDwhxgN1OwX5d5J9sqj0D1U0hZRezg"
-    if len(sys.argv) > 1:
-        return sys.argv[1]
+    if token:
+        return token
     token = os.getenv("OC_API_TOKEN")
     if token:
         return token
@@ -19,28 +27,170 @@ def get_token():
     print("Error: No API token provided. Please update the script with your token, pass it as an argument, or set OC_API_TOKEN.")
     sys.exit(1)
 
-def main():
-    token = get_token()
+def create_session(token, pool_size=4):
+    """Session with a bounded connection pool and retries on transient errors."""
     session = requests.Session()
     session.headers.update({"Authorization": f"Bearer {token}"})
-    url = "https://app.open-cosmos.com/api/data/v0/scenario/scenario/aa55c71b-f73a-4401-a0be-b7ba662f2c98/search"
-    payload = {"query": {}, "limit": 50}
-    try:
-        response = session.post(url, json=payload)
+    retry = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def next_link(page):
+    """Return the rel=next link of a STAC search page, if any."""
+    for link in page.get("links", []):
+        if link.get("rel") == "next":
+            return link
+    return None
+
+def search_all(session, url, payload, max_pages=None):
+    """Run a STAC search and follow rel=next links, merging all pages."""
+    response = session.post(url, json=payload)
+    response.raise_for_status()
+    page = response.json()
+    features = list(page.get("features", []))
+    pages = 1
+    link = next_link(page)
+    while link is not None and (max_pages is None or pages < max_pages):
+        if link.get("method", "GET").upper() == "POST":
+            body = dict(payload, **link.get("body", {})) if link.get("merge") else link.get("body", payload)
+            response = session.post(link["href"], json=body)
+        else:
+            response = session.get(link["href"])
         response.raise_for_status()
-        print(f"Status Code: {response.status_code}")
-        try:
-            response_data = response.json()
-            # Save to file
-            with open("project_data.json", "w") as f:
-                json.dump(response_data, f, indent=4)
-            print("API response saved to project_data.json")
-            print(json.dumps(response_data, indent=4))
-        except json.JSONDecodeError:
-            print("Error: Response is not valid JSON. Data not saved.")
-            print("Response Text (not JSON):")
-            print(response.text)
-            sys.exit(1)
+        page = response.json()
+        features.extend(page.get("features", []))
+        pages += 1
+        print(f"Fetched page {pages} ({len(features)} features so far)")
+        link = next_link(page)
+    page["features"] = features
+    page["numberReturned"] = len(features)
+    return page
+
+def download_asset(session, href, dest, chunk_size=CHUNK_SIZE):
+    """
+    Stream one asset to dest. Partial downloads (dest.part) are resumed with
+    an HTTP Range request and files whose ETag/size did not change are skipped.
+    The ETag a partial download came from is kept in dest.part.etag; a
+    partial of another version of the file is discarded instead of resumed.
+    Returns "skipped", "resumed" or "downloaded".
+    """
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    part_path = dest + ".part"
+    part_meta_path = part_path + ".etag"
+    meta_path = dest + ".etag"
+
+    head = session.head(href, allow_redirects=True)
+    head.raise_for_status()
+    etag = head.headers.get("ETag")
+    size = int(head.headers.get("Content-Length", -1))
+    remote_id = etag or f"size:{size}"
+
+    if os.path.exists(dest) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if f.read() == remote_id and (size < 0 or os.path.getsize(dest) == size):
+                return "skipped"
+
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    part_id = None
+    if offset and os.path.exists(part_meta_path):
+        with open(part_meta_path) as f:
+            part_id = f.read()
+    if offset and (part_id != remote_id or (size >= 0 and offset > size)):
+        # Left over from a different version of the file (or of unknown origin)
+        os.remove(part_path)
+        offset = 0
+    resumed = offset > 0
+    unsatisfiable = False
+    # A partial file that already has every byte only needs renaming
+    if size < 0 or offset < size:
+        headers = {}
+        if offset and head.headers.get("Accept-Ranges") == "bytes":
+            headers["Range"] = f"bytes={offset}-"
+            if etag:
+                # The version the partial came from: a changed file is sent whole
+                headers["If-Range"] = part_id
+        with session.get(href, headers=headers, stream=True) as response:
+            # 416 Range Not Satisfiable: nothing past offset, the partial file is complete
+            unsatisfiable = response.status_code == 416 and "Range" in headers
+            if not unsatisfiable:
+                response.raise_for_status()
+                resumed = response.status_code == 206
+                if not resumed:
+                    with open(part_meta_path, "w") as f:
+                        f.write(response.headers.get("ETag") or remote_id)
+                with open(part_path, "ab" if resumed else "wb") as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+
+    received = os.path.getsize(part_path)
+    if size >= 0 and received != size:
+        if unsatisfiable:
+            # The partial file does not match the remote one; start over on the next attempt
+            os.remove(part_path)
+        raise IOError(f"Incomplete download of {href}: {received} of {size} bytes")
+    with open(part_meta_path) as f:
+        part_id = f.read()
+    os.replace(part_path, dest)
+    os.remove(part_meta_path)
+    with open(meta_path, "w") as f:
+        f.write(part_id)
+    return "resumed" if resumed else "downloaded"
+
+def download_assets(session, features, asset_keys, data_dir=None, workers=4):
+    """Download the given assets of every feature concurrently."""
+    jobs = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for feature in features:
+            for key in asset_keys:
+                if key not in feature.get("assets", {}):
+                    continue
+                href = feature["assets"][key]["href"]
+                dest = asset_local_path(feature, key, data_dir)
+                jobs[pool.submit(download_asset, session, href, dest)] = dest
+        counts = {"downloaded": 0, "resumed": 0, "skipped": 0, "failed": 0}
+        for future in as_completed(jobs):
+            try:
+                status = future.result()
+            except (requests.exceptions.RequestException, IOError) as e:
+                print(f"Error downloading {jobs[future]}: {e}")
+                status = "failed"
+            else:
+                print(f"{status.capitalize()}: {jobs[future]}")
+            counts[status] += 1
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch STAC search results and download scene assets.")
+    parser.add_argument("token", nargs="?", help="API token (or set OC_API_TOKEN)")
+    parser.add_argument("--url", default=SEARCH_URL, help="STAC search endpoint")
+    parser.add_argument("--limit", type=int, default=50, help="Features per page")
+    parser.add_argument("--max-pages", type=int, default=None, help="Stop after this many pages")
+    parser.add_argument("--output", default="project_data.json")
+    parser.add_argument("--download", action="store_true", help="Also download assets")
+    parser.add_argument("--assets", nargs="+", default=["TCI"], help="Asset keys to download")
+    parser.add_argument("--data-dir", default=None, help="Download directory (default figures/scenes)")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent downloads")
+    args = parser.parse_args()
+
+    token = get_token(args.token)
+    session = create_session(token, pool_size=args.workers)
+    url = args.url
+    payload = {"query": {}, "limit": args.limit}
+    try:
+        response_data = search_all(session, url, payload, max_pages=args.max_pages)
+        # Save to file
+        with open(args.output, "w") as f:
+            json.dump(response_data, f, indent=4)
+        print(f"API response with {len(response_data['features'])} features saved to {args.output}")
+        if args.download:
+            counts = download_assets(session, response_data["features"], args.assets, args.data_dir, args.workers)
+            print(f"Assets: {counts['downloaded']} downloaded, {counts['resumed']} resumed, "
+                  f"{counts['skipped']} unchanged, {counts['failed']} failed")
+    except json.JSONDecodeError:
+        print("Error: Response is not valid JSON. Data not saved.")
+        sys.exit(1)
     except requests.exceptions.ConnectionError as e:
         print(f"Connection Error: Could not connect to {url}. Error: {e}")
     except requests.exceptions.Timeout as e:
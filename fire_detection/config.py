@@ -0,0 +1,22 @@
+from pathlib import Path
+
+from utils.stage_cache import CACHE_DEFAULTS
+
+FIGURES_DIR = Path(__file__).parent.parent / "figures"
+
+# Fire detection parameters
+# The combined fire intensity is clipped to 0-1, so with a threshold of 15 the
+# RGB fire mask is always empty: fire detection is effectively disabled until
+# the threshold is brought into that range (the cascade warns about it)
+FIRE_PARAMS = {
+    "intensity_threshold": 15,   # Threshold on the combined fire intensity
+    "nir_intensity_threshold": 0.6,  # Threshold on the red/NIR fire intensity of band stacks
+    "bits_per_sample": None,     # Sensor bit depth of band stack counts (default: raster:bands, else TIFF tag)
+    "kernel_size": 5,            # Morphological open/close kernel size
+    "cascade_margin": 0.1,       # Coarse-pass slack in cascade mode, as a fraction of the intensity threshold
+    "heatmap_alpha": 0.5         # Transparency of heatmap overlay
+}
+
+
+# Stage cache (defaults in utils/stage_cache.py; override keys here)
+CACHE_PARAMS = dict(CACHE_DEFAULTS)
\ No newline at end of file
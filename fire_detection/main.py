@@ -1,66 +1,22 @@
-import cv2
-import numpy as np
 import os
 from pathlib import Path
-from skimage import io
-from utils.load_project_data import load_project_data
+from config import CACHE_PARAMS, FIRE_PARAMS
+from utils.worker_service import print_result, run_remote
 
-def create_heatmap(image):
-    # Convert to float32 for processing
-    img_float = image.astype(np.float32)
-    
-    # Calculate intensity based on RGB values
-    # Enhanced fire detection using multiple color ratios
-    red_channel = img_float[:, :, 0]
-    green_channel = img_float[:, :, 1]
-    blue_channel = img_float[:, :, 2]
-    
-    # Calculate multiple fire indicators
-    # 1. Red dominance ratio
-    red_ratio = red_channel / (green_channel + blue_channel + 1)
-    
-    # 2. Red-Green difference
-    rg_diff = red_channel - green_channel
-    
-    # 3. Red-Blue difference
-    rb_diff = red_channel - blue_channel
-    
-    # 4. Combined intensity (weighted sum of indicators)
-    intensity = (2 * red_ratio + rg_diff + rb_diff) / 4
-    
-    # Normalize intensity to 0-1 range
-    intensity = np.clip(intensity, 0, 1)
-    
-    # Apply threshold to identify fire regions
-    fire_mask = intensity > 15
-    
-    # Apply morphological operations to clean up the mask
-    kernel = np.ones((5,5), np.uint8)
-    fire_mask = cv2.morphologyEx(fire_mask.astype(np.uint8), cv2.MORPH_OPEN, kernel)
-    fire_mask = cv2.morphologyEx(fire_mask, cv2.MORPH_CLOSE, kernel)
-    
-    # Create heatmap using yellow to red colormap
-    heatmap = np.zeros_like(image)
-    
-    # Yellow (255, 255, 0) to Red (255, 0, 0)
-    heatmap[:, :, 0] = 255  # Red channel always 255
-    heatmap[:, :, 1] = 255 * (1 - intensity)  # Green channel decreases with intensity
-    heatmap[:, :, 2] = 0  # Blue channel always 0
-    
-    # Blend original image with heatmap
-    alpha = 0.5  # Transparency of heatmap
-    result = cv2.addWeighted(image, 1 - alpha, heatmap.astype(np.uint8), alpha, 0)
-    
-    # Overlay fire regions with higher intensity
-    result[fire_mask > 0] = [255, 0, 0]  # Mark detected fire regions in red
-    
-    return result, intensity, fire_mask
+def run_local():
+    # Detector imports are deferred so the worker service client path stays light
+    import cv2
+    import numpy as np
+    from utils.fire_detection import create_heatmap
+    from utils.cog_reader import read_image
+    from utils.stac_catalog import open_catalog
+    from utils.stage_cache import StageCache
 
-def main():
-    # Load project data from API
-    project_data = load_project_data()
-    if project_data is not None:
-        print("[INFO] Project data loaded from project_data.json. Keys:", list(project_data.keys()))
+    # Open the local STAC catalog built from project_data.json
+    with open_catalog() as catalog:
+        feature_count = catalog.count()
+    if feature_count:
+        print(f"[INFO] STAC catalog loaded from project_data.json: {feature_count} features")
     else:
         print("[WARN] Project data not available. Proceeding without API data.")
 
@@ -74,8 +30,8 @@ def main():
         print(f"Error: Input image {input_path} not found!")
         return
     
-    # Read the TIFF image using skimage
-    image = io.imread(input_path)
+    # Read the TIFF image through the shared COG reader
+    image = read_image(input_path)
     
     # Convert to RGB if needed (some TIFFs might be in different color spaces)
     if len(image.shape) == 2:  # If grayscale
@@ -83,8 +39,10 @@ def main():
     elif image.shape[2] == 4:  # If RGBA
         image = cv2.cvtColor(image, cv2.COLOR_RGBA2RGB)
     
-    # Create heatmap
-    heatmap_image, intensity, fire_mask = create_heatmap(image)
+    # Create heatmap (upstream stages come from the stage cache when unchanged)
+    cache = StageCache(**CACHE_PARAMS)
+    image_key = cache.file_key(input_path) if cache.enabled else None
+    heatmap_image, intensity, fire_mask = create_heatmap(image, FIRE_PARAMS, cache, image_key)
     
     # Save original and heatmap as PNG
     cv2.imwrite('figures/png/original_TCI.png', cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
@@ -101,6 +59,27 @@ def main():
     print("Original image saved as: figures/png/original_TCI.png")
     print("Heatmap saved as: figures/png/fire_heatmap.png")
     print("Fire mask saved as: figures/png/fire_mask.png")
+    cache.report()
+
+def main():
+    input_path = 'figures/TCI_COG.tiff'
+    if not os.path.exists(input_path):
+        print(f"Error: Input image {input_path} not found!")
+        return
+    
+    # Hand the job to the warm worker service if one is running
+    # (PYTHONPATH=. python utils/worker_service.py serve), otherwise process here
+    record = run_remote({
+        "scene": os.path.abspath(input_path),
+        "outputs": ["original_png", "fire_heatmap", "fire_mask"],
+        "params": {"fire": FIRE_PARAMS},
+        "output_dir": os.path.abspath('figures')
+    })
+    if record is None:
+        run_local()
+        return
+    print("Fire detection completed successfully!")
+    print_result(record)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,111 @@
+import cv2
+import numpy as np
+from utils import spectral_lut
+from utils.instrumentation import instrument
+from utils.spectral_lut import fire_intensity, fire_raw_mask, supports_lut
+from utils.stage_cache import StageCache, code_version
+
+def calculate_fire_intensity(image):
+    """Calculate the combined fire intensity (0-1) from RGB values."""
+    # 8-bit RGB goes through the lookup tables (bit-identical, far fewer temporaries)
+    if supports_lut(image):
+        return fire_intensity(image)
+    
+    # Convert to float32 for processing
+    img_float = image.astype(np.float32)
+    
+    # Calculate intensity based on RGB values
+    # Enhanced fire detection using multiple color ratios
+    red_channel = img_float[:, :, 0]
+    green_channel = img_float[:, :, 1]
+    blue_channel = img_float[:, :, 2]
+    
+    # Calculate multiple fire indicators
+    # 1. Red dominance ratio
+    red_ratio = red_channel / (green_channel + blue_channel + 1)
+    
+    # 2. Red-Green difference
+    rg_diff = red_channel - green_channel
+    
+    # 3. Red-Blue difference
+    rb_diff = red_channel - blue_channel
+    
+    # 4. Combined intensity (weighted sum of indicators)
+    intensity = (2 * red_ratio + rg_diff + rb_diff) / 4
+    
+    # Normalize intensity to 0-1 range
+    return np.clip(intensity, 0, 1)
+
+def calculate_nir_fire_intensity(red, nir):
+    """
+    Fire intensity (0-1) from the red and NIR bands as fractions of the sensor full scale.
+    Flames and embers are bright in both bands, while vegetation is bright
+    only in the NIR: the mean brightness is damped by the positive part of
+    the NDVI.
+    """
+    red = np.asarray(red, dtype=np.float32)
+    nir = np.asarray(nir, dtype=np.float32)
+    total = red + nir
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ndvi = np.where(total > 0, (nir - red) / total, 0)
+    return np.clip(total / 2 * (1 - np.maximum(ndvi, 0)), 0, 1)
+
+def detect_fire_regions(intensity, threshold=15, kernel_size=5):
+    """Threshold the intensity and clean up the fire mask."""
+    # Apply threshold to identify fire regions
+    fire_mask = intensity > threshold
+    return clean_mask(fire_mask.astype(np.uint8), kernel_size)
+
+def detect_fire(image, threshold=15, kernel_size=5):
+    """Fire mask straight from the image, by table lookup for 8-bit RGB."""
+    if supports_lut(image):
+        return clean_mask(fire_raw_mask(image, threshold), kernel_size)
+    return detect_fire_regions(calculate_fire_intensity(image), threshold, kernel_size)
+
+def clean_mask(fire_mask, kernel_size=5):
+    """Apply morphological opening and closing to clean up a 0/1 mask."""
+    kernel = np.ones((kernel_size, kernel_size), np.uint8)
+    fire_mask = cv2.morphologyEx(fire_mask, cv2.MORPH_OPEN, kernel)
+    return cv2.morphologyEx(fire_mask, cv2.MORPH_CLOSE, kernel)
+
+@instrument('fire.detect')
+def create_heatmap(image, params, cache=None, image_key=None):
+    """
+    Complete fire detection pipeline: intensity, mask and heatmap overlay.
+    With a StageCache and the key of the input image, the intensity plane is
+    reused when only the threshold or kernel size change.
+    """
+    if cache is None or image_key is None:
+        cache = StageCache(enabled=False)
+    version = code_version(calculate_fire_intensity, spectral_lut)
+    intensity, _ = cache.run(
+        'fire_intensity',
+        lambda: calculate_fire_intensity(image),
+        inputs=[image_key],
+        version=version
+    )
+    mask_params = {'threshold': params['intensity_threshold'], 'kernel_size': params['kernel_size']}
+    fire_mask, _ = cache.run(
+        'fire_mask',
+        lambda: detect_fire(image, **mask_params),
+        inputs=[image_key],
+        params=mask_params,
+        version=code_version(detect_fire, detect_fire_regions, clean_mask, version)
+    )
+    
+    # Create heatmap using yellow to red colormap
+    heatmap = np.zeros_like(image)
+    
+    # Yellow (255, 255, 0) to Red (255, 0, 0)
+    heatmap[:, :, 0] = 255  # Red channel always 255
+    heatmap[:, :, 1] = 255 * (1 - intensity)  # Green channel decreases with intensity
+    heatmap[:, :, 2] = 0  # Blue channel always 0
+    
+    # Blend original image with heatmap
+    alpha = params['heatmap_alpha']  # Transparency of heatmap
+    result = cv2.addWeighted(image, 1 - alpha, heatmap.astype(np.uint8), alpha, 0)
+    
+    # Overlay fire regions with higher intensity
+    result[fire_mask > 0] = [255, 0, 0]  # Mark detected fire regions in red
+    
+    return result, intensity, fire_mask
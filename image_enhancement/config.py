@@ -1,10 +1,13 @@
 import os
 from pathlib import Path
 
+from utils.stage_cache import CACHE_DEFAULTS
+
 # Directory paths
 BASE_DIR = Path(__file__).parent
 FIGURES_DIR = BASE_DIR.parent / "figures"
 UTILS_DIR = BASE_DIR / "utils"
+MODEL_DIR = BASE_DIR / "models"
 
 # Input/Output file names
 INPUT_IMAGE = "TCI_COG.tiff"
@@ -18,14 +21,52 @@ DENOISE_PARAMS = {
     "mode": 'soft'        # Thresholding mode
 }
 
+# Model paths: the Real-ESRGAN checkpoint exported to ONNX (torch.onnx.export); .pth files need PyTorch
+REALESRGAN_MODEL = MODEL_DIR / "RealESRGAN_x4plus.onnx"
+
+# Upscaler backend of the enhancement chain (models/sr_engine.py)
+UPSCALER_PARAMS = {
+    "backend": "bicubic",      # "bicubic", "model" (SR network file) or "random" (random weights, for testing)
+    "model": str(REALESRGAN_MODEL),  # .onnx (OpenCV DNN) or .npz (numpy engine)
+    "arch": "fsrcnn",          # Architecture of the "random" backend: "fsrcnn" or "esrgan"
+    "channels": None,          # Input channels of an ONNX model (default 3; gray tiles are replicated)
+    "precision": None,         # "fp32", "fp16" or "int8" (default: as stored in the model)
+    "tile": 128,               # Source pixels per inference tile
+    "overlap": None,           # Context around each tile (default: the receptive field, 16 for ONNX)
+    "batch": 1,                # Tiles per forward pass
+    "threads": None            # Intra-op threads during inference (default: BLAS/OpenCV defaults)
+}
+
 ENHANCEMENT_PARAMS = {
     "upscale_factor": 4,
+    "upscaler": UPSCALER_PARAMS,
     "contrast_stretch": True,
     "sharpening_kernel": [[-1, -1, -1],
                          [-1,  9, -1],
                          [-1, -1, -1]]
 }
 
-# Model paths
-MODEL_DIR = BASE_DIR / "models"
-REALESRGAN_MODEL = MODEL_DIR / "RealESRGAN_x4plus.pth" 
\ No newline at end of file
+# Tiled pipeline parameters
+TILE_PARAMS = {
+    "tile_size": 1024,         # Input tile size (rounded up to the wavelet block size)
+    "output_tile": 512,        # Tile size of the written TIFF
+    "workers": None,           # Thread pool size (default: CPU count)
+    "output_dtype": "float32"
+}
+
+# Stage cache (defaults in utils/stage_cache.py; override keys here)
+CACHE_PARAMS = dict(CACHE_DEFAULTS)
+
+# Batch TIFF enhancement (models/train_model.py)
+BATCH_ENHANCE_PARAMS = {
+    "denoise_weight": 0.1,
+    "contrast_limit": 0.3,
+    "sharpness": 1.0,
+    "clahe_grid": 8,            # Contextual regions per axis (skimage default: 1/8 of the image)
+    "clahe_bins": 256,
+    "tile_size": 1024,
+    "output_tile": 512,
+    "workers": None,            # Files processed in parallel (default: CPU count)
+    "skip_prefixes": ["enhanced_", "CARBON_mask_"],  # Derived outputs are never enhanced again
+    "manifest": "enhance_manifest.json"
+}
@@ -1,21 +1,20 @@
 import os
-import gc
 from pathlib import Path
 from config import *
-from utils.image_processing import (
-    load_image,
-    save_image,
-    preprocess_image,
-    upscale_image,
-    sharpen_image
-)
-from utils.load_project_data import load_project_data
+from utils.worker_service import print_result, run_remote
 
-def main():
-    # Load project data from API
-    project_data = load_project_data()
-    if project_data is not None:
-        print("[INFO] Project data loaded from project_data.json. Keys:", list(project_data.keys()))
+def run_local():
+    # Enhancement imports are deferred so the worker service client path stays light
+    from utils.cog_reader import open_cog
+    from utils.tiled_pipeline import enhance_tiled
+    from utils.stac_catalog import open_catalog
+    from utils.stage_cache import StageCache
+
+    # Open the local STAC catalog built from project_data.json
+    with open_catalog() as catalog:
+        feature_count = catalog.count()
+    if feature_count:
+        print(f"[INFO] STAC catalog loaded from project_data.json: {feature_count} features")
     else:
         print("[WARN] Project data not available. Proceeding without API data.")
 
@@ -23,39 +22,19 @@ def main():
     FIGURES_DIR.mkdir(exist_ok=True)
     
     try:
-        # Load input image
         input_path = FIGURES_DIR / INPUT_IMAGE
-        print(f"Loading image from {input_path}")
-        image = load_image(input_path, max_size=2048)  # Limit maximum dimension to 2048 pixels
-        
-        # Preprocess image
-        print("Preprocessing image...")
-        preprocessed = preprocess_image(image, DENOISE_PARAMS)
-        
-        # Free memory
-        del image
-        gc.collect()
-        
-        # Upscale image
-        print("Upscaling image...")
-        upscaled = upscale_image(preprocessed, scale_factor=ENHANCEMENT_PARAMS['upscale_factor'])
-        
-        # Free memory
-        del preprocessed
-        gc.collect()
-        
-        # Sharpen image
-        print("Sharpening image...")
-        sharpened = sharpen_image(upscaled, ENHANCEMENT_PARAMS['sharpening_kernel'])
-        
-        # Free memory
-        del upscaled
-        gc.collect()
-        
-        # Save enhanced image
         output_path = FIGURES_DIR / ENHANCED_IMAGE
-        print(f"Saving enhanced image to {output_path}")
-        save_image(sharpened, output_path)
+        print(f"Loading image from {input_path}")
+        cache = StageCache(**CACHE_PARAMS)
+        source_key = cache.file_key(input_path) if cache.enabled else None
+        with open_cog(input_path) as reader:
+            # Grayscale, denoise, contrast stretch, upscale and sharpen tile by
+            # tile, streaming the result to disk
+            print(f"Enhancing {reader.width}x{reader.height} image in tiles of {TILE_PARAMS['tile_size']} pixels...")
+            shape = enhance_tiled(reader, output_path, DENOISE_PARAMS, ENHANCEMENT_PARAMS, TILE_PARAMS,
+                                  cache, source_key)
+        print(f"Saved {shape[1]}x{shape[0]} enhanced image to {output_path}")
+        cache.report()
         
         print("Image enhancement complete!")
         
@@ -63,5 +42,23 @@ def main():
         print(f"Error during image processing: {str(e)}")
         raise
 
+def main():
+    # Hand the job to the warm worker service if one is running
+    # (PYTHONPATH=. python utils/worker_service.py serve), otherwise process here
+    input_path = FIGURES_DIR / INPUT_IMAGE
+    record = None
+    if input_path.exists():
+        record = run_remote({
+            "scene": str(input_path.resolve()),
+            "outputs": ["enhanced"],
+            "params": {"denoise": DENOISE_PARAMS, "enhancement": ENHANCEMENT_PARAMS, "tile": TILE_PARAMS},
+            "output_dir": str(FIGURES_DIR.resolve())
+        })
+    if record is None:
+        run_local()
+        return
+    print("Image enhancement complete!")
+    print_result(record)
+
 if __name__ == "__main__":
     main() 
\ No newline at end of file
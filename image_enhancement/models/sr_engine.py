@@ -0,0 +1,567 @@
+import argparse
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+import cv2
+import numpy as np
+from image_enhancement.config import ENHANCEMENT_PARAMS
+from image_enhancement.utils.image_processing import upscale_image
+from utils.cog_reader import window_grid
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:  # Comes with scikit-learn; without it BLAS keeps its own thread count
+    threadpool_limits = None
+
+PRECISIONS = ('fp32', 'fp16', 'int8')
+INT8_LEVELS = 127
+# Below this many input channels a convolution gathers all taps into one matrix (im2col)
+IM2COL_CHANNELS = 8
+# Callers inside thread_limits and the settings to restore when the last one leaves
+_limits_lock = threading.Lock()
+_limits_state = {'users': 0, 'cv2': None, 'blas': None}
+
+# A network is a list of layer dicts. Weights use the PyTorch layouts so that
+# exported state dicts load as they are: conv (out, in, k, k), deconv
+# (in, out, k, k). A residual layer adds beta times the output of its own
+# layers to its input.
+
+def fsrcnn_layers(scale, channels=1, d=56, s=12, m=4):
+    """FSRCNN(d, s, m): feature extraction, shrinking, m mapping layers, expanding and a deconvolution."""
+    layers = [{'type': 'conv', 'in': channels, 'out': d, 'kernel': 5}, {'type': 'prelu'},
+              {'type': 'conv', 'in': d, 'out': s, 'kernel': 1}, {'type': 'prelu'}]
+    for _ in range(m):
+        layers += [{'type': 'conv', 'in': s, 'out': s, 'kernel': 3}, {'type': 'prelu'}]
+    layers += [{'type': 'conv', 'in': s, 'out': d, 'kernel': 1}, {'type': 'prelu'},
+               {'type': 'deconv', 'in': d, 'out': channels, 'kernel': 9, 'stride': scale, 'padding': 4,
+                'output_padding': scale - 1}]
+    return layers
+
+def esrgan_layers(scale, channels=1, features=32, blocks=4, beta=0.2):
+    """Small ESRGAN-style network: residual convolution body and a sub-pixel (pixel shuffle) head."""
+    layers = [{'type': 'conv', 'in': channels, 'out': features, 'kernel': 3}]
+    for _ in range(blocks):
+        layers.append({'type': 'residual', 'beta': beta, 'layers': [
+            {'type': 'conv', 'in': features, 'out': features, 'kernel': 3}, {'type': 'leaky_relu', 'slope': 0.2},
+            {'type': 'conv', 'in': features, 'out': features, 'kernel': 3}]})
+    layers += [{'type': 'conv', 'in': features, 'out': features, 'kernel': 3}, {'type': 'leaky_relu', 'slope': 0.2},
+               {'type': 'conv', 'in': features, 'out': channels * scale * scale, 'kernel': 3},
+               {'type': 'pixel_shuffle', 'factor': scale}]
+    return layers
+
+ARCHITECTURES = {
+    'fsrcnn': fsrcnn_layers,
+    'esrgan': esrgan_layers,
+}
+
+def random_weights(layers, seed=0):
+    """He-initialised weights for a layer spec (offline testing and benchmarking)."""
+    rng = np.random.default_rng(seed)
+    for _, layer in _walk(layers):
+        kind = layer['type']
+        if kind in ('conv', 'deconv'):
+            k = layer['kernel']
+            if kind == 'conv':
+                shape, fan_in = (layer['out'], layer['in'], k, k), layer['in'] * k * k
+            else:
+                shape, fan_in = (layer['in'], layer['out'], k, k), layer['in'] * k * k / layer['stride'] ** 2
+            layer['weight'] = (rng.standard_normal(shape) * np.sqrt(2 / fan_in)).astype(np.float32)
+            layer['bias'] = np.zeros(layer['out'], dtype=np.float32)
+        elif kind == 'prelu':
+            layer['alpha'] = np.full(1, 0.25, dtype=np.float32)
+    return layers
+
+def _walk(layers, prefix=''):
+    """(name, layer) of every layer, residual bodies included."""
+    for index, layer in enumerate(layers):
+        name = f'{prefix}{index}'
+        yield name, layer
+        if layer['type'] == 'residual':
+            yield from _walk(layer['layers'], f'{name}.')
+
+def _spec(layers):
+    """The layer spec without its weights (JSON-serialisable)."""
+    return [{key: (_spec(value) if key == 'layers' else value) for key, value in layer.items()
+             if not isinstance(value, np.ndarray)} for layer in layers]
+
+def _receptive(layers, factor=1):
+    """(reach in source pixels, upscaling factor) of a layer spec."""
+    halo = 0
+    for layer in layers:
+        kind = layer['type']
+        if kind == 'conv':
+            halo += -(-layer.get('padding', layer['kernel'] // 2) // factor)
+        elif kind == 'deconv':
+            factor *= layer['stride']
+            halo += -(-(layer['kernel'] // 2) // factor)
+        elif kind == 'pixel_shuffle':
+            factor *= layer['factor']
+        elif kind == 'residual':
+            halo += _receptive(layer['layers'], factor)[0]
+    return halo, factor
+
+def _quantize(weight, precision, axis=0):
+    """
+    Weight as stored at a precision
+    Args:
+        weight: float32 weight array
+        precision: 'fp32', 'fp16' or 'int8' (symmetric, per channel along axis)
+    Returns:
+        (stored values, float32 scale or None)
+    """
+    if precision == 'fp16':
+        return weight.astype(np.float16), None
+    if precision == 'int8':
+        reduce = tuple(i for i in range(weight.ndim) if i != axis)
+        scale = np.abs(weight).max(axis=reduce, keepdims=True) / INT8_LEVELS
+        scale = np.maximum(scale, np.finfo(np.float32).tiny).astype(np.float32)
+        return np.round(weight / scale).astype(np.int8), scale
+    return weight.astype(np.float32), None
+
+def _dequantize(values, scale):
+    values = values.astype(np.float32)
+    return values if scale is None else values * scale
+
+def _fake_quantize(x, precision):
+    """Round activations as a half-precision or int8 (dynamic, per sample) runtime would."""
+    if precision == 'fp16':
+        return x.astype(np.float16).astype(np.float32)
+    if precision == 'int8':
+        scale = np.abs(x).max(axis=(1, 2, 3), keepdims=True) / INT8_LEVELS
+        scale = np.maximum(scale, np.finfo(np.float32).tiny)
+        return np.round(x / scale) * scale
+    return x
+
+def _conv2d(x, weight, bias, kernel, padding):
+    """Convolution of (N, H, W, C) activations; weight is (kernel * kernel * C, out)."""
+    if padding:
+        x = np.pad(x, ((0, 0), (padding, padding), (padding, padding), (0, 0)))
+    n, height, width, channels = x.shape[0], x.shape[1] - kernel + 1, x.shape[2] - kernel + 1, x.shape[3]
+    if kernel == 1 or channels < IM2COL_CHANNELS:
+        # im2col: one matrix product over all kernel taps
+        if kernel > 1:
+            x = np.concatenate([x[:, i:i + height, j:j + width] for i in range(kernel) for j in range(kernel)],
+                               axis=-1)
+        out = (x.reshape(n * height * width, -1) @ weight).reshape(n, height, width, -1)
+    else:
+        # Wide inputs: one product per tap, without the kernel * kernel times larger im2col buffer
+        out = np.zeros((n, height, width, weight.shape[1]), dtype=np.float32)
+        product = np.empty_like(out)
+        for tap in range(kernel * kernel):
+            i, j = divmod(tap, kernel)
+            np.matmul(x[:, i:i + height, j:j + width], weight[tap * channels:(tap + 1) * channels], out=product)
+            out += product
+    out += bias
+    return out
+
+def _conv_transpose2d(x, weight, bias, kernel, stride, padding, output_padding):
+    """Transposed convolution of (N, H, W, C) activations; weight is (C, kernel * kernel * out)."""
+    n, height, width, channels = x.shape
+    taps = (x.reshape(-1, channels) @ weight).reshape(n, height, width, kernel, kernel, -1)
+    full = np.zeros((n, (height - 1) * stride + kernel + output_padding,
+                     (width - 1) * stride + kernel + output_padding, taps.shape[-1]), dtype=np.float32)
+    for i in range(kernel):
+        for j in range(kernel):
+            full[:, i:i + (height - 1) * stride + 1:stride, j:j + (width - 1) * stride + 1:stride] += taps[:, :, :, i, j]
+    out_h = (height - 1) * stride - 2 * padding + kernel + output_padding
+    out_w = (width - 1) * stride - 2 * padding + kernel + output_padding
+    out = full[:, padding:padding + out_h, padding:padding + out_w]
+    out += bias
+    return out
+
+def _prelu(x, alpha):
+    # x + (alpha - 1) * min(x, 0): two passes, much faster than np.where
+    out = np.minimum(x, 0)
+    out *= alpha - 1
+    out += x
+    return out
+
+def _pixel_shuffle(x, factor):
+    """(N, H, W, C * r * r) -> (N, H * r, W * r, C) in PyTorch's channel order."""
+    n, height, width, channels = x.shape
+    channels //= factor * factor
+    x = x.reshape(n, height, width, channels, factor, factor).transpose(0, 1, 4, 2, 5, 3)
+    return x.reshape(n, height * factor, width * factor, channels)
+
+class SRNetwork:
+    """
+    Numpy CPU inference of a feed-forward SR network
+    Activations are channels-last and every convolution is one matrix
+    product, so the work runs in multithreaded BLAS. fp16 and int8 store
+    the weights at that precision and round the activations entering each
+    convolution the same way; the arithmetic itself stays float32.
+    """
+    def __init__(self, layers, precision='fp32', name='network'):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision {precision!r}; use one of {PRECISIONS}")
+        self.layers = layers
+        self.precision = precision
+        self.name = name
+        self.channels = next(layer['in'] for _, layer in _walk(layers) if layer['type'] in ('conv', 'deconv'))
+        self.halo, self.scale = _receptive(layers)
+        self._compiled = self._compile(layers)
+
+    def _compile(self, layers):
+        compiled = []
+        for layer in layers:
+            kind = layer['type']
+            params = {}
+            if kind == 'conv':
+                weight = _dequantize(*_quantize(layer['weight'], self.precision, axis=0))
+                params = {'weight': np.ascontiguousarray(weight.transpose(2, 3, 1, 0).reshape(-1, weight.shape[0])),
+                          'bias': layer['bias'], 'kernel': layer['kernel'],
+                          'padding': layer.get('padding', layer['kernel'] // 2)}
+            elif kind == 'deconv':
+                weight = _dequantize(*_quantize(layer['weight'], self.precision, axis=1))
+                params = {'weight': np.ascontiguousarray(weight.transpose(0, 2, 3, 1).reshape(weight.shape[0], -1)),
+                          'bias': layer['bias'], 'kernel': layer['kernel'], 'stride': layer['stride'],
+                          'padding': layer.get('padding', 0), 'output_padding': layer.get('output_padding', 0)}
+            elif kind == 'prelu':
+                params = {'alpha': layer['alpha']}
+            elif kind == 'leaky_relu':
+                params = {'alpha': np.float32(layer.get('slope', 0.01))}
+            elif kind == 'pixel_shuffle':
+                params = {'factor': layer['factor']}
+            elif kind == 'residual':
+                params = {'beta': np.float32(layer.get('beta', 1.0)), 'layers': self._compile(layer['layers'])}
+            elif kind != 'relu':
+                raise ValueError(f"Unknown layer type {kind!r}")
+            compiled.append((kind, params))
+        return compiled
+
+    def _run(self, compiled, x):
+        for kind, params in compiled:
+            if kind == 'conv':
+                x = _conv2d(_fake_quantize(x, self.precision), params['weight'], params['bias'], params['kernel'],
+                            params['padding'])
+            elif kind == 'deconv':
+                x = _conv_transpose2d(_fake_quantize(x, self.precision), params['weight'], params['bias'],
+                                      params['kernel'], params['stride'], params['padding'], params['output_padding'])
+            elif kind in ('prelu', 'leaky_relu'):
+                x = _prelu(x, params['alpha'])
+            elif kind == 'relu':
+                x = np.maximum(x, 0)
+            elif kind == 'pixel_shuffle':
+                x = _pixel_shuffle(x, params['factor'])
+            elif kind == 'residual':
+                x = x + params['beta'] * self._run(params['layers'], x)
+        return x
+
+    def forward(self, batch):
+        """(N, H, W, channels) float32 -> (N, H * scale, W * scale, channels)."""
+        return self._run(self._compiled, np.ascontiguousarray(batch, dtype=np.float32))
+
+    def save(self, path):
+        """Write the spec and the weights (at the network's precision) to an .npz file."""
+        arrays = {'spec': np.array(json.dumps({'name': self.name, 'precision': self.precision,
+                                               'layers': _spec(self.layers)}))}
+        for name, layer in _walk(self.layers):
+            if 'weight' in layer:
+                values, scale = _quantize(layer['weight'], self.precision, axis=1 if layer['type'] == 'deconv' else 0)
+                arrays[f'{name}.weight'] = values
+                if scale is not None:
+                    arrays[f'{name}.weight_scale'] = scale
+            for key in ('bias', 'alpha'):
+                if key in layer:
+                    arrays[f'{name}.{key}'] = layer[key].astype(np.float32)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path, precision=None):
+        """Network from an .npz file written by save (precision defaults to the stored one)."""
+        with np.load(path) as data:
+            meta = json.loads(str(data['spec']))
+            layers = meta['layers']
+            for name, layer in _walk(layers):
+                for key in ('weight', 'bias', 'alpha'):
+                    if f'{name}.{key}' in data:
+                        scale = data[f'{name}.{key}_scale'] if f'{name}.{key}_scale' in data else None
+                        layer[key] = _dequantize(data[f'{name}.{key}'], scale)
+        return cls(layers, precision or meta['precision'], meta['name'])
+
+class ONNXNetwork:
+    """OpenCV DNN inference of an ONNX SR model (e.g. Real-ESRGAN exported with torch.onnx.export)."""
+    # Receptive field unknown: the tiles rely on the configured overlap
+    halo = None
+
+    def __init__(self, path, channels=3, precision='fp32'):
+        if precision == 'int8':
+            raise ValueError("int8 ONNX inference needs a model quantized offline; load it with precision 'fp32'")
+        self.net = cv2.dnn.readNetFromONNX(str(path))
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        if precision == 'fp16':
+            if not hasattr(cv2.dnn, 'DNN_TARGET_CPU_FP16'):
+                raise ValueError("This OpenCV build has no FP16 CPU target")
+            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU_FP16)
+        self.name = Path(path).stem
+        self.precision = precision
+        self.channels = channels
+        # A cv2.dnn Net must not run in several threads at once
+        self._lock = threading.Lock()
+        self.scale = self.forward(np.zeros((1, 16, 16, channels), dtype=np.float32)).shape[1] // 16
+
+    def forward(self, batch):
+        """(N, H, W, channels) float32 -> (N, H * scale, W * scale, channels)."""
+        with self._lock:
+            self.net.setInput(np.ascontiguousarray(batch.transpose(0, 3, 1, 2), dtype=np.float32))
+            out = self.net.forward()
+        return out.transpose(0, 2, 3, 1)
+
+@lru_cache(maxsize=4)
+def _cached_network(path, mtime, precision, channels):
+    if Path(path).suffix.lower() == '.onnx':
+        return ONNXNetwork(path, channels or 3, precision or 'fp32')
+    return SRNetwork.load(path, precision)
+
+def load_network(path, precision=None, channels=None):
+    """
+    Load an SR network; repeated loads of an unchanged file are shared
+    Args:
+        path: .npz weights (numpy engine) or .onnx model (OpenCV DNN)
+        precision: 'fp32', 'fp16' or 'int8' (default: as stored, fp32 for ONNX)
+        channels: Input channels of an ONNX model (default 3)
+    Returns:
+        SRNetwork or ONNXNetwork
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix not in ('.npz', '.onnx'):
+        raise ValueError(f"Unsupported model format {suffix!r}: use .npz weights or an ONNX export "
+                         "(PyTorch checkpoints need torch)")
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"SR model not found: {path}")
+    return _cached_network(str(path), os.path.getmtime(path), precision, channels)
+
+def _ramp(size, overlap, fade, first, last):
+    """
+    Blend weights along one tile axis (output pixels)
+    Each tile owns its core; the weights cross-fade linearly over `fade`
+    pixels either side of the core edges shared with neighbours, so they sum
+    to one everywhere. Edges on the image border keep full weight.
+    """
+    weights = np.zeros(size, dtype=np.float32)
+    weights[overlap - fade:size - overlap + fade] = 1
+    ramp = (np.arange(2 * fade, dtype=np.float32) + 0.5) / (2 * fade) if fade else None
+    if first:
+        weights[:overlap] = 1
+    elif fade:
+        weights[overlap - fade:overlap + fade] = ramp
+    if last:
+        weights[size - overlap:] = 1
+    elif fade:
+        weights[size - overlap - fade:size - overlap + fade] = ramp[::-1]
+    return weights
+
+class BicubicUpscaler:
+    """Bicubic interpolation (the default backend)."""
+    # Bicubic taps reach 2 source pixels
+    halo = 2
+
+    def __init__(self, scale):
+        self.scale = scale
+
+    def upscale(self, image):
+        return upscale_image(image, scale_factor=self.scale)
+
+@contextmanager
+def thread_limits(threads):
+    """
+    Cap the intra-op threads of OpenCV DNN and the BLAS behind the numpy
+    engine while any caller is inside (the settings are process-wide, so
+    concurrent callers share the limit of the first); the previous settings
+    are restored when the last caller leaves.
+    """
+    if not threads:
+        yield
+        return
+    with _limits_lock:
+        if _limits_state['users'] == 0:
+            _limits_state['cv2'] = cv2.getNumThreads()
+            cv2.setNumThreads(threads)
+            if threadpool_limits is not None:
+                _limits_state['blas'] = threadpool_limits(limits=threads, user_api='blas')
+        _limits_state['users'] += 1
+    try:
+        yield
+    finally:
+        with _limits_lock:
+            _limits_state['users'] -= 1
+            if _limits_state['users'] == 0:
+                cv2.setNumThreads(_limits_state['cv2'])
+                if _limits_state['blas'] is not None:
+                    _limits_state['blas'].restore_original_limits()
+                    _limits_state['blas'] = None
+
+class SRUpscaler:
+    """
+    Tiled, batched inference of an SR network
+    The image is cut into tiles read with `overlap` source pixels of
+    context on each side; tiles run through the network `batch` at a time.
+    Outputs near a tile edge are unreliable (the network pads there), so
+    neighbours are cross-faded only over the part of the overlap beyond the
+    receptive field. With an overlap of at least the receptive field (the
+    default for numpy networks) the result matches a whole-image pass away
+    from the image border; for ONNX models, whose receptive field is
+    unknown, half the overlap is cross-faded.
+    """
+    def __init__(self, network, tile=128, overlap=None, batch=1, threads=None):
+        self.network = network
+        self.scale = network.scale
+        self.tile = tile
+        self.overlap = (network.halo if network.halo is not None else 16) if overlap is None else overlap
+        self.fade = self.overlap // 2 if network.halo is None else max(0, self.overlap - network.halo)
+        if 2 * self.fade > tile:
+            raise ValueError(f"Cross-fade of {self.fade} pixels does not fit tiles of {tile}")
+        self.halo = max(self.overlap, network.halo or 0)
+        self.batch = batch
+        # Intra-op threads during inference only (see thread_limits)
+        self.threads = threads
+        self._lock = threading.Lock()
+        self.stats = {'images': 0, 'tiles': 0, 'pixels': 0, 'seconds': 0.0}
+
+    def upscale(self, image):
+        """Upscale a 2-D or channels-last image; float32 output of the same layout."""
+        started = time.perf_counter()
+        height, width = image.shape[:2]
+        data = image.reshape(height, width, -1).astype(np.float32)
+        gray = data.shape[2] == 1 and self.network.channels == 3
+        if gray:
+            data = np.repeat(data, 3, axis=2)
+        elif data.shape[2] != self.network.channels:
+            raise ValueError(f"{self.network.name} takes {self.network.channels} channels, got {data.shape[2]}")
+        tile, overlap, scale = self.tile, self.overlap, self.scale
+        # Every tile gets the same input size (one batch shape); edge tiles see mirrored context
+        padded = np.pad(data, ((overlap, overlap + _round_up(height, tile) - height),
+                               (overlap, overlap + _round_up(width, tile) - width), (0, 0)), mode='reflect')
+        out = np.zeros((height * scale, width * scale, data.shape[2]), dtype=np.float32)
+        size = tile + 2 * overlap
+        windows = window_grid(height, width, size=tile)
+        with thread_limits(self.threads):
+            for start in range(0, len(windows), self.batch):
+                group = windows[start:start + self.batch]
+                result = self.network.forward(np.stack([padded[w.row:w.row + size, w.col:w.col + size]
+                                                        for w in group]))
+                for window, block in zip(group, result):
+                    self._blend(out, block, window, height, width)
+        if gray:
+            out = out.mean(axis=2, keepdims=True)
+        with self._lock:
+            self.stats['images'] += 1
+            self.stats['tiles'] += len(windows)
+            self.stats['pixels'] += height * width
+            self.stats['seconds'] += time.perf_counter() - started
+        return out[:, :, 0] if image.ndim == 2 else out
+
+    def _blend(self, out, block, window, height, width):
+        scale, size = self.scale, block.shape[0]
+        overlap, fade = self.overlap * scale, self.fade * scale
+        rows = _ramp(size, overlap, fade, window.row == 0, window.row + self.tile >= height)
+        cols = _ramp(size, overlap, fade, window.col == 0, window.col + self.tile >= width)
+        top, left = (window.row - self.overlap) * scale, (window.col - self.overlap) * scale
+        # Parts of the tile outside the image (padding) are dropped
+        r0, r1 = max(0, -top), min(size, height * scale - top)
+        c0, c1 = max(0, -left), min(size, width * scale - left)
+        weights = rows[r0:r1, None] * cols[None, c0:c1]
+        out[top + r0:top + r1, left + c0:left + c1] += block[r0:r1, c0:c1] * weights[:, :, None]
+
+    def megapixels_per_second(self, output=False):
+        """Throughput so far in source (or output) megapixels per second."""
+        with self._lock:
+            pixels, seconds = self.stats['pixels'], self.stats['seconds']
+        if output:
+            pixels *= self.scale ** 2
+        return pixels / 1e6 / seconds if seconds else 0.0
+
+def _round_up(value, multiple):
+    return -(-value // multiple) * multiple
+
+def _bicubic(params, scale):
+    return BicubicUpscaler(scale)
+
+def _sr_upscaler(network, params, scale):
+    if network.scale != scale:
+        raise ValueError(f"{network.name} upscales x{network.scale}, the enhancement chain needs x{scale}")
+    return SRUpscaler(network, tile=params.get('tile', 128), overlap=params.get('overlap'),
+                      batch=params.get('batch', 1), threads=params.get('threads'))
+
+def _model(params, scale):
+    network = load_network(params['model'], params.get('precision'), params.get('channels'))
+    return _sr_upscaler(network, params, scale)
+
+def _random(params, scale):
+    arch = params.get('arch', 'fsrcnn')
+    layers = random_weights(ARCHITECTURES[arch](scale, params.get('channels') or 1), params.get('seed', 0))
+    return _sr_upscaler(SRNetwork(layers, params.get('precision') or 'fp32', f'random {arch}'), params, scale)
+
+# Backend name -> factory(params, scale). A backend is any object with
+# `scale`, `halo` (source pixels of context it needs) and upscale(image).
+UPSCALERS = {
+    'bicubic': _bicubic,
+    'model': _model,
+    'random': _random,
+}
+
+def create_upscaler(params, scale):
+    """Upscaler of the enhancement chain from ENHANCEMENT_PARAMS['upscaler'] (bicubic when empty)."""
+    params = params or {}
+    backend = params.get('backend', 'bicubic')
+    if backend not in UPSCALERS:
+        raise ValueError(f"Unknown upscaler backend {backend!r}; available: {', '.join(UPSCALERS)}")
+    return UPSCALERS[backend](params, scale)
+
+def benchmark(upscaler, size=512, channels=1, repeat=3, seed=0):
+    """Best time of upscaling a random size x size image; returns (seconds, source MP/s, output MP/s)."""
+    image = np.random.default_rng(seed).random((size, size, channels) if channels > 1 else (size, size),
+                                               dtype=np.float32)
+    best = min(_timed(upscaler.upscale, image) for _ in range(repeat))
+    megapixels = size * size / 1e6
+    return best, megapixels / best, megapixels * upscaler.scale ** 2 / best
+
+def _timed(func, *args):
+    started = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU super-resolution engine: write test weights or measure throughput.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    init = commands.add_parser('init', help="Write randomly initialised weights to an .npz file")
+    init.add_argument('output')
+    bench = commands.add_parser('bench', help="Tiled inference throughput on a random image")
+    bench.add_argument('--model', help=".npz or .onnx model (default: random weights of --arch)")
+    bench.add_argument('--size', type=int, default=512)
+    bench.add_argument('--tile', type=int, default=128)
+    bench.add_argument('--overlap', type=int, default=None, help="Default: the receptive field of the network")
+    bench.add_argument('--batch', type=int, default=1)
+    bench.add_argument('--threads', type=int, default=None, help="Intra-op threads (default: all cores)")
+    bench.add_argument('--repeat', type=int, default=3)
+    for command in (init, bench):
+        command.add_argument('--arch', choices=sorted(ARCHITECTURES), default='fsrcnn')
+        command.add_argument('--scale', type=int, default=ENHANCEMENT_PARAMS['upscale_factor'])
+        command.add_argument('--channels', type=int, default=None)
+        command.add_argument('--precision', choices=PRECISIONS, default=None,
+                             help="Default: as stored in --model, else fp32")
+        command.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == 'init':
+        layers = random_weights(ARCHITECTURES[args.arch](args.scale, args.channels or 1), args.seed)
+        network = SRNetwork(layers, args.precision or 'fp32', f'random {args.arch}')
+        network.save(args.output)
+        print(f"[INFO] Saved random {args.arch} x{args.scale} weights ({network.precision}) to {args.output}")
+        return
+
+    params = {'backend': 'model' if args.model else 'random', 'model': args.model, 'arch': args.arch,
+              'channels': args.channels, 'precision': args.precision, 'seed': args.seed, 'tile': args.tile,
+              'overlap': args.overlap, 'batch': args.batch, 'threads': args.threads}
+    upscaler = create_upscaler(params, args.scale)
+    seconds, source_rate, output_rate = benchmark(upscaler, args.size, upscaler.network.channels, args.repeat)
+    print(f"[INFO] {upscaler.network.name} x{upscaler.scale} ({upscaler.network.precision}, tile {upscaler.tile}, "
+          f"overlap {upscaler.overlap}, batch {upscaler.batch}): {args.size}x{args.size} in {seconds:.3f}s, "
+          f"{source_rate:.2f} MP/s in, {output_rate:.2f} MP/s out")
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,102 @@
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
+import pywt
 from skimage import exposure, restoration
 from skimage.filters import unsharp_mask
+from image_enhancement.utils.tiled_pipeline import (ordered_map, queue_depth, wavelet_denoise, wavelet_levels,
+                                                    wavelet_thresholds)
+from utils.cog_reader import crop_halo, window_grid
+
+UINT16_LEVELS = 65536
+# Gaussian of unsharp_mask(radius=1): truncated at 4 sigma
+UNSHARP_HALO = 4
+
+def _clahe_regions(shape, grid):
+    """(region height, region width, regions down, regions across) of the CLAHE grid."""
+    region_h = -(-shape[0] // min(grid, shape[0]))
+    region_w = -(-shape[1] // min(grid, shape[1]))
+    return region_h, region_w, -(-shape[0] // region_h), -(-shape[1] // region_w)
+
+def _bins(value, nbins):
+    """Histogram bin of every uint16 value (integer arithmetic, no float conversion)."""
+    return ((value.astype(np.uint32) * nbins) >> 16).astype(np.int32)
+
+def clahe_histograms(value, row, col, regions, nbins):
+    """Histograms of a uint16 tile at (row, col), split by CLAHE region (summed over tiles)."""
+    region_h, region_w, down, across = regions
+    region = (np.arange(row, row + value.shape[0]) // region_h)[:, None] * across + \
+        (np.arange(col, col + value.shape[1]) // region_w)[None, :]
+    keys = (region * nbins).astype(np.int32) + _bins(value, nbins)
+    return np.bincount(keys.ravel(), minlength=down * across * nbins).reshape(-1, nbins)
+
+def clahe_luts(histograms, clip_limit, nbins):
+    """
+    Clipped, equalized mapping of every region as a lookup table per bin
+    Args:
+        histograms: (regions, nbins) counts from clahe_histograms
+        clip_limit: Fraction of a region's pixels a bin may hold (skimage convention)
+    Returns:
+        (regions, nbins) float32 array of output levels in [0, 1]
+    """
+    hist = histograms.astype(np.float64)
+    counts = np.maximum(hist.sum(axis=1, keepdims=True), 1)
+    if 0 < clip_limit < 1:
+        limit = np.maximum(clip_limit * counts, 1)
+        excess = np.maximum(hist - limit, 0).sum(axis=1, keepdims=True)
+        hist = np.minimum(hist, limit) + excess / nbins
+    return np.clip(np.cumsum(hist, axis=1) / counts, 0, 1).astype(np.float32)
+
+def _interpolation(start, length, size, count):
+    """Lower region, upper region and upper weight along one axis (bilinear between region centres)."""
+    centre = (np.arange(start, start + length) + 0.5) / size - 0.5
+    lower = np.clip(np.floor(centre), 0, count - 1).astype(np.int64)
+    upper = np.minimum(lower + 1, count - 1)
+    weight = np.clip(centre - lower, 0, 1).astype(np.float32)
+    return lower, upper, weight
+
+def apply_clahe(value, row, col, luts, regions):
+    """CLAHE of a uint16 tile at (row, col) through the region LUTs; float32 in [0, 1]."""
+    region_h, region_w, down, across = regions
+    nbins = luts.shape[1]
+    top, bottom, wy = _interpolation(row, value.shape[0], region_h, down)
+    left, right, wx = _interpolation(col, value.shape[1], region_w, across)
+    # The tables are small enough to stay in cache for the four gathers per pixel
+    flat = luts.reshape(-1)
+    bins = _bins(value, nbins)
+
+    def lookup(rows, cols):
+        return flat.take(((rows[:, None] * across + cols[None, :]) * nbins).astype(np.int32) + bins)
+
+    wx = wx[None, :]
+    upper = lookup(top, left) * (1 - wx) + lookup(top, right) * wx
+    lower = lookup(bottom, left) * (1 - wx) + lookup(bottom, right) * wx
+    return upper * (1 - wy[:, None]) + lower * wy[:, None]
+
+def _value(image):
+    """HSV value (channel maximum) of RGB, the image itself when gray."""
+    if image.ndim == 2:
+        return image
+    # Pairwise maxima are much faster than a reduction over the short channel axis
+    return np.maximum(np.maximum(image[:, :, 0], image[:, :, 1]), image[:, :, 2])
+
+def _with_value(image, value):
+    """Replace the HSV value of RGB (or the gray level) by `value`, keeping hue and saturation."""
+    if image.ndim == 2:
+        return value
+    current = _value(image)
+    ratio = value / np.maximum(current, np.finfo(np.float32).tiny)
+    # Black pixels have no hue or saturation: they become gray at the new value
+    return np.where(current[:, :, None] > 0, image * ratio[:, :, None], value[:, :, None])
 
 class TIFFEnhancer:
-    def __init__(self, denoise_weight=0.1, contrast_limit=0.3, sharpness=1.0):
+    def __init__(self, denoise_weight=0.1, contrast_limit=0.3, sharpness=1.0, clahe_grid=8, clahe_bins=256):
         self.denoise_weight = denoise_weight
         self.contrast_limit = contrast_limit
         self.sharpness = sharpness
+        self.clahe_grid = clahe_grid
+        self.clahe_bins = clahe_bins
         
     def enhance_tiff(self, image):
         """
@@ -41,6 +130,74 @@ class TIFFEnhancer:
         
         return sharpened
 
+    def enhance_tiles(self, image, tile_size=1024, output_tile=512, workers=None):
+        """
+        Tiled version of enhance_tiff for large scenes
+        The wavelet denoise uses thresholds of the whole image (as enhance_tiff
+        does) and is stored as uint16 in a temporary file. CLAHE runs natively
+        on uint16: region histograms are summed over the tiles and applied
+        through lookup tables, bilinearly between region centres (OpenCV's
+        scheme), on the HSV value of RGB images. Unsharp masking runs per tile
+        with a halo.
+        Args:
+            image: Input numpy array (2-D, or RGB with channels last), or a
+                COGReader, whose tiles are read as needed (after a pass for
+                the value range) instead of holding the scene in memory
+            tile_size: Tile size of the denoise pass
+            output_tile: Size of the yielded tiles (a multiple of 16 for write_cog)
+            workers: Threads per image (default: CPU count)
+        Returns:
+            Generator of uint16 output tiles in row-major order
+        """
+        shape = image.shape
+        if hasattr(image, 'read_window'):
+            read = image.read_window
+            ranges = [(tile.min(), tile.max()) for _, tile in image.iter_windows(tile_size)]
+            low, high = np.float32(min(r[0] for r in ranges)), np.float32(max(r[1] for r in ranges))
+        else:
+            def read(row, col, height, width):
+                return image[row:row + height, col:col + width]
+            low, high = np.float32(image.min()), np.float32(image.max())
+        params = {'sigma': self.denoise_weight, 'wavelet': 'db1', 'mode': 'soft'}
+        wavelet = pywt.Wavelet(params['wavelet'])
+        levels = wavelet_levels(shape, params)
+        # Haar tiles aligned to 2**levels decompose exactly like the whole image
+        tile_size = -(-tile_size // 2 ** levels) * 2 ** levels
+        regions = _clahe_regions(shape, self.clahe_grid)
+        denoised = np.memmap(tempfile.TemporaryFile(), dtype=np.uint16, mode='w+', shape=shape)
+        depth = queue_depth(workers)
+
+        def normalized(window):
+            tile = read(window.row, window.col, window.height, window.width)
+            return (tile.astype(np.float32) - low) / (high - low)
+
+        def denoise(window):
+            tile = wavelet_denoise(normalized(window), wavelet, levels, thresholds, params['mode'], clip_range)
+            tile = np.round(tile * (UINT16_LEVELS - 1)).astype(np.uint16)
+            denoised[window.row:window.row + window.height, window.col:window.col + window.width] = tile
+            return clahe_histograms(_value(tile), window.row, window.col, regions, self.clahe_bins)
+
+        def enhance(window):
+            rows = slice(window.row - window.top, window.row + window.height + window.bottom)
+            cols = slice(window.col - window.left, window.col + window.width + window.right)
+            tile = np.asarray(denoised[rows, cols])
+            equalized = apply_clahe(_value(tile), rows.start, cols.start, luts, regions)
+            enhanced = _with_value(tile.astype(np.float32) / (UINT16_LEVELS - 1), equalized)
+            sharpened = crop_halo(unsharp_mask(enhanced, radius=1, amount=self.sharpness), window)
+            out = (sharpened * (UINT16_LEVELS - 1)).astype(np.uint16)
+            return [out[:, col:col + output_tile] for col in range(0, out.shape[1], output_tile)]
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            windows = window_grid(*shape[:2], size=tile_size)
+            thresholds, clip_range = wavelet_thresholds(normalized, windows, params, levels, pool, depth)
+            luts = clahe_luts(sum(ordered_map(pool, denoise, windows, depth)), self.contrast_limit,
+                              self.clahe_bins)
+            # Bands one output tile high so results stream to the writer in row-major order
+            width = -(-tile_size // output_tile) * output_tile
+            bands = window_grid(*shape[:2], size=(output_tile, width), halo=UNSHARP_HALO)
+            for tiles in ordered_map(pool, enhance, bands, depth):
+                yield from tiles
+
 def prepare_image(image):
     """
     Prepare image for enhancement
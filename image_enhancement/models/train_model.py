@@ -1,41 +1,167 @@
+import argparse
+import hashlib
+import json
 import os
-import tifffile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 import numpy as np
+import tiff_enhancer
 from tiff_enhancer import TIFFEnhancer
+from image_enhancement.config import BATCH_ENHANCE_PARAMS
+from utils.cog_reader import open_cog
+from utils.cog_writer import read_georef, write_cog
+from utils.stage_cache import code_version
+
+READ_BLOCK = 1 << 22
+
+def is_derived(filename, params=BATCH_ENHANCE_PARAMS):
+    """Outputs of this or other stages (enhanced_*, masks) are never enhanced again."""
+    return filename.startswith(tuple(params['skip_prefixes']))
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(path, manifest):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def file_digest(path, entry=None):
+    """
+    SHA-256 of a file's bytes, reused from its manifest entry while the
+    file's size and mtime are unchanged. Returns (digest, [size, mtime_ns]).
+    """
+    stat = os.stat(path)
+    file_stat = [stat.st_size, stat.st_mtime_ns]
+    if entry and entry.get('input_stat') == file_stat and entry.get('input_digest'):
+        return entry['input_digest'], file_stat
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_BLOCK), b''):
+            h.update(block)
+    return h.hexdigest(), file_stat
+
+def enhance_file(input_path, output_path, params=BATCH_ENHANCE_PARAMS, workers=None):
+    """
+    Enhance one TIFF tile by tile and stream it to a 16-bit COG with the input
+    georeference. The COG is written next to output_path and renamed over it
+    once complete, so a failed run never leaves a truncated output behind.
+    """
+    enhancer = TIFFEnhancer(denoise_weight=params['denoise_weight'], contrast_limit=params['contrast_limit'],
+                            sharpness=params['sharpness'], clahe_grid=params['clahe_grid'],
+                            clahe_bins=params['clahe_bins'])
+    tmp_path = f"{output_path}.tmp"
+    try:
+        with open_cog(input_path) as reader:
+            tiles = enhancer.enhance_tiles(reader, params['tile_size'], params['output_tile'], workers)
+            result = write_cog(tmp_path, tiles, shape=reader.shape, dtype=np.uint16, tile=params['output_tile'],
+                               georef=read_georef(input_path))
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return result
+
+def _enhance_job(job):
+    # Runs in a worker process; errors are reported back instead of raised
+    filename, input_path, output_path, params, workers = job
+    try:
+        enhance_file(input_path, output_path, params, workers)
+        return filename, None
+    except Exception as e:
+        return filename, str(e)
+
+def _job_result(future, filename):
+    # A worker killed by the OS (e.g. out of memory) breaks the pool: every pending file fails
+    try:
+        return future.result()
+    except BrokenProcessPool as e:
+        return filename, f"worker process died ({e or type(e).__name__})"
+
+def enhance_images(input_dir='figures', params=BATCH_ENHANCE_PARAMS, workers=None, force=False):
+    """
+    Enhance all TIFF images in the input directory across a process pool
+    Derived outputs are skipped, and inputs whose bytes and enhancement
+    code/parameters match the manifest entry of an existing output are not
+    processed again (force=True reprocesses everything). Input digests are
+    kept in the manifest next to the outputs and only recomputed when a
+    file's size or mtime changes.
+    """
+    tiff_files = sorted(f for f in os.listdir(input_dir)
+                        if f.lower().endswith(('.tif', '.tiff')) and not is_derived(f, params))
 
-def enhance_images(input_dir='figures'):
-    """Process all TIFF images in the input directory"""
-    # Initialize enhancer
-    enhancer = TIFFEnhancer(denoise_weight=0.1, contrast_limit=0.3, sharpness=1.0)
-    
-    # Get all TIFF files
-    tiff_files = [f for f in os.listdir(input_dir) if f.endswith('.tiff')]
-    
     if not tiff_files:
         print(f"No TIFF files found in {input_dir}")
         return
-    
+
     print(f"Found {len(tiff_files)} TIFF files to process")
-    
-    # Process each file
+
+    manifest_path = os.path.join(input_dir, params['manifest'])
+    manifest = load_manifest(manifest_path)
+    version = code_version(json.dumps(params, sort_keys=True), tiff_enhancer, enhance_file)
+
+    jobs, digests = [], {}
     for filename in tiff_files:
         input_path = os.path.join(input_dir, filename)
         output_path = os.path.join(input_dir, f'enhanced_{filename}')
-        
+        entry = manifest.get(filename, {})
+        digests[filename] = file_digest(input_path, entry)
+        if (not force and os.path.exists(output_path) and entry.get('input_digest') == digests[filename][0]
+                and entry.get('version') == version):
+            print(f"Skipping {filename}: unchanged since {entry['output']} was written")
+            continue
         print(f"Processing {filename}...")
-        
-        # Load and enhance image
-        try:
-            image = tifffile.imread(input_path)
-            enhanced = enhancer.enhance_tiff(image)
-            
-            # Save enhanced image
-            tifffile.imwrite(output_path, 
-                           (enhanced * 65535).astype(np.uint16))  # Convert back to 16-bit
-            print(f"Saved enhanced image to {output_path}")
-            
-        except Exception as e:
-            print(f"Error processing {filename}: {str(e)}")
+        jobs.append([filename, input_path, output_path])
+
+    if not jobs:
+        print("All enhanced images are up to date")
+        return
+
+    # An output being rewritten is not up to date until its job succeeds (e.g. a worker killed mid-write)
+    for filename, _, _ in jobs:
+        manifest.pop(filename, None)
+    save_manifest(manifest_path, manifest)
+
+    # One file per process; the tile threads share the remaining cores
+    processes = min(workers or params.get('workers') or os.cpu_count() or 1, len(jobs))
+    threads = max(1, (os.cpu_count() or 1) // processes)
+    jobs = [(filename, input_path, output_path, params, threads) for filename, input_path, output_path in jobs]
+    if processes == 1:
+        results = map(_enhance_job, jobs)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=processes)
+        futures = {pool.submit(_enhance_job, job): job[0] for job in jobs}
+        results = (_job_result(future, futures[future]) for future in as_completed(futures))
+
+    try:
+        for filename, error in results:
+            if error is not None:
+                print(f"Error processing {filename}: {error}")
+                continue
+            output = f'enhanced_{filename}'
+            digest, file_stat = digests[filename]
+            manifest[filename] = {'input_digest': digest, 'input_stat': file_stat, 'version': version,
+                                  'output': output}
+            # Saved after every file so an interrupted batch keeps its progress
+            save_manifest(manifest_path, manifest)
+            print(f"Saved enhanced image to {os.path.join(input_dir, output)}")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description="Enhance every TIFF in a directory (skipping unchanged inputs).")
+    parser.add_argument('--input-dir', default='figures')
+    parser.add_argument('--workers', type=int, default=None, help="Files processed in parallel")
+    parser.add_argument('--force', action='store_true', help="Reprocess inputs listed as up to date")
+    args = parser.parse_args()
+    enhance_images(args.input_dir, workers=args.workers, force=args.force)
 
 if __name__ == '__main__':
-    enhance_images()
+    main()
@@ -2,10 +2,12 @@ import cv2
 import numpy as np
 from skimage import exposure, restoration
 import tifffile
+from utils.cog_reader import read_image
+from utils.cog_writer import write_cog
 
 def load_image(image_path, max_size=2048):
-    """Load image using tifffile for TIFF images and resize if too large."""
-    image = tifffile.imread(image_path)
+    """Load image through the shared COG reader and resize if too large."""
+    image = read_image(image_path)
     
     # Get current dimensions
     height, width = image.shape[:2]
@@ -19,9 +21,12 @@ def load_image(image_path, max_size=2048):
     
     return image
 
-def save_image(image, output_path):
-    """Save image using tifffile for TIFF images."""
-    tifffile.imwrite(output_path, image)
+def save_image(image, output_path, georef=None):
+    """Save TIFFs as tiled, compressed COGs with overviews."""
+    if str(output_path).lower().endswith(('.tif', '.tiff')):
+        write_cog(output_path, image, georef=georef)
+    else:
+        tifffile.imwrite(output_path, image)
 
 def convert_to_grayscale(image):
     """Convert RGB image to grayscale."""
@@ -37,30 +42,14 @@ def denoise_image(image, method='wavelet', **kwargs):
         wavelet = kwargs.pop('wavelet', 'db1')
         mode = kwargs.pop('mode', 'soft')
         
-        # Process in chunks if image is large
-        if image.size > 1000000:  # 1 million pixels
-            chunks = np.array_split(image, 4)  # Split into 4 chunks
-            denoised_chunks = []
-            for chunk in chunks:
-                denoised = restoration.denoise_wavelet(
-                    chunk,
-                    sigma=sigma,
-                    wavelet=wavelet,
-                    mode=mode,
-                    channel_axis=None,
-                    **kwargs
-                )
-                denoised_chunks.append(denoised)
-            return np.concatenate(denoised_chunks)
-        else:
-            return restoration.denoise_wavelet(
-                image,
-                sigma=sigma,
-                wavelet=wavelet,
-                mode=mode,
-                channel_axis=None,
-                **kwargs
-            )
+        return restoration.denoise_wavelet(
+            image,
+            sigma=sigma,
+            wavelet=wavelet,
+            mode=mode,
+            channel_axis=None,
+            **kwargs
+        )
     elif method == 'nlmeans':
         return cv2.fastNlMeansDenoising(image, None, **kwargs)
     else:
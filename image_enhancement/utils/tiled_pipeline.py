@@ -0,0 +1,343 @@
+import math
+import os
+import tempfile
+import threading
+import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pywt
+import tifffile
+from skimage import exposure, img_as_float
+from image_enhancement.models import sr_engine
+from image_enhancement.models.sr_engine import create_upscaler
+from utils.cog_reader import crop_halo, window_grid
+from utils.cog_writer import georef_tags, write_cog
+from utils.instrumentation import stage
+from utils.stage_cache import StageCache, code_version
+from .image_processing import convert_to_grayscale, denoise_image, upscale_image, sharpen_image
+
+# 75th percentile of the standard normal distribution (scipy.stats.norm.ppf(0.75))
+NORMAL_Q75 = 0.6744897501960817
+# warnings.catch_warnings swaps process-wide state; tile threads take turns
+_warnings_lock = threading.Lock()
+
+def _round_up(value, multiple):
+    return -(-value // multiple) * multiple
+
+def queue_depth(workers):
+    return 2 * (workers or os.cpu_count() or 1)
+
+def ordered_map(pool, func, items, depth):
+    """Like pool.map, but with at most `depth` tasks in flight so results stream in order."""
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(func, item))
+        if len(pending) >= depth:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def wavelet_levels(shape, denoise_params):
+    """Decomposition depth denoise_wavelet would pick for the whole image."""
+    levels = denoise_params.get('wavelet_levels')
+    if levels is None:
+        wavelet = pywt.Wavelet(denoise_params.get('wavelet', 'db1'))
+        levels = max(pywt.dwtn_max_level(shape, wavelet) - 3, 1)
+    return levels
+
+def _wavelet_halo(wavelet, levels):
+    """Halo covering the analysis + synthesis footprint of a multi-level DWT.
+
+    Haar tiles aligned to 2**levels decompose exactly like the whole image and
+    need no halo; longer filters spread across tile borders at every level.
+    """
+    if wavelet.dec_len == 2:
+        return 0
+    return _round_up(2 * (wavelet.dec_len - 1) * 2 ** levels, 2 ** levels)
+
+def _nlmeans_halo(denoise_params):
+    return denoise_params.get('templateWindowSize', 7) // 2 + denoise_params.get('searchWindowSize', 21) // 2
+
+def _scaled_sigma(sigma, gray_min, gray_max):
+    """Rescale sigma the way denoise_wavelet does when converting to float."""
+    gray_range = np.array([gray_min, gray_max])
+    if gray_range.dtype.kind == 'f':
+        return sigma
+    as_float = img_as_float(gray_range)
+    return sigma * ((as_float[1] - as_float[0]) / (gray_max - gray_min))
+
+def _wavedecn(image, wavelet, levels):
+    """pywt.wavedecn at the whole-image depth.
+
+    Edge tiles narrower than 2**levels make pywt warn that the level is too
+    high; that is expected, their coefficients still line up with the
+    whole-image decomposition, so the warning is silenced for those tiles.
+    """
+    if pywt.dwtn_max_level(image.shape, wavelet) >= levels:
+        return pywt.wavedecn(image, wavelet=wavelet, level=levels)
+    with _warnings_lock, warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="Level value of .* is too high", category=UserWarning)
+        return pywt.wavedecn(image, wavelet=wavelet, level=levels)
+
+def sigma_estimate(detail_coeffs):
+    """Robust median noise estimate of finest detail coefficients, as skimage's estimate_sigma."""
+    # Coefficients exactly zero are treated as masked out
+    detail_coeffs = detail_coeffs[np.nonzero(detail_coeffs)]
+    return np.median(np.abs(detail_coeffs)) / NORMAL_Q75
+
+def wavelet_stats(gray, wavelet, levels, estimate_sigma):
+    """Per-tile pieces of the global statistics BayesShrink needs."""
+    coeffs = _wavedecn(img_as_float(gray), wavelet, levels)
+    sums = [{key: float(np.sum(d * d)) for key, d in level.items()} for level in coeffs[1:]]
+    counts = [{key: d.size for key, d in level.items()} for level in coeffs[1:]]
+    finest = coeffs[-1]['d' * gray.ndim]
+    estimate = sigma_estimate(finest) if estimate_sigma and finest.size else 0.0
+    return gray.min(), gray.max(), sums, counts, finest.size, estimate
+
+def wavelet_thresholds(read, windows, denoise_params, levels, pool, depth):
+    """BayesShrink thresholds of the whole image, accumulated tile by tile.
+
+    read(window) returns the (halo-free) tile to denoise; tiles may have any
+    number of dimensions. Returns (thresholds per level and detail key, clip
+    range of the output).
+    """
+    wavelet = pywt.Wavelet(denoise_params.get('wavelet', 'db1'))
+    sigma = denoise_params.get('sigma')
+
+    def stats(window):
+        tile = read(window)
+        with stage('enhance.wavelet_stats', allocations=False):
+            return wavelet_stats(tile, wavelet, levels, sigma is None)
+
+    gray_min = gray_max = None
+    sums = counts = None
+    estimates, weights = [], []
+    for tile_min, tile_max, tile_sums, tile_counts, finest_size, estimate in ordered_map(pool, stats, windows, depth):
+        gray_min = tile_min if gray_min is None else min(gray_min, tile_min)
+        gray_max = tile_max if gray_max is None else max(gray_max, tile_max)
+        if sums is None:
+            sums, counts = tile_sums, tile_counts
+        else:
+            for level, tile_level, count, tile_count in zip(sums, tile_sums, counts, tile_counts):
+                for key in level:
+                    level[key] += tile_level[key]
+                    count[key] += tile_count[key]
+        estimates.append(estimate)
+        weights.append(finest_size)
+
+    if sigma is None:
+        # The noise estimate is a median, approximated by the weighted median of the tile estimates
+        order = np.argsort(estimates)
+        cumulative = np.cumsum(np.asarray(weights)[order])
+        sigma = float(np.asarray(estimates)[order][np.searchsorted(cumulative, cumulative[-1] / 2)])
+    else:
+        sigma = _scaled_sigma(sigma, gray_min, gray_max)
+
+    var = sigma ** 2
+    eps = np.finfo(np.float64).eps
+    thresholds = [
+        {key: var / np.sqrt(max(level[key] / count[key] - var, eps)) for key in level}
+        for level, count in zip(sums, counts)
+    ]
+    clip_range = (-1, 1) if img_as_float(np.array([gray_min])).min() < 0 else (0, 1)
+    return thresholds, clip_range
+
+def wavelet_denoise(gray, wavelet, levels, thresholds, mode, clip_range):
+    """denoise_wavelet on one tile with precomputed thresholds."""
+    image = img_as_float(gray)
+    coeffs = _wavedecn(image, wavelet, levels)
+    denoised = [coeffs[0]] + [
+        {key: pywt.threshold(level[key], value=thresh[key], mode=mode) for key in level}
+        for thresh, level in zip(thresholds, coeffs[1:])
+    ]
+    out = pywt.waverecn(denoised, wavelet)[tuple(slice(s) for s in image.shape)]
+    out = out.astype(image.dtype)
+    return np.clip(out, *clip_range, out=out)
+
+def denoise_tiles(reader, denoise_params, tile_size=1024, workers=None):
+    """
+    Grayscale + denoise the scene tile by tile into a disk-backed buffer.
+    Returns (buffer, min, max); the range feeds the global contrast stretch.
+    """
+    params = dict(denoise_params)
+    method = params.pop('method', 'wavelet')
+    shape = (reader.height, reader.width)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        if method == 'wavelet':
+            wavelet = pywt.Wavelet(params.get('wavelet', 'db1'))
+            levels = wavelet_levels(shape, params)
+            block = 2 ** levels
+            tile_size = _round_up(tile_size, block)
+            halo = _wavelet_halo(wavelet, levels)
+
+            def read(window):
+                with stage('enhance.load', allocations=False):
+                    tile = reader.read_window(window.row, window.col, window.height, window.width)
+                return convert_to_grayscale(tile)
+
+            thresholds, clip_range = wavelet_thresholds(
+                read, window_grid(*shape, size=tile_size), params, levels, pool, queue_depth(workers))
+            dtype = img_as_float(np.zeros(1, dtype=reader.dtype)).dtype
+
+            def denoise(gray):
+                return wavelet_denoise(gray, wavelet, levels, thresholds, params.get('mode', 'soft'), clip_range)
+        elif method == 'nlmeans':
+            halo = _nlmeans_halo(params)
+            dtype = reader.dtype
+
+            def denoise(gray):
+                return denoise_image(gray, method, **params)
+        else:
+            raise ValueError(f"Unknown denoising method: {method}")
+
+        buffer = np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode='w+', shape=shape)
+
+        def process(window):
+            with stage('enhance.load', allocations=False):
+                tile = reader.read_halo_window(window)
+            with stage('enhance.preprocess', allocations=False):
+                core = crop_halo(denoise(convert_to_grayscale(tile)), window)
+            buffer[window.row:window.row + window.height, window.col:window.col + window.width] = core
+            return core.min(), core.max()
+
+        windows = window_grid(*shape, size=tile_size, halo=halo)
+        ranges = list(ordered_map(pool, process, windows, queue_depth(workers)))
+    low = min(r[0] for r in ranges)
+    high = max(r[1] for r in ranges)
+    return buffer, low, high
+
+def enhance_tiles(denoised, value_range, enhancement_params, tile_params):
+    """
+    Yield output tiles of the contrast stretch -> upscale -> sharpen chain in
+    row-major order. Each worker window is one output tile high and a whole
+    number of output tiles wide, so results stream straight to the writer.
+    """
+    scale = enhancement_params['upscale_factor']
+    kernel = np.array(enhancement_params['sharpening_kernel'])
+    out_tile = _round_up(tile_params.get('output_tile', 512), math.lcm(16, scale))
+    band = out_tile // scale
+    width = _round_up(tile_params.get('tile_size', 1024), band)
+    upscaler = create_upscaler(enhancement_params.get('upscaler'), scale)
+    # The upscaler reaches its halo in source pixels (bicubic: 2); the sharpening kernel its radius in output pixels
+    halo = upscaler.halo + -(-(max(kernel.shape) // 2) // scale)
+    dtype = np.dtype(tile_params.get('output_dtype', 'float32'))
+
+    def process(window):
+        tile = np.asarray(denoised[
+            window.row - window.top:window.row + window.height + window.bottom,
+            window.col - window.left:window.col + window.width + window.right
+        ])
+        if enhancement_params.get('contrast_stretch', True):
+            with stage('enhance.contrast', allocations=False):
+                tile = exposure.rescale_intensity(tile, in_range=value_range)
+        with stage('enhance.upscale', allocations=False):
+            upscaled = upscaler.upscale(tile)
+        with stage('enhance.sharpen', allocations=False):
+            sharpened = sharpen_image(upscaled, kernel)
+        top, left = window.top * scale, window.left * scale
+        out = sharpened[top:top + window.height * scale, left:left + window.width * scale].astype(dtype)
+        return [out[:, col:col + out_tile] for col in range(0, out.shape[1], out_tile)]
+
+    windows = window_grid(*denoised.shape, size=(band, width), halo=halo)
+    workers = tile_params.get('workers')
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for tiles in ordered_map(pool, process, windows, queue_depth(workers)):
+            yield from tiles
+
+def collect_tiles(tiles, out, tile):
+    """Pass row-major tiles through while copying them into the full array out."""
+    across = -(-out.shape[1] // tile)
+    for index, block in enumerate(tiles):
+        row, col = divmod(index, across)
+        out[row * tile:row * tile + block.shape[0], col * tile:col * tile + block.shape[1]] = block
+        yield block
+
+def _preprocess_stage(source_key, denoise_params):
+    # Results do not depend on the tiling or worker count, so those stay out of the keys
+    return dict(
+        inputs=[source_key],
+        params=denoise_params,
+        version=code_version(denoise_tiles, wavelet_levels, wavelet_thresholds, wavelet_stats,
+                             wavelet_denoise, _scaled_sigma, denoise_image, convert_to_grayscale),
+    )
+
+def _enhance_stage(cache, source_key, denoise_params, enhancement_params, tile_params):
+    scale = enhancement_params['upscale_factor']
+    out_tile = _round_up(tile_params.get('output_tile', 512), math.lcm(16, scale))
+    dtype = np.dtype(tile_params.get('output_dtype', 'float32'))
+    inputs = [cache.key('preprocess', **_preprocess_stage(source_key, denoise_params))]
+    upscaler = enhancement_params.get('upscaler') or {}
+    if upscaler.get('backend') == 'model':
+        # Replacing the weights file invalidates the enhanced output
+        inputs.append(Path(upscaler['model']))
+    return dict(
+        inputs=inputs,
+        params=dict(enhancement_params, output_tile=out_tile, output_dtype=dtype.name),
+        version=code_version(enhance_tiles, enhance_tiled, upscale_image, sharpen_image, write_cog, sr_engine),
+    )
+
+def enhanced_key(cache, source_key, denoise_params, enhancement_params, tile_params):
+    """Stage cache key the enhanced image of a source is stored under."""
+    return cache.key('enhance', **_enhance_stage(cache, source_key, denoise_params, enhancement_params, tile_params))
+
+def enhance_tiled(reader, output_path, denoise_params, enhancement_params, tile_params, cache=None, source_key=None,
+                  out=None):
+    """
+    Run the full enhancement chain tile by tile and stream the result to a
+    compressed COG carrying the source georeference. Peak memory is bounded
+    by the tile size: the denoised scene is kept in a temporary file and only
+    in-flight tiles are held in memory.
+    With a StageCache and the key of the source file, the denoised scene and
+    the enhanced COG are reused when their inputs and parameters are unchanged.
+    With `out` (an array of the output shape and dtype) the tiles are also
+    collected in memory; output_path may then be None to skip the file.
+    Returns the output shape.
+    """
+    if cache is None or source_key is None:
+        cache = StageCache(enabled=False)
+    scale = enhancement_params['upscale_factor']
+    shape = (reader.height * scale, reader.width * scale)
+    dtype = np.dtype(tile_params.get('output_dtype', 'float32'))
+    out_tile = _round_up(tile_params.get('output_tile', 512), math.lcm(16, scale))
+    written = False
+
+    def denoise():
+        return denoise_tiles(reader, denoise_params, tile_params.get('tile_size', 1024), tile_params.get('workers'))
+
+    def write(path):
+        nonlocal written
+        written = True
+        (denoised, low, high), _ = cache.run('preprocess', denoise, **_preprocess_stage(source_key, denoise_params))
+        tiles = enhance_tiles(denoised, (low, high), enhancement_params, tile_params)
+        if out is not None:
+            tiles = collect_tiles(tiles, out, out_tile)
+        if path is None:
+            deque(tiles, maxlen=0)
+            return
+        # Tiles are produced while the writer consumes them, so this includes the tile stages
+        with stage('enhance.save'):
+            write_cog(
+                path,
+                tiles,
+                shape=shape,
+                dtype=dtype,
+                tile=out_tile,
+                georef=georef_tags(reader.tags, scale),
+                maxworkers=tile_params.get('workers'),
+            )
+
+    if output_path is None:
+        write(None)
+        return shape
+    cache.run_file(
+        'enhance', write, output_path,
+        **_enhance_stage(cache, source_key, denoise_params, enhancement_params, tile_params)
+    )
+    if out is not None and not written:
+        # Cache hit: the enhanced image only exists as the copied file
+        tifffile.imread(output_path, out=out)
+    return shape
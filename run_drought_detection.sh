@@ -13,7 +13,10 @@ source venv/bin/activate
 # Install required packages
 echo -e "\n[2/3] Installing dependencies..."
 pip install --upgrade pip
-pip install numpy opencv-python scikit-image matplotlib
+pip install numpy opencv-python scikit-image
+
+# Ensure PYTHONPATH includes project root for shared utils
+export PYTHONPATH="$(pwd):$PYTHONPATH"
 
 # Run drought detection
 echo -e "\n[3/3] Running drought detection..."
@@ -13,7 +13,10 @@ source venv/bin/activate
 # Install required packages
 echo -e "\n[2/3] Installing dependencies..."
 pip install --upgrade pip
-pip install numpy opencv-python
+pip install numpy opencv-python tifffile imagecodecs
+
+# Ensure PYTHONPATH includes project root for shared utils
+export PYTHONPATH="$(pwd):$PYTHONPATH"
 
 # Run fire detection
 echo -e "\n[3/3] Running fire detection..."
@@ -0,0 +1,272 @@
+import argparse
+import os
+import tempfile
+from contextlib import nullcontext
+from pathlib import Path
+import cv2
+import numpy as np
+from carbon_detection.config import CARBON_DETECTION, CARBON_MASK
+from carbon_detection.utils.carbon_detection import create_carbon_heatmap, process_image, save_image
+from drought_detection.config import DROUGHT_PARAMS
+from drought_detection.utils.drought_detection import detect_drought
+from fire_detection.config import FIRE_PARAMS
+from fire_detection.utils.fire_detection import create_heatmap
+from image_enhancement.config import (CACHE_PARAMS, DENOISE_PARAMS, ENHANCED_IMAGE, ENHANCEMENT_PARAMS,
+                                      INPUT_IMAGE, TILE_PARAMS)
+from image_enhancement.utils.tiled_pipeline import enhance_tiled, enhanced_key
+from utils.cog_reader import open_cog
+from utils.cog_writer import georef_tags, read_georef
+from utils.colormap import render_heatmap
+from utils.convert_to_png import to_uint8
+from utils.fused_detection import to_rgb
+from utils.instrumentation import Instrumentation, print_report, stage
+from utils.pipeline import Pipeline
+from utils.stac_catalog import open_catalog
+from utils.stage_cache import StageCache
+from utils.tile_stats import TileStats, TileStatsStore
+
+# Usage: python run_pipeline.py [--outputs fire_mask carbon_heatmap ...] [--workers 3] [--report run.json]
+# Replaces the chain of module mains in setup_and_run.sh with one process:
+# the scene is decoded once and arrays are handed between stages in memory.
+
+FIGURES_DIR = Path(__file__).resolve().parent / "figures"
+PNG_DIR = FIGURES_DIR / "png"
+
+# Output name -> file, relative to figures/
+OUTPUTS = {
+    "tci_png": "png/TCI_COG.png",
+    "original_png": "png/original_TCI.png",
+    "enhanced": ENHANCED_IMAGE,
+    "enhanced_png": "png/enhanced_TCI_COG.png",
+    "fire_heatmap": "png/fire_heatmap.png",
+    "fire_mask": "png/fire_mask.png",
+    "drought_visualization": "png/drought_visualization.png",
+    "drought_heatmap": "png/drought_severity_heatmap.png",
+    "drought_mask": "png/drought_mask.png",
+    "carbon_mask": CARBON_MASK,
+    "carbon_mask_png": "png/CARBON_mask_TCI_COG.png",
+    "carbon_heatmap": "png/carbon_heatmap.png",
+    "carbon_raw_mask": "png/carbon_mask.png",
+    "tile_stats": "tile_stats",
+}
+
+def default_params():
+    """The module config parameters, by pipeline section."""
+    return {
+        "denoise": dict(DENOISE_PARAMS),
+        "enhancement": dict(ENHANCEMENT_PARAMS),
+        "tile": dict(TILE_PARAMS),
+        "fire": dict(FIRE_PARAMS),
+        "drought": dict(DROUGHT_PARAMS),
+        "carbon": dict(CARBON_DETECTION),
+    }
+
+def merge_params(overrides=None):
+    """Config parameters with per-section overrides applied."""
+    params = default_params()
+    for section, values in (overrides or {}).items():
+        if section not in params:
+            raise ValueError(f"Unknown parameter section: {section}")
+        params[section].update(values)
+    return params
+
+def output_path(name, output_dir=FIGURES_DIR):
+    return Path(output_dir) / OUTPUTS[name]
+
+def coverage(mask):
+    return np.count_nonzero(mask) / mask.size * 100
+
+def disk_array(shape, dtype):
+    """Array backed by an anonymous temporary file, for images larger than RAM."""
+    return np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode="w+", shape=shape)
+
+def load_to_disk(path, tile_size=1024):
+    """Decode an image window by window into a disk-backed array."""
+    with open_cog(path) as reader:
+        out = disk_array(reader.shape, reader.dtype)
+        for window, tile in reader.iter_windows(tile_size):
+            out[window.row:window.row + window.height, window.col:window.col + window.width] = tile
+    return out
+
+def build_pipeline(input_path, cache, params=None, output_dir=FIGURES_DIR, enhanced_path=None, summary=None,
+                   feature=None):
+    """
+    The scene -> {fire, drought} and enhance -> carbon DAG.
+    With enhanced_path the enhance stage loads that image instead of
+    computing it; coverage numbers are recorded in `summary`. The enhanced
+    image is upscaled (16x the pixels of the scene), so it is handed to
+    carbon detection in a disk-backed array that carbon processes in blocks.
+    Per-tile statistics are stored under the STAC feature id with its
+    datetime and footprint; without a feature they are not written, as date
+    and bbox queries could never find them.
+    """
+    params = params or default_params()
+    summary = {} if summary is None else summary
+    source_key = cache.file_key(input_path) if cache.enabled and input_path else None
+    pipeline = Pipeline()
+
+    def path(name):
+        target = output_path(name, output_dir)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        return target
+
+    def scene(run):
+        # Decode the scene once for the fire and drought branches
+        with stage("scene.load"), open_cog(input_path) as reader:
+            image = reader.read()
+        with stage("scene.save"):
+            if "tci_png" in run.outputs:
+                cv2.imwrite(str(path("tci_png")), to_uint8(image))
+            image = to_rgb(image)
+            if "original_png" in run.outputs:
+                cv2.imwrite(str(path("original_png")), cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+        return image
+
+    def enhance(run):
+        if enhanced_path is not None:
+            with stage("enhance.load"):
+                image = load_to_disk(enhanced_path)
+            key = cache.file_key(enhanced_path) if cache.enabled else None
+            return {"image": image, "georef": read_georef(enhanced_path), "key": key}
+        # Stream the enhanced image to disk and/or collect it for the carbon branch
+        with open_cog(input_path) as reader:
+            scale = params["enhancement"]["upscale_factor"]
+            georef = georef_tags(reader.tags, scale)
+            out = None
+            if run.consumed or "enhanced_png" in run.outputs:
+                out = disk_array((reader.height * scale, reader.width * scale), params["tile"]["output_dtype"])
+            target = path("enhanced") if "enhanced" in run.outputs else None
+            enhance_tiled(reader, target, params["denoise"], params["enhancement"], params["tile"], cache,
+                          source_key, out)
+        if "enhanced_png" in run.outputs:
+            with stage("enhance.save"):
+                cv2.imwrite(str(path("enhanced_png")), to_uint8(out))
+        key = enhanced_key(cache, source_key, params["denoise"], params["enhancement"], params["tile"])
+        return {"image": out, "georef": georef, "key": key}
+
+    def fire(run):
+        heatmap_image, intensity, fire_mask = create_heatmap(run.inputs["scene"], params["fire"], cache, source_key)
+        with stage("fire.save"):
+            if "fire_heatmap" in run.outputs:
+                cv2.imwrite(str(path("fire_heatmap")), cv2.cvtColor(heatmap_image, cv2.COLOR_RGB2BGR))
+            if "fire_mask" in run.outputs:
+                cv2.imwrite(str(path("fire_mask")), fire_mask * 255)
+        summary["fire_coverage"] = coverage(fire_mask)
+        print(f"Fire coverage: {summary['fire_coverage']:.2f}% of the image")
+        return fire_mask
+
+    def drought(run):
+        drought_image, drought_severity, drought_mask = detect_drought(
+            run.inputs["scene"], params["drought"], cache, source_key)
+        with stage("drought.save"):
+            if "drought_visualization" in run.outputs:
+                cv2.imwrite(str(path("drought_visualization")), cv2.cvtColor(drought_image, cv2.COLOR_RGB2BGR))
+            if "drought_heatmap" in run.outputs:
+                render_heatmap(drought_severity, path("drought_heatmap"), 'YlOrBr', legend_label='Drought Severity')
+            if "drought_mask" in run.outputs:
+                cv2.imwrite(str(path("drought_mask")), drought_mask * 255)
+        summary["drought_coverage"] = coverage(drought_mask)
+        print(f"Potential drought coverage: {summary['drought_coverage']:.2f}% of the image")
+        return {"mask": drought_mask, "severity": drought_severity}
+
+    def carbon(run):
+        enhanced = run.inputs["enhance"]
+        classified, mask, image_norm, _ = process_image(enhanced["image"], params["carbon"], cache, enhanced["key"])
+        with stage("carbon.save"):
+            if "carbon_mask" in run.outputs:
+                save_image(classified, path("carbon_mask"), enhanced["georef"])
+            if "carbon_mask_png" in run.outputs:
+                cv2.imwrite(str(path("carbon_mask_png")), to_uint8(np.asarray(classified)))
+            if "carbon_raw_mask" in run.outputs:
+                save_image(mask, path("carbon_raw_mask"), enhanced["georef"])
+        if "carbon_heatmap" in run.outputs:
+            create_carbon_heatmap(image_norm, mask, path("carbon_heatmap"), params["carbon"]['heatmap_colormap'])
+        summary["carbon_coverage"] = coverage(mask)
+        print(f"Carbon coverage: {summary['carbon_coverage']:.2f}% of the image")
+        return mask
+
+    def stats(run):
+        if feature is None:
+            print("[WARN] Tile statistics not written: no STAC feature for the input (pass --feature-id)")
+            return None
+        image, drought = run.inputs["scene"], run.inputs["drought"]
+        carbon_mask = run.inputs["carbon"]
+        tile_stats = TileStats(image.shape[0], image.shape[1])
+        tile_stats.add_image(image, drought["severity"])
+        tile_stats.add_masks(run.inputs["fire"], drought["mask"], carbon_mask,
+                             carbon_mask.shape[0] // image.shape[0])
+        with stage("stats.save"):
+            TileStatsStore(output_path("tile_stats", output_dir)).write(
+                feature["id"], tile_stats, datetime=feature.get("properties", {}).get("datetime"),
+                geometry=feature.get("geometry"), source=input_path)
+
+    pipeline.add("scene", scene, outputs=["tci_png", "original_png"])
+    pipeline.add("enhance", enhance, outputs=["enhanced", "enhanced_png"])
+    pipeline.add("fire", fire, deps=["scene"], outputs=["fire_heatmap", "fire_mask"])
+    pipeline.add("drought", drought, deps=["scene"],
+                 outputs=["drought_visualization", "drought_heatmap", "drought_mask"])
+    pipeline.add("carbon", carbon, deps=["enhance"],
+                 outputs=["carbon_mask", "carbon_mask_png", "carbon_heatmap", "carbon_raw_mask"])
+    pipeline.add("stats", stats, deps=["scene", "fire", "drought", "carbon"], outputs=["tile_stats"])
+    return pipeline
+
+def main():
+    parser = argparse.ArgumentParser(description="Run enhancement and fire/drought/carbon detection in one process.")
+    parser.add_argument("--input", default=str(FIGURES_DIR / INPUT_IMAGE), help="Input scene (TCI)")
+    parser.add_argument("--feature-id",
+                        help="STAC feature of the input, for the tile statistics (default: the feature whose "
+                             "downloaded asset or href is --input)")
+    parser.add_argument("--outputs", nargs="+", metavar="NAME", help="Outputs or stages to produce (default: all)")
+    parser.add_argument("--workers", type=int, default=None, help="Stages run concurrently (default: all ready)")
+    parser.add_argument("--list", action="store_true", help="List the available outputs and exit")
+    parser.add_argument("--report", metavar="JSON", help="Write a per-stage time/memory/I-O report")
+    parser.add_argument("--prometheus", metavar="PATH", help="Write the report in Prometheus text format")
+    parser.add_argument("--track-allocations", action="store_true",
+                        help="Report the largest NumPy buffers per stage (slower)")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, path in OUTPUTS.items():
+            print(f"{name:24s} figures/{path}")
+        return
+
+    if not os.path.exists(args.input):
+        print(f"Error: Input image {args.input} not found!")
+        return
+
+    # Open the local STAC catalog built from project_data.json (once for all stages)
+    with open_catalog() as catalog:
+        feature_count = catalog.count()
+        if args.feature_id:
+            feature = catalog.get_feature(args.feature_id)
+        else:
+            feature = catalog.find_by_source(args.input)
+    if feature_count:
+        print(f"[INFO] STAC catalog loaded from project_data.json: {feature_count} features")
+    else:
+        print("[WARN] Project data not available. Proceeding without API data.")
+    if args.feature_id and feature is None:
+        print(f"[WARN] Feature {args.feature_id} not in the catalog; tile statistics will not be written.")
+
+    FIGURES_DIR.mkdir(exist_ok=True)
+    PNG_DIR.mkdir(exist_ok=True)
+    cache = StageCache(**CACHE_PARAMS)
+    pipeline = build_pipeline(args.input, cache, feature=feature)
+    instrumentation = Instrumentation(track_allocations=args.track_allocations)
+    with instrumentation if args.report or args.prometheus else nullcontext():
+        timings = pipeline.run(args.outputs, workers=args.workers)
+    cache.report()
+
+    print("Pipeline completed successfully!")
+    print(f"Stages run: {', '.join(f'{name} ({seconds:.1f}s)' for name, seconds in timings.items())}")
+    for name in args.outputs or OUTPUTS:
+        if name in OUTPUTS and output_path(name).exists():
+            print(f"{name} saved as: figures/{OUTPUTS[name]}")
+    if args.report:
+        print_report(instrumentation.report())
+        print(f"Run report saved as: {instrumentation.write_json(args.report)}")
+    if args.prometheus:
+        print(f"Prometheus metrics saved as: {instrumentation.write_prometheus(args.prometheus)}")
+
+if __name__ == "__main__":
+    main()
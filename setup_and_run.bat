@@ -8,13 +8,13 @@ echo =============================================
 
 :: Create and activate virtual environment
 echo.
-echo [1/5] Setting up virtual environment...
+echo [1/4] Setting up virtual environment...
 python -m venv venv
 call venv\Scripts\activate
 
 :: Install packages in batches
 echo.
-echo [2/5] Installing dependencies...
+echo [2/4] Installing dependencies...
 echo Installing basic packages...
 pip install --upgrade pip
 pip install numpy opencv-python scikit-image imagecodecs pywavelets
@@ -23,11 +23,11 @@ echo Installing PyTorch...
 pip install torch torchvision
 
 echo Installing remaining packages...
-pip install tifffile matplotlib pandas scikit-learn
+pip install tifffile pandas scikit-learn
 
 :: Create necessary directories
 echo.
-echo [3/5] Creating directory structure...
+echo [3/4] Creating directory structure...
 if not exist figures mkdir figures
 if not exist image_enhancement\models mkdir image_enhancement\models
 if not exist Carbon_detection\models mkdir Carbon_detection\models
@@ -39,50 +39,21 @@ if not exist "figures\TCI_COG.tiff" (
     exit /b 1
 )
 
-:: Run image enhancement
+:: Ensure PYTHONPATH includes project root for shared utils
+set PYTHONPATH=%cd%;%PYTHONPATH%
+
+:: Run enhancement, carbon, fire and drought detection and the PNG conversions
+:: as one pipeline: the scene is decoded once and arrays stay in memory
 echo.
-echo [4/7] Running image enhancement...
-python image_enhancement\main.py
+echo [4/4] Running the processing pipeline...
+python run_pipeline.py
 if errorlevel 1 (
-    echo Error during image enhancement!
+    echo Error during the processing pipeline!
     echo Please check if all dependencies are installed correctly.
     echo Try running: pip install pywavelets
     exit /b 1
 ) else (
-    echo Image enhancement completed successfully
-)
-
-:: Run Carbon detection
-echo.
-echo [5/7] Running Carbon detection...
-python carbon_detection\main.py
-if errorlevel 1 (
-    echo Error during Carbon detection!
-    exit /b 1
-) else (
-    echo Carbon detection completed successfully
-)
-
-:: Run Fire detection
-echo.
-echo [6/7] Running Fire detection...
-python fire_detection\main.py
-if errorlevel 1 (
-    echo Error during Fire detection!
-    exit /b 1
-) else (
-    echo Fire detection completed successfully
-)
-
-:: Convert TIFF images to PNG
-echo.
-echo [7/7] Converting images to PNG format...
-python utils\convert_to_png.py
-if errorlevel 1 (
-    echo Error during image conversion!
-    exit /b 1
-) else (
-    echo Image conversion completed successfully
+    echo Processing pipeline completed successfully
 )
 
 echo.
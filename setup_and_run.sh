@@ -6,12 +6,12 @@ echo "Satellite Image Processing Suite"
 echo "============================================="
 
 # Create and activate virtual environment
-echo -e "\n[1/6] Setting up virtual environment..."
+echo -e "\n[1/4] Setting up virtual environment..."
 python3 -m venv venv
 source venv/bin/activate
 
 # Install packages in batches
-echo -e "\n[2/6] Installing dependencies..."
+echo -e "\n[2/4] Installing dependencies..."
 echo "Installing basic packages..."
 pip install --upgrade pip
 pip install numpy opencv-python scikit-image imagecodecs pywavelets
@@ -20,10 +20,10 @@ echo "Installing PyTorch..."
 pip install torch torchvision
 
 echo "Installing remaining packages..."
-pip install tifffile matplotlib pandas scikit-learn
+pip install tifffile pandas scikit-learn
 
 # Create necessary directories
-echo -e "\n[3/6] Creating directory structure..."
+echo -e "\n[3/4] Creating directory structure..."
 mkdir -p figures
 mkdir -p image_enhancement/models
 mkdir -p carbon_detection/models
@@ -58,80 +58,18 @@ python3 fetch_project_data.py
 # Ensure PYTHONPATH includes project root for all scripts
 export PYTHONPATH="$(pwd):$PYTHONPATH"
 
-# Train and run image enhancement
-echo -e "\n[4/6] Running image enhancement..."
-# First train the TIFF enhancement model
-if python image_enhancement/models/train_model.py; then
-    echo "TIFF enhancement model trained successfully"
+# Run enhancement, carbon, fire and drought detection and the PNG conversions
+# as one pipeline: the scene is decoded once and arrays stay in memory
+echo -e "\n[4/4] Running the processing pipeline..."
+if python run_pipeline.py; then
+    echo "Processing pipeline completed successfully"
 else
-    echo "Error during TIFF enhancement model training!"
-    exit 1
-fi
-
-if python image_enhancement/models/train_model.py; then
-    echo "TIFF enhancement model trained successfully"
-else
-    echo "Error during TIFF enhancement model training!"
-    exit 1
-fi
-
-if python image_enhancement/main.py; then
-    echo "Image enhancement completed successfully"
-else
-    echo "Error during image enhancement!"
+    echo "Error during the processing pipeline!"
     echo "Please check if all dependencies are installed correctly."
     echo "Try running: pip install pywavelets"
     exit 1
 fi
 
-# Ensure enhanced_enhanced_TCI_COG.tiff exists
-# if [ ! -f "figures/enhanced_enhanced_TCI_COG.tiff" ]; then
-#     echo "enhanced_enhanced_TCI_COG.tiff not found. Running enhancement again on enhanced_TCI_COG.tiff..."
-#     # Run enhancement again on the enhanced image
-#     if python image_enhancement/main.py figures/enhanced_TCI_COG.tiff; then
-#         echo "enhanced_enhanced_TCI_COG.tiff created successfully."
-#     else
-#         echo "Error: Could not create enhanced_enhanced_TCI_COG.tiff."
-#         exit 1
-#     fi
-# fi
-
-echo "Step 2: Carbon Detection"
-if python carbon_detection/main.py; then
-    echo "Carbon detection completed successfully"
-else
-    echo "Error during carbon detection!"
-    exit 1
-fi
-
-echo "Step 3: Fire Detection"
-if python fire_detection/main.py; then
-    echo "Fire detection completed successfully"
-else
-    echo "Error during fire detection!"
-    exit 1
-fi
-
-echo "Step 4: Drought Detection"
-cd drought_detection
-if python main.py; then
-    cd ..
-    echo "Drought detection completed successfully"
-else
-    cd ..
-    echo "Error during drought detection!"
-    exit 1
-fi
-
-# Convert TIFF images to PNG
-echo -e "\n[5/6] Converting images to PNG format..."
-if python utils/convert_to_png.py; then
-    echo "Image conversion completed successfully"
-else
-    echo "Error during image conversion!"
-    exit 1
-fi
-
 echo -e "\n============================================="
 echo "Process completed successfully!"
 echo "Enhanced image saved as: figures/enhanced_TCI_COG.tiff"
@@ -0,0 +1,45 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import batch_runner  # noqa: E402
+
+# Usage: python -m pytest tests  (or python -m unittest discover tests)
+
+
+def crash_stub(job, output_dir, *args):
+    """Stand-in for process_scene: the "crash" scene kills its worker, every other scene succeeds."""
+    if job["feature_id"] == "crash":
+        os._exit(1)
+    return {"seconds": 0.0}
+
+
+class RunBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        source = os.path.join(self.tmp.name, "scene.tif")
+        open(source, "wb").close()
+        self.jobs = [{"feature_id": name, "asset": "TCI", "datetime": None, "geometry": None, "source": source}
+                     for name in ("a", "b", "crash", "c")]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_dead_worker_only_charges_the_crashing_job(self):
+        output_dir = os.path.join(self.tmp.name, "batch")
+        with mock.patch.object(batch_runner, "process_scene", crash_stub):
+            manifest = batch_runner.run_batch(self.jobs, output_dir, {}, workers=4, retries=1)
+        status = {record["feature_id"]: (record["status"], record["attempts"]) for record in manifest["jobs"]}
+        self.assertEqual(status, {"a": ("ok", 1), "b": ("ok", 1), "c": ("ok", 1), "crash": ("failed", 2)})
+        with open(os.path.join(output_dir, "manifest.json")) as f:
+            self.assertEqual(json.load(f)["failed"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,179 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fetch_project_data import create_session, download_asset, search_all  # noqa: E402
+
+# Usage: python -m pytest tests  (or python -m unittest discover tests)
+
+BLOB = bytes(range(256)) * 64
+ETAG = '"blob-v1"'
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Asset and STAC search endpoints of a stand-in server; the test case configures it through the server."""
+
+    def log_message(self, *args):
+        pass
+
+    def _asset_headers(self, length):
+        if self.server.send_length:
+            self.send_header("Content-Length", str(length))
+        self.send_header("ETag", self.server.etag)
+        self.send_header("Accept-Ranges", "bytes")
+
+    def do_HEAD(self):
+        self.server.requests.append(("HEAD", self.path, None))
+        self.send_response(200)
+        self._asset_headers(len(self.server.blob))
+        self.end_headers()
+
+    def do_GET(self):
+        range_header = self.headers.get("Range")
+        self.server.requests.append(("GET", self.path, range_header))
+        if self.path.startswith("/search"):
+            return self._search_page(int(self.path.rsplit("=", 1)[-1]))
+        blob = self.server.blob
+        if self.headers.get("If-Range") not in (None, self.server.etag):
+            # The client's partial is of another version: send the whole file
+            range_header = None
+        start = int(range_header[len("bytes="):-1]) if range_header else 0
+        if start >= len(blob):
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{len(blob)}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = blob[start:]
+        self.send_response(206 if range_header else 200)
+        if range_header:
+            self.send_header("Content-Range", f"bytes {start}-{len(blob) - 1}/{len(blob)}")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", self.server.etag)
+        self.end_headers()
+        # truncate_at drops the connection part-way, like an interrupted run
+        self.wfile.write(body[:self.server.truncate_at])
+
+    def do_POST(self):
+        self.server.requests.append(("POST", self.path, None))
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._search_page(1)
+
+    def _search_page(self, number):
+        base = f"http://127.0.0.1:{self.server.server_port}"
+        page = {"type": "FeatureCollection", "features": [{"id": f"item-{number}"}], "links": []}
+        if number < 3:
+            page["links"].append({"rel": "next", "href": f"{base}/search?page={number + 1}", "method": "GET"})
+        body = json.dumps(page).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FetchProjectDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+        self.server.requests = []
+        self.server.send_length = True
+        self.server.blob = BLOB
+        self.server.etag = ETAG
+        self.server.truncate_at = None
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.base = f"http://127.0.0.1:{self.server.server_port}"
+        self.session = create_session("test-token")
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dest = os.path.join(self.tmp.name, "scene", "TCI.tif")
+
+    def tearDown(self):
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def _gets(self):
+        return [request for request in self.server.requests if request[0] == "GET"]
+
+    def _write_part(self, data, etag=ETAG):
+        os.makedirs(os.path.dirname(self.dest), exist_ok=True)
+        with open(self.dest + ".part", "wb") as f:
+            f.write(data)
+        with open(self.dest + ".part.etag", "w") as f:
+            f.write(etag)
+
+    def _assert_downloaded(self, blob=BLOB):
+        with open(self.dest, "rb") as f:
+            self.assertEqual(f.read(), blob)
+        self.assertFalse(os.path.exists(self.dest + ".part"))
+        self.assertFalse(os.path.exists(self.dest + ".part.etag"))
+
+    def test_download_then_skip_unchanged(self):
+        self.assertEqual(download_asset(self.session, f"{self.base}/TCI.tif", self.dest), "downloaded")
+        self._assert_downloaded()
+        self.assertEqual(download_asset(self.session, f"{self.base}/TCI.tif", self.dest), "skipped")
+        self.assertEqual(len(self._gets()), 1)
+
+    def test_resume_partial_download(self):
+        self._write_part(BLOB[:1000])
+        self.assertEqual(download_asset(self.session, f"{self.base}/TCI.tif", self.dest), "resumed")
+        self._assert_downloaded()
+        self.assertEqual(self._gets()[-1][2], "bytes=1000-")
+
+    def test_complete_partial_download_is_finalized_without_get(self):
+        self._write_part(BLOB)
+        self.assertEqual(download_asset(self.session, f"{self.base}/TCI.tif", self.dest), "resumed")
+        self._assert_downloaded()
+        self.assertEqual(self._gets(), [])
+
+    def test_range_not_satisfiable_means_complete(self):
+        # Without a Content-Length the size is unknown and the Range request is sent; the server answers 416
+        self.server.send_length = False
+        self._write_part(BLOB)
+        self.assertEqual(download_asset(self.session, f"{self.base}/TCI.tif", self.dest), "resumed")
+        self._assert_downloaded()
+        self.assertEqual(self._gets()[-1][2], f"bytes={len(BLOB)}-")
+
+    def test_stale_oversized_partial_is_discarded(self):
+        self._write_part(BLOB + b"extra")
+        self.assertEqual(download_asset(self.session, f"{self.base}/TCI.tif", self.dest), "downloaded")
+        self._assert_downloaded()
+
+    def test_partial_of_changed_file_is_not_resumed(self):
+        # The first run is cut off after 1000 bytes; the file changes (same size) before the second run
+        self.server.truncate_at = 1000
+        with self.assertRaises(Exception):
+            download_asset(self.session, f"{self.base}/TCI.tif", self.dest, chunk_size=500)
+        self.assertEqual(os.path.getsize(self.dest + ".part"), 1000)
+        self.server.truncate_at = None
+        self.server.blob = BLOB[::-1]
+        self.server.etag = '"blob-v2"'
+        self.assertEqual(download_asset(self.session, f"{self.base}/TCI.tif", self.dest), "downloaded")
+        self._assert_downloaded(BLOB[::-1])
+        self.assertIsNone(self._gets()[-1][2])
+        with open(self.dest + ".etag") as f:
+            self.assertEqual(f.read(), '"blob-v2"')
+
+    def test_partial_without_source_etag_is_discarded(self):
+        self._write_part(BLOB[::-1][:1000])
+        os.remove(self.dest + ".part.etag")
+        self.assertEqual(download_asset(self.session, f"{self.base}/TCI.tif", self.dest), "downloaded")
+        self._assert_downloaded()
+
+    def test_search_follows_next_links(self):
+        page = search_all(self.session, f"{self.base}/search", {"limit": 1})
+        self.assertEqual([feature["id"] for feature in page["features"]], ["item-1", "item-2", "item-3"])
+        self.assertEqual(page["numberReturned"], 3)
+        self.assertEqual(len(search_all(self.session, f"{self.base}/search", {}, max_pages=2)["features"]), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import sys
+import unittest
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.packed_mask import PackedMask  # noqa: E402
+
+# Usage: python -m pytest tests  (or python -m unittest discover tests)
+
+OPERATIONS = {
+    "erode": cv2.MORPH_ERODE,
+    "dilate": cv2.MORPH_DILATE,
+    "open": cv2.MORPH_OPEN,
+    "close": cv2.MORPH_CLOSE,
+}
+
+
+class PackedMorphologyTest(unittest.TestCase):
+
+    def _assert_matches_cv2(self, mask, kernel_size):
+        packed = PackedMask.pack(mask)
+        kernel = np.ones((kernel_size, kernel_size), np.uint8)
+        for name, op in OPERATIONS.items():
+            with self.subTest(shape=mask.shape, kernel_size=kernel_size, op=name):
+                expected = cv2.morphologyEx(mask, op, kernel)
+                np.testing.assert_array_equal(getattr(packed, name)(kernel_size).unpack(), expected)
+
+    def test_matches_cv2_on_random_masks(self):
+        rng = np.random.default_rng(0)
+        for shape in [(37, 45), (16, 64), (20, 13)]:
+            mask = (rng.random(shape) < 0.6).astype(np.uint8)
+            for kernel_size in range(1, 13):
+                self._assert_matches_cv2(mask, kernel_size)
+
+    def test_masks_smaller_than_the_kernel(self):
+        rng = np.random.default_rng(1)
+        for shape in [(3, 20), (1, 9), (20, 3), (2, 2)]:
+            self._assert_matches_cv2(np.ones(shape, np.uint8), 11)
+            self._assert_matches_cv2((rng.random(shape) < 0.5).astype(np.uint8), 11)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,310 @@
+import argparse
+import json
+import os
+import threading
+from collections import namedtuple
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from utils.cog_reader import crop_halo, open_cog, window_grid
+from utils.load_project_data import asset_local_path
+
+FIGURES_DIR = Path(__file__).resolve().parent.parent / "figures"
+
+# Scale/offset to radiance, the fill value and the sensor bit depth of one band (STAC raster:bands)
+Calibration = namedtuple("Calibration", ["scale", "offset", "nodata", "bits"], defaults=(None,))
+
+BandResult = namedtuple("BandResult", [
+    "fire_mask", "drought_mask", "fire_coverage", "drought_coverage", "bands_read",
+])
+
+
+def _calibration(asset):
+    bands = asset.get("raster:bands") or [{}]
+    return Calibration(bands[0].get("scale", 1.0), bands[0].get("offset", 0.0), bands[0].get("nodata"),
+                       bands[0].get("bits_per_sample"))
+
+
+class BandStack:
+    """Lazy multi-band view of single-band COG assets covering the same footprint.
+
+    Bands are opened on first use and only the windows a caller asks for are
+    decoded, so an index over two bands reads two files however many the
+    feature has. Bands are addressed by asset key ("NIR", "RE2") or by STAC
+    common name ("nir", "red"; the first matching asset). L1 assets share a
+    footprint, so a band on another grid (e.g. PAN) is aligned to the
+    reference grid by its size ratio and resampled bilinearly.
+    """
+
+    def __init__(self, sources, calibration=None, aliases=None, reference=None, level=0):
+        self.sources = dict(sources)
+        self.calibration = dict(calibration or {})
+        self.aliases = dict(aliases or {})
+        self.level = level
+        self._readers = {}
+        self._lock = threading.Lock()
+        if not self.sources:
+            raise ValueError("A band stack needs at least one band")
+        if reference is None:
+            reference = "red" if "red" in self.aliases else next(iter(self.sources))
+        self.reference = self.resolve(reference)
+        ref = self.reader(self.reference)
+        self.height, self.width = ref.height, ref.width
+
+    @classmethod
+    def from_feature(cls, feature, bands=None, data_dir=None, remote=True, reference=None, level=0):
+        """Band stack of the single-band assets (those with eo:bands) of a STAC feature.
+
+        Downloaded copies are preferred over the hrefs; with remote=False
+        bands that were not downloaded are left out.
+        """
+        sources, calibration, aliases = {}, {}, {}
+        for key, asset in feature.get("assets", {}).items():
+            eo_bands = asset.get("eo:bands") or []
+            if len(eo_bands) != 1 or (bands is not None and key not in bands):
+                continue
+            source = asset_local_path(feature, key, data_dir)
+            if not os.path.exists(source):
+                if not remote:
+                    continue
+                source = asset["href"]
+            sources[key] = source
+            calibration[key] = _calibration(asset)
+            common_name = eo_bands[0].get("common_name")
+            if common_name:
+                aliases.setdefault(common_name, key)
+        return cls(sources, calibration, aliases, reference, level)
+
+    @property
+    def shape(self):
+        return (self.height, self.width)
+
+    @property
+    def bands(self):
+        return list(self.sources)
+
+    @property
+    def opened(self):
+        """Bands whose files have been opened so far."""
+        return list(self._readers)
+
+    def resolve(self, band):
+        """Asset key of a band given by asset key or common name."""
+        if band in self.sources:
+            return band
+        if band in self.aliases:
+            return self.aliases[band]
+        raise KeyError(f"No band {band!r}; available: {', '.join(self.bands)} "
+                       f"(common names: {', '.join(self.aliases)})")
+
+    def reader(self, band):
+        """COGReader of a band, opened on first use."""
+        key = self.resolve(band)
+        with self._lock:
+            if key not in self._readers:
+                self._readers[key] = open_cog(self.sources[key], level=self.level)
+            return self._readers[key]
+
+    def close(self):
+        with self._lock:
+            for reader in self._readers.values():
+                reader.close()
+            self._readers.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _read_aligned(self, reader, row, col, height, width):
+        """A window of the reference grid read from a band on any grid."""
+        if (reader.height, reader.width) == self.shape:
+            return reader.read_window(row, col, height, width)
+        row0, col0 = max(row, 0), max(col, 0)
+        row1, col1 = min(row + height, self.height), min(col + width, self.width)
+        # Pixel centres of the window on the band grid
+        ys = (np.arange(row0, row1) + 0.5) * (reader.height / self.height) - 0.5
+        xs = (np.arange(col0, col1) + 0.5) * (reader.width / self.width) - 0.5
+        top, left = max(int(np.floor(ys[0])), 0), max(int(np.floor(xs[0])), 0)
+        bottom = min(int(np.ceil(ys[-1])) + 1, reader.height)
+        right = min(int(np.ceil(xs[-1])) + 1, reader.width)
+        source = reader.read_window(top, left, bottom - top, right - left)
+        if source.dtype not in (np.uint8, np.uint16, np.int16, np.float32):
+            source = source.astype(np.float32)
+        map_x = np.broadcast_to((xs - left).astype(np.float32), (len(ys), len(xs)))
+        map_y = np.broadcast_to((ys - top).astype(np.float32)[:, None], (len(ys), len(xs)))
+        return cv2.remap(source, np.ascontiguousarray(map_x), np.ascontiguousarray(map_y), cv2.INTER_LINEAR,
+                         borderMode=cv2.BORDER_REPLICATE)
+
+    def calibrate(self, band, data):
+        """Raw counts of a band to float32 radiance (raster:bands scale and offset), NaN at nodata."""
+        scale, offset, nodata, _ = self.calibration.get(self.resolve(band), Calibration(1.0, 0.0, None))
+        radiance = data.astype(np.float32) * np.float32(scale) + np.float32(offset)
+        if nodata is not None:
+            radiance[data == nodata] = np.nan
+        return radiance
+
+    def bit_depth(self, band):
+        """Significant bits of a band's counts: raster:bands bits_per_sample, else the TIFF BitsPerSample."""
+        bits = self.calibration.get(self.resolve(band), Calibration(1.0, 0.0, None)).bits
+        if bits is None:
+            tag = self.reader(band).tags.get("BitsPerSample")
+            if tag is not None:
+                bits = tag.value[0] if isinstance(tag.value, tuple) else tag.value
+        return bits
+
+    def read_band(self, band, row, col, height, width, calibrated=False):
+        """One band over a window of the reference grid (clipped to the image); raw counts or radiance."""
+        data = self._read_aligned(self.reader(band), row, col, height, width)
+        return self.calibrate(band, data) if calibrated else data
+
+    def read_window(self, bands, row, col, height, width, calibrated=False):
+        """(height, width, len(bands)) stack of the requested bands; 2-D for a single band name."""
+        if isinstance(bands, str):
+            return self.read_band(bands, row, col, height, width, calibrated)
+        return np.stack([self.read_band(band, row, col, height, width, calibrated) for band in bands], axis=-1)
+
+    def read(self, bands, calibrated=False):
+        """The requested bands over the whole reference grid."""
+        return self.read_window(bands, 0, 0, self.height, self.width, calibrated)
+
+    def windows(self, size=1024, halo=0):
+        """Return the Window grid covering the reference grid with the given halo."""
+        return window_grid(self.height, self.width, size, halo)
+
+    def read_halo_window(self, window, bands, calibrated=False):
+        """Read a Window including its halo."""
+        return self.read_window(
+            bands,
+            window.row - window.top,
+            window.col - window.left,
+            window.height + window.top + window.bottom,
+            window.width + window.left + window.right,
+            calibrated,
+        )
+
+    def iter_windows(self, bands, size=1024, halo=0, calibrated=False):
+        """Yield (window, {band: data}) pairs covering the image; data includes the halo."""
+        for window in self.windows(size, halo):
+            yield window, {band: self.read_halo_window(window, band, calibrated) for band in bands}
+
+
+def full_scale(dtype, bits=None):
+    """Largest raw count of a band: 2**bits - 1 for a sensor bit depth, else of its dtype (1.0 for float bands).
+
+    12-bit sensors store counts in uint16, so scaling by the dtype alone
+    would leave every fraction below 1/16.
+    """
+    dtype = np.dtype(dtype)
+    if not np.issubdtype(dtype, np.integer):
+        return 1.0
+    if bits:
+        return min(2 ** int(bits) - 1, np.iinfo(dtype).max)
+    return np.iinfo(dtype).max
+
+
+def run_band_detection(stack, fire_params, drought_params, band_names, tile_size=1024):
+    """Fire and drought masks from true spectral indices in one tiled pass.
+
+    Drought uses NDVI (NIR, red) or NDRE (NIR, red edge) of calibrated
+    radiance; fire uses the red/NIR intensity of the raw counts as
+    fractions of the sensor full scale (FIRE_PARAMS bits_per_sample, else
+    the band's bit depth). Only the bands these need are opened, and each
+    window is decoded once.
+    """
+    from drought_detection.utils.drought_detection import (calculate_ndre, calculate_ndvi,
+                                                           vegetation_drought_mask)
+    from fire_detection.utils.fire_detection import calculate_nir_fire_intensity, detect_fire_regions
+
+    index = drought_params.get("vegetation_index", "ndvi")
+    if index not in ("ndvi", "ndre"):
+        raise ValueError(f"Unknown vegetation index {index!r}; use 'ndvi' or 'ndre'")
+    red, nir = band_names["red"], band_names["nir"]
+    reference = band_names["rededge"] if index == "ndre" else red
+    threshold = drought_params["ndre_threshold" if index == "ndre" else "ndvi_threshold"]
+    kernel_size = max(fire_params["kernel_size"], drought_params["kernel_size"])
+    # Opening then closing chains four erosions/dilations
+    halo = 4 * (kernel_size // 2)
+
+    fire_mask = np.zeros(stack.shape, dtype=np.uint8)
+    drought_mask = np.zeros(stack.shape, dtype=np.uint8)
+    bits = fire_params.get("bits_per_sample")
+    red_scale = np.float32(full_scale(stack.reader(red).dtype, bits or stack.bit_depth(red)))
+    nir_scale = np.float32(full_scale(stack.reader(nir).dtype, bits or stack.bit_depth(nir)))
+    bands = [red, nir] if reference == red else [red, nir, reference]
+
+    for window, data in stack.iter_windows(bands, tile_size, halo=halo):
+        core = (slice(window.row, window.row + window.height),
+                slice(window.col, window.col + window.width))
+
+        intensity = calculate_nir_fire_intensity(data[red] / red_scale, data[nir] / nir_scale)
+        fire_tile = detect_fire_regions(intensity, fire_params["nir_intensity_threshold"], fire_params["kernel_size"])
+        fire_mask[core] = crop_halo(fire_tile, window)
+
+        # The bands were read once as raw counts; the index needs radiance
+        nir_radiance = stack.calibrate(nir, data[nir])
+        if index == "ndre":
+            vegetation = calculate_ndre(nir_radiance, stack.calibrate(reference, data[reference]))
+        else:
+            vegetation = calculate_ndvi(nir_radiance, stack.calibrate(red, data[red]))
+        drought_tile = vegetation_drought_mask(vegetation, threshold, drought_params["kernel_size"])
+        drought_mask[core] = crop_halo(drought_tile, window)
+
+    total_pixels = stack.height * stack.width
+    return BandResult(
+        fire_mask, drought_mask,
+        fire_coverage=np.count_nonzero(fire_mask) / total_pixels * 100,
+        drought_coverage=np.count_nonzero(drought_mask) / total_pixels * 100,
+        bands_read=[stack.resolve(band) for band in bands],
+    )
+
+
+def save_band_result(result, output_dir):
+    """Write the masks as PNGs and the coverage numbers as result.json into output_dir."""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    cv2.imwrite(str(output_dir / "fire_mask.png"), result.fire_mask * 255)
+    cv2.imwrite(str(output_dir / "drought_mask.png"), result.drought_mask * 255)
+    with open(output_dir / "result.json", "w") as f:
+        json.dump({"fire_coverage": result.fire_coverage, "drought_coverage": result.drought_coverage,
+                   "bands_read": result.bands_read}, f, indent=4)
+
+
+def main():
+    from drought_detection.config import DROUGHT_PARAMS, SPECTRAL_BANDS
+    from fire_detection.config import FIRE_PARAMS
+    from utils.stac_catalog import open_catalog
+
+    parser = argparse.ArgumentParser(
+        description="Fire and drought masks from the NIR/red(-edge) assets of STAC features (true NDVI/NDRE).")
+    parser.add_argument("feature_ids", nargs="+", help="STAC feature ids (see utils/stac_catalog.py)")
+    parser.add_argument("--index", choices=["ndvi", "ndre"], default=DROUGHT_PARAMS["vegetation_index"])
+    parser.add_argument("--tile-size", type=int, default=1024)
+    parser.add_argument("--data-dir", default=None, help="Directory holding downloaded assets")
+    parser.add_argument("--local-only", action="store_true", help="Do not read bands that were not downloaded")
+    parser.add_argument("--output-dir", default=str(FIGURES_DIR / "bands"))
+    args = parser.parse_args()
+
+    drought_params = dict(DROUGHT_PARAMS, vegetation_index=args.index)
+    with open_catalog() as catalog:
+        features = [(feature_id, catalog.get_feature(feature_id)) for feature_id in args.feature_ids]
+    for feature_id, feature in features:
+        if feature is None:
+            print(f"[WARN] Skipping {feature_id}: not in the catalog")
+            continue
+        try:
+            with BandStack.from_feature(feature, data_dir=args.data_dir, remote=not args.local_only) as stack:
+                result = run_band_detection(stack, FIRE_PARAMS, drought_params, SPECTRAL_BANDS, args.tile_size)
+        except KeyError as e:
+            print(f"[WARN] Skipping {feature_id}: {e.args[0]}")
+            continue
+        save_band_result(result, Path(args.output_dir) / feature_id)
+        print(f"[INFO] {feature_id}: read {', '.join(result.bands_read)}; "
+              f"fire {result.fire_coverage:.2f}%, drought ({args.index}) {result.drought_coverage:.2f}%")
+
+
+if __name__ == "__main__":
+    main()
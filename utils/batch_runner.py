@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import CancelledError, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from utils.cog_reader import open_cog
+from utils.fused_detection import run_fused_detection, save_fused_result
+from utils.load_project_data import asset_local_path
+from utils.packed_mask import MASK_SUFFIXES
+from utils.stac_catalog import open_catalog
+from utils.tile_stats import DEFAULT_STORE, DEFAULT_TILE, TileStatsStore
+
+FIGURES_DIR = Path(__file__).resolve().parent.parent / "figures"
+
+
+def plan_jobs(features, assets=("TCI",), data_dir=None, remote=False):
+    """Build one job per (feature, asset) pair present in the STAC features.
+
+    Jobs carry the feature footprint, so workers never open the catalog.
+    """
+    jobs = []
+    for feature in features:
+        for asset_key in assets:
+            if asset_key not in feature.get("assets", {}):
+                continue
+            source = asset_local_path(feature, asset_key, data_dir)
+            if remote and not os.path.exists(source):
+                source = feature["assets"][asset_key]["href"]
+            jobs.append({
+                "feature_id": feature["id"],
+                "asset": asset_key,
+                "datetime": feature.get("properties", {}).get("datetime"),
+                "geometry": feature.get("geometry"),
+                "source": source,
+            })
+    return jobs
+
+
+def process_scene(job, output_dir, params, tile_size=1024, stats_dir=None, mask_format="png"):
+    """Run fused detection for one job and write its outputs; returns the coverage numbers.
+
+    With stats_dir the per-tile statistics of the scene are added to that tile
+    stats store. The masks are held bit-packed, so a worker needs 1 bit per
+    pixel and mask rather than a byte.
+    """
+    scene_dir = Path(output_dir) / job["feature_id"] / job["asset"]
+    start = time.time()
+    with open_cog(job["source"]) as reader:
+        result = run_fused_detection(
+            reader, params["fire"], params["drought"], params["carbon"], tile_size=tile_size,
+            stats_tile=DEFAULT_TILE if stats_dir else None, packed=True
+        )
+    save_fused_result(result, scene_dir, mask_format)
+    if stats_dir:
+        TileStatsStore(stats_dir).write(job["feature_id"], result.tile_stats, job["asset"], job["datetime"],
+                                        job.get("geometry"), job["source"])
+    summary = {
+        "fire_coverage": result.fire_coverage,
+        "drought_coverage": result.drought_coverage,
+        "carbon_coverage": result.carbon_coverage,
+        "seconds": round(time.time() - start, 3),
+    }
+    with open(scene_dir / "result.json", "w") as f:
+        json.dump(summary, f, indent=4)
+    return summary
+
+
+def _record(job, status, attempts, **fields):
+    """Manifest entry of a job (without its footprint)."""
+    entry = {key: value for key, value in job.items() if key != "geometry"}
+    return {**entry, "status": status, "attempts": attempts, **fields}
+
+
+def run_batch(jobs, output_dir, params, workers=None, retries=1, tile_size=1024, stats_dir=None, mask_format="png"):
+    """Run jobs across a process pool, retrying failures, and write manifest.json.
+
+    A worker that dies (crash, out-of-memory kill) breaks the pool and fails
+    every job still in it, though only one of them caused it. Those jobs are
+    not charged an attempt: once the pool has drained they run one at a time
+    in a single-worker pool, so a crash there is charged to the job that
+    caused it, and the rest go back to a full pool. The manifest is written
+    even if the run is interrupted, with the unfinished jobs marked failed.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    records = []
+
+    pending = []
+    for job in jobs:
+        if job["source"].startswith(("http://", "https://")) or os.path.exists(job["source"]):
+            pending.append(job)
+        else:
+            print(f"[WARN] Skipping {job['feature_id']}/{job['asset']}: {job['source']} not found")
+            records.append(_record(job, "skipped", 0, error="source not found"))
+
+    attempts = {id(job): 1 for job in pending}
+    futures = {}
+    queue = deque(pending)
+    # Jobs in the pool when a worker died, run alone until each has passed or crashed by itself
+    suspects = deque()
+    pool = None
+    isolated = False
+
+    def submit(job):
+        futures[pool.submit(process_scene, job, output_dir, params, tile_size, stats_dir, mask_format)] = job
+
+    try:
+        while queue or suspects or futures:
+            if not futures:
+                if pool is None or isolated != bool(suspects):
+                    if pool is not None:
+                        pool.shutdown(wait=False, cancel_futures=True)
+                    isolated = bool(suspects)
+                    pool = ProcessPoolExecutor(max_workers=1 if isolated else workers)
+                if isolated:
+                    submit(suspects.popleft())
+                while queue and not isolated:
+                    submit(queue.popleft())
+            future = next(as_completed(futures))
+            job = futures.pop(future)
+            try:
+                summary = future.result()
+            except Exception as e:
+                if isinstance(e, (BrokenProcessPool, CancelledError)):
+                    if pool is not None:
+                        print("[WARN] A worker process died; restarting the pool")
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        pool = None
+                    if not isolated:
+                        # Killed along with the pool, maybe by another job: no attempt charged
+                        suspects.append(job)
+                        continue
+                error = str(e) or type(e).__name__
+                if attempts[id(job)] <= retries:
+                    print(f"[WARN] {job['feature_id']}/{job['asset']} failed ({error}), retrying...")
+                    attempts[id(job)] += 1
+                    if isolated and pool is None:
+                        # It crashed on its own: retry it alone again
+                        suspects.append(job)
+                    elif pool is None or isolated:
+                        queue.append(job)
+                    else:
+                        submit(job)
+                else:
+                    print(f"[ERROR] {job['feature_id']}/{job['asset']} failed: {error}")
+                    records.append(_record(job, "failed", attempts[id(job)], error=error))
+                continue
+            print(f"[INFO] {job['feature_id']}/{job['asset']} done in {summary['seconds']}s")
+            records.append(_record(job, "ok", attempts[id(job)], **summary))
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        for job in [*futures.values(), *queue, *suspects]:
+            records.append(_record(job, "failed", attempts[id(job)], error="interrupted"))
+        records.sort(key=lambda r: (r["feature_id"], r["asset"]))
+        manifest = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "total": len(records),
+            "ok": sum(r["status"] == "ok" for r in records),
+            "failed": sum(r["status"] == "failed" for r in records),
+            "skipped": sum(r["status"] == "skipped" for r in records),
+            "jobs": records,
+        }
+        with open(output_dir / "manifest.json", "w") as f:
+            json.dump(manifest, f, indent=4)
+    return manifest
+
+
+def main():
+    from carbon_detection.config import CARBON_DETECTION
+    from drought_detection.config import DROUGHT_PARAMS
+    from fire_detection.config import FIRE_PARAMS
+
+    parser = argparse.ArgumentParser(description="Run detection for every STAC feature in project_data.json.")
+    parser.add_argument("--assets", nargs="+", default=["TCI"], help="Asset keys to process per feature")
+    parser.add_argument("--workers", type=int, default=None, help="Process pool size (default: CPU count)")
+    parser.add_argument("--retries", type=int, default=1, help="Retries per failed job")
+    parser.add_argument("--tile-size", type=int, default=1024)
+    parser.add_argument("--data-dir", default=None, help="Directory holding downloaded assets")
+    parser.add_argument("--output-dir", default=str(FIGURES_DIR / "batch"))
+    parser.add_argument("--remote", action="store_true", help="Read assets not downloaded yet from their hrefs")
+    parser.add_argument("--stats-dir", default=str(DEFAULT_STORE), help="Tile statistics store")
+    parser.add_argument("--no-stats", action="store_true", help="Do not write per-tile statistics")
+    parser.add_argument("--mask-format", choices=["png", *MASK_SUFFIXES], default="png",
+                        help="Mask files: png, 1-bit deflate TIFF or run lengths")
+    parser.add_argument("--bbox", nargs=4, type=float, metavar=("MIN_X", "MIN_Y", "MAX_X", "MAX_Y"))
+    parser.add_argument("--start", help="Only scenes acquired at or after this datetime")
+    parser.add_argument("--end", help="Only scenes acquired at or before this datetime")
+    parser.add_argument("--platform")
+    parser.add_argument("--level", help="Processing level, e.g. L1B")
+    parser.add_argument("--dedup", action="store_true", help="Keep only the highest level per acquisition")
+    args = parser.parse_args()
+
+    with open_catalog() as catalog:
+        items = catalog.search(args.bbox, args.start, args.end, args.platform, args.level, dedup=args.dedup)
+        features = [catalog.get_feature(item["id"]) for item in items]
+
+    jobs = plan_jobs(features, args.assets, args.data_dir, args.remote)
+    print(f"[INFO] Scheduling {len(jobs)} jobs on {args.workers or os.cpu_count()} workers")
+    params = {"fire": FIRE_PARAMS, "drought": DROUGHT_PARAMS, "carbon": CARBON_DETECTION}
+    manifest = run_batch(jobs, args.output_dir, params, args.workers, args.retries, args.tile_size,
+                         None if args.no_stats else args.stats_dir, args.mask_format)
+
+    print("Batch completed!")
+    print(f"{manifest['ok']} succeeded, {manifest['failed']} failed, {manifest['skipped']} skipped")
+    print(f"Manifest saved to {Path(args.output_dir) / 'manifest.json'}")
+
+
+if __name__ == "__main__":
+    main()
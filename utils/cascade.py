@@ -0,0 +1,236 @@
+import argparse
+import json
+import os
+from collections import namedtuple
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from drought_detection.utils.drought_detection import detect_drought_mask, drought_severity_map
+from fire_detection.utils.fire_detection import calculate_fire_intensity, detect_fire
+from utils.cog_reader import COGReader, crop_halo, open_cog
+from utils.fused_detection import mask_halo, reserve_row_cache, to_rgb
+
+FIGURES_DIR = Path(__file__).resolve().parent.parent / "figures"
+# Coarsest overview used for flagging; deeper ones average small fires away
+MAX_FACTOR = 8
+# Coarse pixels added around every tile footprint, for the overview resampling kernel
+PAD = 1
+# calculate_fire_intensity clips to this range
+FIRE_INTENSITY_MAX = 1.0
+
+Coarse = namedtuple("Coarse", ["image", "factor_y", "factor_x", "source"])
+CascadeResult = namedtuple("CascadeResult", [
+    "fire_mask", "drought_mask", "fire_coverage", "drought_coverage", "report",
+])
+
+
+def overview_coarse(reader, max_factor=MAX_FACTOR):
+    """The deepest COG overview downsampled by at most max_factor, or None without overviews."""
+    best = None
+    for level in range(1, reader.num_levels):
+        with COGReader(reader.source, level=level) as overview:
+            factor = reader.width / overview.width
+            if factor > max_factor:
+                break
+            best = Coarse(to_rgb(overview.read()), reader.height / overview.height, factor, f"overview {level}")
+    return best
+
+
+def thumbnail_coarse(reader, path):
+    """The STAC thumbnail of the scene (an 8-bit display rendering) as coarse image."""
+    if reader.dtype != np.uint8:
+        raise ValueError("The thumbnail only matches 8-bit scenes; use an overview instead")
+    image = cv2.imread(str(path), cv2.IMREAD_COLOR)
+    if image is None:
+        raise FileNotFoundError(path)
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return Coarse(image, reader.height / image.shape[0], reader.width / image.shape[1], "thumbnail")
+
+
+def coarse_thresholds(fire_params, drought_params):
+    """Thresholds of the coarse pass: each detector's lowered by its cascade_margin, a fraction of the threshold."""
+    return {
+        "fire": fire_params["intensity_threshold"] * (1 - fire_params.get("cascade_margin", 0)),
+        "drought": drought_params["drought_threshold"] * (1 - drought_params.get("cascade_margin", 0)),
+    }
+
+
+def unreachable_detectors(fire_params, drought_params):
+    """Detectors whose threshold is at or above the largest value of their index, so their mask is always empty."""
+    limits = {
+        "fire": (fire_params["intensity_threshold"], FIRE_INTENSITY_MAX),
+        # Severity is ndvi_weight * (1 - pseudo-NDVI) + color_weight * brown, both parts at most 1
+        "drought": (drought_params["drought_threshold"],
+                    drought_params["ndvi_weight"] + drought_params["color_weight"]),
+    }
+    return {name: top for name, (threshold, top) in limits.items() if threshold >= top}
+
+
+def coarse_flags(coarse, fire_params, drought_params):
+    """Coarse pixels that may hold fire or drought: index above the coarse threshold."""
+    thresholds = coarse_thresholds(fire_params, drought_params)
+    return {
+        "fire": calculate_fire_intensity(coarse.image) > thresholds["fire"],
+        "drought": drought_severity_map(coarse.image, drought_params) > thresholds["drought"],
+    }
+
+
+def _coarse_window(window, coarse, pad=PAD):
+    """Coarse slices covering a window and its halo."""
+    height, width = coarse.image.shape[:2]
+    top, bottom = window.row - window.top, window.row + window.height + window.bottom
+    left, right = window.col - window.left, window.col + window.width + window.right
+    r0 = max(int(np.floor(top / coarse.factor_y)) - pad, 0)
+    r1 = min(int(np.ceil(bottom / coarse.factor_y)) + pad, height)
+    c0 = max(int(np.floor(left / coarse.factor_x)) - pad, 0)
+    c1 = min(int(np.ceil(right / coarse.factor_x)) + pad, width)
+    return slice(r0, r1), slice(c0, c1)
+
+
+def run_cascade(reader, fire_params, drought_params, tile_size=512, coarse=None, verify=False):
+    """Fire and drought masks computed only on the tiles a coarse pass flags.
+
+    The indices are evaluated on the coarse image (an overview or the
+    thumbnail) with thresholds lowered by each detector's cascade_margin. A
+    tile is decoded at full resolution only if a coarse pixel over it or
+    its halo is flagged, and then only the flagged detectors run; their
+    masks equal the fused pass on those tiles. Features smaller than a
+    coarse pixel whose index differs from their coarse pixel by more than
+    the margin can be missed: with verify=True every tile is processed and
+    the pixels the cascade would have missed are counted, to tune the margins.
+    A detector whose threshold its index never exceeds is reported as
+    unreachable: it skips every tile and verifies with 0 misses trivially.
+    """
+    unreachable = unreachable_detectors(fire_params, drought_params)
+    for name, top in unreachable.items():
+        print(f"[WARN] The {name} threshold is not below {top}, the largest {name} index; "
+              f"the {name} mask is always empty")
+    halo = mask_halo(fire_params, drought_params)
+    reserve_row_cache(reader, tile_size, halo)
+    flags = coarse_flags(coarse, fire_params, drought_params) if coarse is not None else None
+    detectors = {
+        "fire": lambda tile: detect_fire(tile, fire_params["intensity_threshold"], fire_params["kernel_size"]),
+        "drought": lambda tile: detect_drought_mask(tile, drought_params),
+    }
+
+    height, width = reader.height, reader.width
+    masks = {name: np.zeros((height, width), dtype=np.uint8) for name in detectors}
+    flagged = {name: 0 for name in detectors}
+    misses = {name: 0 for name in detectors}
+    read_pixels = 0
+    windows = reader.windows(tile_size, halo)
+    for window in windows:
+        if flags is None:
+            need = {name: True for name in detectors}
+        else:
+            region = _coarse_window(window, coarse)
+            need = {name: bool(flags[name][region].any()) for name in detectors}
+        pixels = window.height * window.width
+        if any(need.values()):
+            read_pixels += pixels
+        elif not verify:
+            continue
+
+        tile = to_rgb(reader.read_halo_window(window))
+        core = (slice(window.row, window.row + window.height),
+                slice(window.col, window.col + window.width))
+        for name, detect in detectors.items():
+            if not (need[name] or verify):
+                continue
+            mask = crop_halo(detect(tile), window)
+            if need[name]:
+                masks[name][core] = mask
+                flagged[name] += pixels
+            else:
+                misses[name] += int(np.count_nonzero(mask))
+
+    total_pixels = height * width
+    report = {
+        "coarse": coarse.source if coarse is not None else None,
+        "factor": [coarse.factor_y, coarse.factor_x] if coarse is not None else None,
+        "tiles": len(windows),
+        "skipped_fraction": 1 - read_pixels / total_pixels,
+        "fire_skipped_fraction": 1 - flagged["fire"] / total_pixels,
+        "drought_skipped_fraction": 1 - flagged["drought"] / total_pixels,
+        "margins": {"fire": fire_params.get("cascade_margin", 0), "drought": drought_params.get("cascade_margin", 0)},
+        "coarse_thresholds": coarse_thresholds(fire_params, drought_params),
+        "unreachable": sorted(unreachable),
+        "missed_pixels": misses if verify else None,
+    }
+    return CascadeResult(
+        masks["fire"], masks["drought"],
+        fire_coverage=np.count_nonzero(masks["fire"]) / total_pixels * 100,
+        drought_coverage=np.count_nonzero(masks["drought"]) / total_pixels * 100,
+        report=report,
+    )
+
+
+def main():
+    from drought_detection.config import DROUGHT_PARAMS
+    from fire_detection.config import FIRE_PARAMS
+    from utils.load_project_data import asset_local_path
+    from utils.stac_catalog import open_catalog
+
+    parser = argparse.ArgumentParser(description="Coarse-to-fine fire and drought detection.")
+    parser.add_argument("input", nargs="?", default=str(FIGURES_DIR / "TCI_COG.tiff"))
+    parser.add_argument("--coarse", choices=["overview", "thumbnail"], default="overview")
+    parser.add_argument("--thumbnail", help="Thumbnail file (default: the downloaded thumbnail of --feature-id)")
+    parser.add_argument("--feature-id", help="STAC feature whose thumbnail asset to use")
+    parser.add_argument("--max-factor", type=float, default=MAX_FACTOR, help="Coarsest overview to use")
+    parser.add_argument("--fire-margin", type=float, default=FIRE_PARAMS["cascade_margin"],
+                        help="Coarse threshold slack as a fraction of the fire threshold")
+    parser.add_argument("--drought-margin", type=float, default=DROUGHT_PARAMS["cascade_margin"],
+                        help="Coarse threshold slack as a fraction of the drought threshold")
+    parser.add_argument("--tile-size", type=int, default=512)
+    parser.add_argument("--verify", action="store_true", help="Also process skipped tiles and count misses")
+    parser.add_argument("--output-dir", default=str(FIGURES_DIR / "cascade"))
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        print(f"Error: Input image {args.input} not found!")
+        return
+    fire_params = dict(FIRE_PARAMS, cascade_margin=args.fire_margin)
+    drought_params = dict(DROUGHT_PARAMS, cascade_margin=args.drought_margin)
+
+    with open_cog(args.input) as reader:
+        if args.coarse == "thumbnail":
+            thumbnail = args.thumbnail
+            if thumbnail is None and args.feature_id:
+                with open_catalog() as catalog:
+                    feature = catalog.get_feature(args.feature_id)
+                if feature is not None and "thumbnail" in feature.get("assets", {}):
+                    thumbnail = asset_local_path(feature, "thumbnail")
+            if thumbnail is None or not os.path.exists(thumbnail):
+                print("Error: No thumbnail found; pass --thumbnail or download it with fetch_project_data.py")
+                return
+            coarse = thumbnail_coarse(reader, thumbnail)
+        else:
+            coarse = overview_coarse(reader, args.max_factor)
+            if coarse is None:
+                print("[WARN] No overview within the maximum factor; every tile is processed")
+        result = run_cascade(reader, fire_params, drought_params, args.tile_size, coarse, args.verify)
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    cv2.imwrite(str(output_dir / "fire_mask.png"), result.fire_mask * 255)
+    cv2.imwrite(str(output_dir / "drought_mask.png"), result.drought_mask * 255)
+    summary = {"fire_coverage": result.fire_coverage, "drought_coverage": result.drought_coverage, **result.report}
+    with open(output_dir / "result.json", "w") as f:
+        json.dump(summary, f, indent=4)
+
+    report = result.report
+    print("Cascade detection completed successfully!")
+    print(f"Coarse pass: {report['coarse'] or 'none'}")
+    print(f"Skipped {report['skipped_fraction'] * 100:.1f}% of the scene "
+          f"(fire {report['fire_skipped_fraction'] * 100:.1f}%, drought {report['drought_skipped_fraction'] * 100:.1f}%)")
+    print(f"Fire coverage: {result.fire_coverage:.2f}% of the image")
+    print(f"Potential drought coverage: {result.drought_coverage:.2f}% of the image")
+    if report["missed_pixels"] is not None:
+        print(f"Missed pixels: fire {report['missed_pixels']['fire']}, drought {report['missed_pixels']['drought']}")
+    print(f"Masks saved in: {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import io
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import tifffile
+
+# A window of the image: the core region (row, col, height, width) plus the
+# halo actually included on each side (clipped at the image edges).
+Window = namedtuple("Window", ["row", "col", "height", "width", "top", "left", "bottom", "right"])
+
+
+class HTTPRangeFile(io.RawIOBase):
+    """Read-only, seekable file object backed by HTTP Range requests.
+
+    Only the blocks tifffile actually touches (header, IFDs and the tiles of
+    the requested windows) are downloaded, so remote COGs can be read lazily.
+    """
+
+    def __init__(self, url, session=None, block_size=1 << 20, max_blocks=64):
+        if session is None:
+            import requests
+            session = requests.Session()
+            token = os.getenv("OC_API_TOKEN")
+            if token:
+                session.headers.update({"Authorization": f"Bearer {token}"})
+        self.url = url
+        self.session = session
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self._blocks = OrderedDict()
+        self._pos = 0
+        response = session.head(url, allow_redirects=True)
+        response.raise_for_status()
+        self._size = int(response.headers["Content-Length"])
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = self._size + offset
+        return self._pos
+
+    def _block(self, index):
+        if index in self._blocks:
+            self._blocks.move_to_end(index)
+            return self._blocks[index]
+        start = index * self.block_size
+        end = min(start + self.block_size, self._size) - 1
+        response = self.session.get(self.url, headers={"Range": f"bytes={start}-{end}"})
+        response.raise_for_status()
+        block = response.content
+        self._blocks[index] = block
+        if len(self._blocks) > self.max_blocks:
+            self._blocks.popitem(last=False)
+        return block
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._size - self._pos
+        size = max(0, min(size, self._size - self._pos))
+        chunks = []
+        while size > 0:
+            index, offset = divmod(self._pos, self.block_size)
+            chunk = self._block(index)[offset:offset + size]
+            chunks.append(chunk)
+            self._pos += len(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class COGReader:
+    """Lazy, window-based reader for (cloud-optimized) GeoTIFFs.
+
+    Only the tiles or strips intersecting a requested window are read and
+    decoded; uncompressed contiguous files are memory-mapped instead.
+    Images are always returned as (height, width) or (height, width, samples).
+    """
+
+    def __init__(self, source, level=0, cache_size=64):
+        if isinstance(source, str) and source.startswith(("http://", "https://")):
+            self._tif = tifffile.TiffFile(HTTPRangeFile(source), name=os.path.basename(source))
+        else:
+            self._tif = tifffile.TiffFile(source)
+        self.source = source
+        series = self._tif.series[0]
+        self.num_levels = len(series.levels)
+        self._page = series.levels[level].keyframe
+        page = self._page
+        self.height = page.imagelength
+        self.width = page.imagewidth
+        self.samples = page.samplesperpixel
+        self.dtype = page.dtype
+        self.is_tiled = page.is_tiled
+        if self.is_tiled:
+            self.segment_shape = (page.tilelength, page.tilewidth)
+        else:
+            self.segment_shape = (min(page.rowsperstrip, self.height), self.width)
+        self._planar = page.planarconfig == 2 and self.samples > 1
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self.cache_size = cache_size
+        self._memmap = None
+        if level == 0 and page.is_memmappable and isinstance(source, (str, os.PathLike)):
+            self._memmap = self._normalize(self._tif.asarray(out="memmap"))
+
+    @property
+    def shape(self):
+        if self.samples > 1:
+            return (self.height, self.width, self.samples)
+        return (self.height, self.width)
+
+    @property
+    def tags(self):
+        """TIFF tags of the full-resolution page (used to copy georeference)."""
+        return self._tif.series[0].levels[0].keyframe.tags
+
+    def close(self):
+        self._tif.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _normalize(self, array):
+        """Return arrays in (height, width[, samples]) order."""
+        if self._planar:
+            array = np.moveaxis(array, 0, -1)
+        return array
+
+    def _decode_segment(self, index):
+        """Decode one tile or strip to a (length, width, samples) array."""
+        with self._lock:
+            if index in self._cache:
+                self._cache.move_to_end(index)
+                return self._cache[index]
+            page = self._page
+            fh = self._tif.filehandle
+            bytecount = page.databytecounts[index]
+            if bytecount:
+                fh.seek(page.dataoffsets[index])
+                data = fh.read(bytecount)
+            else:
+                data = None
+        segment, _, shape = page.decode(data, index, jpegtables=page.jpegtables)
+        if segment is None:
+            segment = np.zeros(shape[-3:], dtype=self.dtype)
+        segment = segment.reshape(shape[-3:])
+        with self._lock:
+            self._cache[index] = segment
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return segment
+
+    def read_window(self, row, col, height, width):
+        """Read the window [row:row+height, col:col+width] (clipped to the image)."""
+        row0, col0 = max(row, 0), max(col, 0)
+        row1, col1 = min(row + height, self.height), min(col + width, self.width)
+        if self._memmap is not None:
+            return np.array(self._memmap[row0:row1, col0:col1])
+
+        out = np.zeros((row1 - row0, col1 - col0, self.samples), dtype=self.dtype)
+        seg_h, seg_w = self.segment_shape
+        across = -(-self.width // seg_w)
+        down = -(-self.height // seg_h)
+        planes = self.samples if self._planar else 1
+        for plane in range(planes):
+            for ty in range(row0 // seg_h, (row1 - 1) // seg_h + 1):
+                for tx in range(col0 // seg_w, (col1 - 1) // seg_w + 1):
+                    index = plane * down * across + ty * across + tx
+                    segment = self._decode_segment(index)
+                    y0, x0 = ty * seg_h, tx * seg_w
+                    sy0, sy1 = max(row0, y0), min(row1, y0 + seg_h)
+                    sx0, sx1 = max(col0, x0), min(col1, x0 + seg_w)
+                    block = segment[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0]
+                    if self._planar:
+                        out[sy0 - row0:sy1 - row0, sx0 - col0:sx1 - col0, plane] = block[..., 0]
+                    else:
+                        out[sy0 - row0:sy1 - row0, sx0 - col0:sx1 - col0] = block
+        if self.samples == 1:
+            out = out[..., 0]
+        return out
+
+    def read(self):
+        """Read the whole image at this level."""
+        return self.read_window(0, 0, self.height, self.width)
+
+    def windows(self, size=1024, halo=0):
+        """Return the Window grid covering the image with the given halo."""
+        return window_grid(self.height, self.width, size, halo)
+
+    def read_halo_window(self, window):
+        """Read a Window including its halo."""
+        return self.read_window(
+            window.row - window.top,
+            window.col - window.left,
+            window.height + window.top + window.bottom,
+            window.width + window.left + window.right,
+        )
+
+    def iter_windows(self, size=1024, halo=0):
+        """Yield (window, data) pairs covering the image; data includes the halo."""
+        for window in self.windows(size, halo):
+            yield window, self.read_halo_window(window)
+
+
+def window_grid(height, width, size=1024, halo=0):
+    """Return the Window grid covering a height x width image with the given halo."""
+    if isinstance(size, int):
+        size = (size, size)
+    result = []
+    for row in range(0, height, size[0]):
+        for col in range(0, width, size[1]):
+            win_h = min(size[0], height - row)
+            win_w = min(size[1], width - col)
+            result.append(Window(
+                row, col, win_h, win_w,
+                top=min(halo, row),
+                left=min(halo, col),
+                bottom=min(halo, height - row - win_h),
+                right=min(halo, width - col - win_w),
+            ))
+    return result
+
+
+def crop_halo(data, window):
+    """Strip the halo from an array computed over a halo window."""
+    return data[window.top:window.top + window.height, window.left:window.left + window.width]
+
+
+def open_cog(source, level=0):
+    """Open a local path or http(s) href as a COGReader."""
+    if isinstance(source, os.PathLike):
+        source = os.fspath(source)
+    return COGReader(source, level=level)
+
+
+def read_image(source, level=0):
+    """Read a whole image through COGReader (drop-in for tifffile/skimage imread)."""
+    with open_cog(source, level=level) as reader:
+        return reader.read()
+
+
+def open_asset(feature, asset_key, data_dir=None, level=0):
+    """Open a STAC feature asset, preferring a downloaded copy over the remote href."""
+    from utils.load_project_data import asset_local_path
+
+    local_path = asset_local_path(feature, asset_key, data_dir)
+    if os.path.exists(local_path):
+        return open_cog(local_path, level=level)
+    return open_cog(feature["assets"][asset_key]["href"], level=level)
@@ -0,0 +1,150 @@
+import os
+import tempfile
+
+import numpy as np
+import tifffile
+
+# GeoTIFF / GDAL tags copied from the source image
+GEOREF_TAGS = {
+    33550: "ModelPixelScaleTag",
+    33922: "ModelTiepointTag",
+    34264: "ModelTransformationTag",
+    34735: "GeoKeyDirectoryTag",
+    34736: "GeoDoubleParamsTag",
+    34737: "GeoAsciiParamsTag",
+    42112: "GDAL_METADATA",
+    42113: "GDAL_NODATA",
+}
+
+DEFAULT_TILE = 512
+DEFAULT_COMPRESSION = "zlib"
+
+
+def georef_tags(tags, scale=1):
+    """Build tifffile extratags that carry the georeference of `tags` over.
+
+    `tags` is a tifffile TiffTags (e.g. COGReader.tags). For outputs upscaled
+    by `scale` the pixel size (and the linear part of a model transformation)
+    is divided accordingly; tie points are unchanged since pixel (0, 0) keeps
+    its corner.
+    """
+    extratags = []
+    for code in GEOREF_TAGS:
+        tag = tags.get(code)
+        if tag is None:
+            continue
+        value = tag.value
+        if scale != 1 and code == 33550:
+            value = (value[0] / scale, value[1] / scale) + tuple(value[2:])
+        elif scale != 1 and code == 34264:
+            value = list(value)
+            for index in (0, 1, 4, 5, 8, 9):
+                value[index] /= scale
+            value = tuple(value)
+        count = None if isinstance(value, (str, bytes)) else len(value) if isinstance(value, (tuple, list)) else 1
+        extratags.append((code, tag.dtype, count, value, True))
+    return extratags
+
+
+def read_georef(path, scale=1):
+    """Georeference extratags of the TIFF at `path` ([] when it has none or is not a TIFF)."""
+    try:
+        with tifffile.TiffFile(path) as tif:
+            return georef_tags(tif.pages[0].tags, scale)
+    except (tifffile.TiffFileError, OSError):
+        return []
+
+
+def overview_shapes(shape, tile=DEFAULT_TILE, levels=None):
+    """Shapes of the 2x reduced overview levels, down to one tile by default."""
+    shapes = []
+    height, width = shape[:2]
+    while (levels is None and max(height, width) > tile) or (levels is not None and len(shapes) < levels):
+        height, width = -(-height // 2), -(-width // 2)
+        shapes.append((height, width) + tuple(shape[2:]))
+        if height == 1 and width == 1:
+            break
+    return shapes
+
+
+def downsample2(block, resampling="average"):
+    """Halve a block: 2x2 mean ('average') or top-left sample ('nearest')."""
+    if resampling == "nearest":
+        return block[::2, ::2]
+    pad = ((0, block.shape[0] % 2), (0, block.shape[1] % 2)) + ((0, 0),) * (block.ndim - 2)
+    if any(p[1] for p in pad):
+        block = np.pad(block, pad, mode="edge")
+    height, width = block.shape[0] // 2, block.shape[1] // 2
+    mean = block.reshape((height, 2, width, 2) + block.shape[2:]).mean(axis=(1, 3))
+    if np.issubdtype(block.dtype, np.integer):
+        mean = np.rint(mean)
+    return mean.astype(block.dtype)
+
+
+def _photometric(shape):
+    if len(shape) == 3 and shape[2] in (3, 4):
+        return "rgb"
+    return "minisblack"
+
+
+def write_cog(path, data, shape=None, dtype=None, tile=DEFAULT_TILE, compression=DEFAULT_COMPRESSION,
+              predictor=None, overviews=None, resampling="average", georef=None, maxworkers=None):
+    """Write a tiled, compressed, pyramidal BigTIFF.
+
+    `data` is an array or an iterator of tiles in row-major order (edge tiles
+    may be smaller), in which case `shape` and `dtype` are required and the
+    tiles are consumed as they are produced. The 2x overviews are written as
+    reduced-resolution IFDs after the full-resolution image (as GDAL and
+    COGReader read them); level 1 is built from the tiles on the fly into a
+    temporary memmap, so the full image is never held in memory.
+    Tiles are compressed on `maxworkers` threads.
+    """
+    if isinstance(data, np.ndarray):
+        shape, dtype = data.shape, data.dtype
+        tiles = (data[row:row + tile, col:col + tile]
+                 for row in range(0, shape[0], tile) for col in range(0, shape[1], tile))
+    else:
+        tiles = data
+    shape, dtype = tuple(shape), np.dtype(dtype)
+    if tile % 16:
+        raise ValueError("tile size must be a multiple of 16")
+    if predictor is None:
+        predictor = compression is not None and np.issubdtype(dtype, np.integer)
+    levels = overview_shapes(shape, tile, overviews)
+    options = dict(
+        tile=(tile, tile),
+        compression=compression,
+        predictor=predictor or None,
+        photometric=_photometric(shape),
+        planarconfig="contig" if len(shape) == 3 else None,
+        maxworkers=maxworkers,
+    )
+
+    def scratch(level_shape):
+        return np.memmap(tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path))),
+                         dtype=dtype, mode="w+", shape=level_shape)
+
+    overview = scratch(levels[0]) if levels else None
+
+    def feed(tiles):
+        across = -(-shape[1] // tile)
+        for index, block in enumerate(tiles):
+            if overview is not None:
+                row, col = divmod(index, across)
+                reduced = downsample2(np.asarray(block), resampling)
+                overview[row * tile // 2:row * tile // 2 + reduced.shape[0],
+                         col * tile // 2:col * tile // 2 + reduced.shape[1]] = reduced
+            yield block
+
+    with tifffile.TiffWriter(path, bigtiff=True) as tif:
+        tif.write(feed(tiles), shape=shape, dtype=dtype, subfiletype=0, extratags=georef or [], **options)
+        previous = overview
+        for level, level_shape in enumerate(levels):
+            if level > 0:
+                current = scratch(level_shape)
+                for row in range(0, previous.shape[0], 2 * tile):
+                    reduced = downsample2(np.asarray(previous[row:row + 2 * tile]), resampling)
+                    current[row // 2:row // 2 + reduced.shape[0]] = reduced
+                previous = current
+            tif.write(previous, subfiletype=1, **options)
+    return shape
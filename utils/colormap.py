@@ -0,0 +1,148 @@
+import os
+import struct
+import zlib
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+# ColorBrewer 9-class sequential schemes (the anchors of the matplotlib colormaps
+# of the same name)
+COLORMAPS = {
+    "YlOrBr": "ffffe5 fff7bc fee391 fec44f fe9929 ec7014 cc4c02 993404 662506",
+    "YlOrRd": "ffffcc ffeda0 fed976 feb24c fd8d3c fc4e2a e31a1c bd0026 800026",
+    "OrRd": "fff7ec fee8c8 fdd49e fdbb84 fc8d59 ef6548 d7301f b30000 7f0000",
+    "Reds": "fff5f0 fee0d2 fcbba1 fc9272 fb6a4a ef3b2c cb181d a50f15 67000d",
+    "Greens": "f7fcf5 e5f5e0 c7e9c0 a1d99b 74c476 41ab5d 238b45 006d2c 00441b",
+    "YlGn": "ffffe5 f7fcb9 d9f0a3 addd8e 78c679 41ab5d 238443 006837 004529",
+    "Blues": "f7fbff deebf7 c6dbef 9ecae1 6baed6 4292c6 2171b5 08519c 08306b",
+    "Greys": "ffffff f0f0f0 d9d9d9 bdbdbd 969696 737373 525252 252525 000000",
+}
+
+ROWS_PER_BAND = 256
+
+
+@lru_cache(maxsize=None)
+def colormap_lut(name="YlOrBr", n=256):
+    """(n, 3) uint8 colour table, interpolated like matplotlib's LinearSegmentedColormap.
+
+    A trailing "_r" reverses the colormap.
+    """
+    reverse = name.endswith("_r")
+    anchors = COLORMAPS[name[:-2] if reverse else name].split()
+    colors = np.array([[int(a[i:i + 2], 16) / 255 for i in (0, 2, 4)] for a in anchors])
+    if reverse:
+        colors = colors[::-1]
+    x = np.linspace(0, 1, len(colors)) * (n - 1)
+    xind = (n - 1) * np.linspace(0, 1, n)
+    ind = np.searchsorted(x, xind)[1:-1]
+    distance = (xind[1:-1] - x[ind - 1]) / (x[ind] - x[ind - 1])
+    lut = distance[:, None] * (colors[ind] - colors[ind - 1]) + colors[ind - 1]
+    lut = np.clip(np.concatenate([colors[:1], lut, colors[-1:]]), 0, 1)
+    return (lut * 255).astype(np.uint8)
+
+
+def color_indices(data, vmin, vmax, n=256):
+    """Map values to colour table indices the way matplotlib's Normalize + Colormap do."""
+    scaled = np.asarray(data, dtype=np.float64) - vmin
+    if vmax > vmin:
+        scaled /= vmax - vmin
+    else:
+        scaled[...] = 0
+    scaled *= n
+    np.clip(scaled, 0, n - 1, out=scaled)
+    return scaled.astype(np.intp)
+
+
+def apply_colormap(data, cmap="YlOrBr", vmin=None, vmax=None, out=None):
+    """Render a 2-D raster (float, integer or mask) to an RGB uint8 image by table lookup."""
+    lut = colormap_lut(cmap)
+    if vmin is None:
+        vmin = float(np.min(data))
+    if vmax is None:
+        vmax = float(np.max(data))
+    if out is None:
+        out = np.empty(data.shape[:2] + (3,), dtype=np.uint8)
+    for row in range(0, data.shape[0], ROWS_PER_BAND):
+        np.take(lut, color_indices(data[row:row + ROWS_PER_BAND], vmin, vmax, len(lut)),
+                axis=0, out=out[row:row + ROWS_PER_BAND])
+    return out
+
+
+def colormap_bands(data, cmap="YlOrBr", vmin=None, vmax=None, rows=ROWS_PER_BAND):
+    """Yield the colour-mapped raster one band of rows at a time (data may be a memmap)."""
+    if vmin is None:
+        vmin = float(np.min(data))
+    if vmax is None:
+        vmax = float(np.max(data))
+    for row in range(0, data.shape[0], rows):
+        yield apply_colormap(np.asarray(data[row:row + rows]), cmap, vmin, vmax)
+
+
+def _png_chunk(tag, payload):
+    return struct.pack(">I", len(payload)) + tag + payload + struct.pack(">I", zlib.crc32(tag + payload))
+
+
+def write_png(path, bands, width, height, channels=3, level=6):
+    """Stream row bands of an 8-bit image into a PNG file.
+
+    Rows use the PNG "up" filter and are deflated as they arrive, so only the
+    current band is ever in memory.
+    """
+    color_type = {1: 0, 3: 2, 4: 6}[channels]
+    compressor = zlib.compressobj(level)
+    previous = np.zeros((width * channels,), dtype=np.uint8)
+    written = 0
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(_png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)))
+        for band in bands:
+            rows = np.ascontiguousarray(band, dtype=np.uint8).reshape(len(band), width * channels)
+            filtered = np.empty((len(rows), width * channels + 1), dtype=np.uint8)
+            filtered[:, 0] = 2
+            np.subtract(rows[0], previous, out=filtered[0, 1:])
+            np.subtract(rows[1:], rows[:-1], out=filtered[1:, 1:])
+            previous = rows[-1].copy()
+            written += len(rows)
+            data = compressor.compress(filtered.tobytes())
+            if data:
+                f.write(_png_chunk(b"IDAT", data))
+        f.write(_png_chunk(b"IDAT", compressor.flush()))
+        f.write(_png_chunk(b"IEND", b""))
+    if written != height:
+        raise ValueError(f"Expected {height} rows, got {written}")
+
+
+def render_legend(output_path, cmap="YlOrBr", vmin=0.0, vmax=1.0, label="", height=256, width=24):
+    """Write a small vertical colour bar with min/max ticks and a label as its own image."""
+    ramp = colormap_lut(cmap)[::-1]
+    bar = cv2.resize(ramp[:, None, :], (width, height), interpolation=cv2.INTER_NEAREST)
+    canvas = np.full((height + 40, width + 140, 3), 255, dtype=np.uint8)
+    canvas[20:20 + height, 10:10 + width] = bar
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    cv2.putText(canvas, f"{vmax:.3g}", (width + 16, 28), font, 0.45, (0, 0, 0), 1, cv2.LINE_AA)
+    cv2.putText(canvas, f"{vmin:.3g}", (width + 16, 20 + height), font, 0.45, (0, 0, 0), 1, cv2.LINE_AA)
+    cv2.putText(canvas, label, (width + 16, 20 + height // 2), font, 0.45, (0, 0, 0), 1, cv2.LINE_AA)
+    cv2.imwrite(str(output_path), cv2.cvtColor(canvas, cv2.COLOR_RGB2BGR))
+
+
+def render_heatmap(data, output_path, cmap="YlOrBr", vmin=None, vmax=None, legend_label=None):
+    """Colour-map a raster straight to PNG (streamed in bands) or WebP/JPEG (via OpenCV).
+
+    With legend_label a colour bar is written next to it as <name>_legend.png.
+    Returns the (vmin, vmax) used.
+    """
+    if vmin is None:
+        vmin = float(np.min(data))
+    if vmax is None:
+        vmax = float(np.max(data))
+    output_path = str(output_path)
+    height, width = data.shape[:2]
+    if output_path.lower().endswith(".png"):
+        write_png(output_path, colormap_bands(data, cmap, vmin, vmax), width, height)
+    else:
+        rgb = apply_colormap(data, cmap, vmin, vmax)
+        cv2.imwrite(output_path, cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_WEBP_QUALITY, 90])
+    if legend_label is not None:
+        render_legend(f"{os.path.splitext(output_path)[0]}_legend.png", cmap, vmin, vmax, legend_label)
+    return vmin, vmax
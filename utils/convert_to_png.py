@@ -4,20 +4,23 @@ import tifffile
 import cv2
 import numpy as np
 
-def convert_tiff_to_png(input_path, output_path):
-    """Convert TIFF image to PNG format."""
-    # Read TIFF image
-    image = tifffile.imread(input_path)
-    
+def to_uint8(image):
+    """Stretch non-8-bit images to the 0-255 range."""
     # Normalize image to 0-255 range if needed
     if image.dtype != np.uint8:
         # Normalize to 0-1 range
         normalized = (image - np.min(image)) / (np.max(image) - np.min(image))
         # Convert to 0-255 range
         image = (normalized * 255).astype(np.uint8)
+    return image
+
+def convert_tiff_to_png(input_path, output_path):
+    """Convert TIFF image to PNG format."""
+    # Read TIFF image
+    image = tifffile.imread(input_path)
     
     # Save as PNG
-    cv2.imwrite(output_path, image)
+    cv2.imwrite(str(output_path), to_uint8(image))
     print(f"Converted {input_path} to {output_path}")
 
 def main():
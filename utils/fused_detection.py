@@ -0,0 +1,204 @@
+import argparse
+import os
+from collections import namedtuple
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from carbon_detection.utils.region_engine import filter_regions_tiled
+from drought_detection.utils.drought_detection import detect_drought_mask, drought_severity_map
+from fire_detection.utils.fire_detection import detect_fire
+from utils.cog_reader import crop_halo, open_cog
+from utils.packed_mask import MASK_SUFFIXES, PackedMask, count_pixels, save_mask
+from utils.tile_stats import DEFAULT_TILE, TileStats, TileStatsStore
+
+FusedResult = namedtuple("FusedResult", [
+    "fire_mask", "drought_mask", "carbon_mask",
+    "fire_coverage", "drought_coverage", "carbon_coverage", "tile_stats",
+], defaults=[None])
+
+
+def to_rgb(image):
+    """Convert grayscale or RGBA tiles to RGB, as the detector mains do."""
+    if len(image.shape) == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_RGBA2RGB)
+    return image
+
+
+def _channel_sum_dtype(dtype):
+    """Smallest dtype that holds the exact sum of three channels."""
+    if dtype == np.uint8:
+        return np.uint16
+    if np.issubdtype(dtype, np.integer) and dtype.itemsize <= 2:
+        return np.uint32
+    return np.float64
+
+
+def _carbon_mask(channel_sum, threshold, min_area, tile_size=1024):
+    """Normalise the channel mean globally, threshold it and filter small regions.
+
+    Components are labelled tile by tile and merged across seams, so only one
+    tile of float temporaries and labels is alive at a time; the arithmetic
+    matches detect_carbon_regions exactly.
+    """
+    low = channel_sum.min() / 3.0
+    high = channel_sum.max() / 3.0
+
+    def read_tile(row, col, height, width):
+        mean = channel_sum[row:row + height, col:col + width] / 3.0
+        return (mean - low) / (high - low) > threshold, None
+
+    mask, _ = filter_regions_tiled(read_tile, channel_sum.shape, min_area=min_area, tile_size=tile_size)
+    return mask
+
+
+def mask_halo(fire_params, drought_params):
+    """Halo that makes tiled fire/drought masks match whole-image ones."""
+    kernel_size = max(fire_params["kernel_size"], drought_params["kernel_size"])
+    # Opening then closing chains four erosions/dilations
+    return 4 * (kernel_size // 2)
+
+
+def reserve_row_cache(reader, tile_size, halo):
+    """Size the reader cache for a full row of decoded segments (plus halo).
+
+    Neighbouring windows then never decode the same tile twice.
+    """
+    seg_h, seg_w = reader.segment_shape
+    segments_across = -(-reader.width // seg_w)
+    segments_down = -(-(tile_size + 2 * halo) // seg_h) + 1
+    reader.cache_size = max(reader.cache_size, segments_across * segments_down)
+
+
+def run_fused_detection(reader, fire_params, drought_params, carbon_params, tile_size=1024, stats_tile=None,
+                        zones=None, packed=False):
+    """Compute fire, drought and carbon masks in a single tiled pass over the scene.
+
+    Every source tile is decoded once; the fire and drought masks are
+    evaluated per tile (with a halo covering the open/close footprint) and the
+    carbon channel sum is accumulated so the global normalisation can be
+    applied after the pass. With stats_tile, per-tile statistics on a grid of
+    that size are collected from the same decoded tiles (see tile_stats);
+    with a ZonalStats, per-zone sums are (see zonal_stats). With packed=True
+    the masks are kept as PackedMask (1 bit per pixel, filled tile by tile;
+    tile_size must then be a multiple of 8).
+    """
+    halo = mask_halo(fire_params, drought_params)
+    reserve_row_cache(reader, tile_size, halo)
+
+    height, width = reader.height, reader.width
+    if packed:
+        fire_mask = PackedMask.zeros((height, width))
+        drought_mask = PackedMask.zeros((height, width))
+    else:
+        fire_mask = np.zeros((height, width), dtype=np.uint8)
+        drought_mask = np.zeros((height, width), dtype=np.uint8)
+    channel_sum = np.zeros((height, width), dtype=_channel_sum_dtype(reader.dtype))
+    stats = TileStats(height, width, stats_tile) if stats_tile else None
+
+    for window, tile in reader.iter_windows(tile_size, halo=halo):
+        tile = to_rgb(tile)
+        core = (slice(window.row, window.row + window.height),
+                slice(window.col, window.col + window.width))
+
+        fire_tile = detect_fire(
+            tile,
+            threshold=fire_params["intensity_threshold"],
+            kernel_size=fire_params["kernel_size"]
+        )
+        fire_tile = crop_halo(fire_tile, window)
+
+        drought_tile = crop_halo(detect_drought_mask(tile, drought_params), window)
+        if packed:
+            fire_mask.set_window(window.row, window.col, fire_tile)
+            drought_mask.set_window(window.row, window.col, drought_tile)
+        else:
+            fire_mask[core] = fire_tile
+            drought_mask[core] = drought_tile
+
+        core_tile = crop_halo(tile, window)
+        channel_sum[core] = core_tile.sum(axis=2, dtype=channel_sum.dtype)
+        if stats is not None or zones is not None:
+            severity = drought_severity_map(core_tile, drought_params)
+        if stats is not None:
+            stats.add_image(core_tile, severity, window.row, window.col)
+        if zones is not None:
+            zones.add_tile(window.row, window.col, core_tile, fire_tile, drought_tile, severity)
+
+    carbon_mask = _carbon_mask(channel_sum, carbon_params["threshold"], carbon_params["min_area"], tile_size)
+    del channel_sum
+    if packed:
+        carbon_mask = PackedMask.pack(carbon_mask)
+    if stats is not None:
+        stats.add_masks(fire_mask, drought_mask, carbon_mask)
+    if zones is not None:
+        zones.add_carbon(carbon_mask, tile_size)
+
+    total_pixels = height * width
+    return FusedResult(
+        fire_mask, drought_mask, carbon_mask,
+        fire_coverage=count_pixels(fire_mask) / total_pixels * 100,
+        drought_coverage=count_pixels(drought_mask) / total_pixels * 100,
+        carbon_coverage=count_pixels(carbon_mask) / total_pixels * 100,
+        tile_stats=stats,
+    )
+
+
+def save_fused_result(result, output_dir, mask_format="png"):
+    """Write the three masks into output_dir as PNGs, 1-bit TIFFs ("tiff") or run lengths ("rle")."""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    masks = {"fire_mask": result.fire_mask, "drought_mask": result.drought_mask, "carbon_mask": result.carbon_mask}
+    for name, mask in masks.items():
+        if mask_format == "png":
+            if isinstance(mask, PackedMask):
+                mask = mask.unpack() * 255
+            elif name != "carbon_mask":
+                # The carbon mask is already 0/255
+                mask = mask * 255
+            cv2.imwrite(str(output_dir / f"{name}.png"), mask)
+        else:
+            save_mask(mask, output_dir / f"{name}{MASK_SUFFIXES[mask_format]}")
+
+
+def main():
+    from carbon_detection.config import CARBON_DETECTION
+    from drought_detection.config import DROUGHT_PARAMS
+    from fire_detection.config import FIRE_PARAMS
+
+    figures_dir = Path(__file__).resolve().parent.parent / "figures"
+    parser = argparse.ArgumentParser(description="Run fire, drought and carbon detection in one pass.")
+    parser.add_argument("input", nargs="?", default=str(figures_dir / "TCI_COG.tiff"))
+    parser.add_argument("--output-dir", default=str(figures_dir / "fused_detection"))
+    parser.add_argument("--tile-size", type=int, default=1024)
+    parser.add_argument("--stats", action="store_true", help="Also write per-tile statistics to the tile stats store")
+    parser.add_argument("--stats-tile", type=int, default=DEFAULT_TILE)
+    parser.add_argument("--mask-format", choices=["png", *MASK_SUFFIXES], default="png",
+                        help="png, 1-bit deflate TIFF or run lengths; tiff/rle keep the masks bit-packed in memory")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        print(f"Error: Input image {args.input} not found!")
+        return
+
+    with open_cog(args.input) as reader:
+        result = run_fused_detection(reader, FIRE_PARAMS, DROUGHT_PARAMS, CARBON_DETECTION, tile_size=args.tile_size,
+                                     stats_tile=args.stats_tile if args.stats else None,
+                                     packed=args.mask_format != "png")
+    save_fused_result(result, args.output_dir, args.mask_format)
+    if result.tile_stats is not None:
+        segment = TileStatsStore().write(Path(args.input).stem, result.tile_stats, source=args.input)
+        print(f"Tile statistics saved in: {segment}")
+
+    print("Fused detection completed successfully!")
+    print(f"Fire coverage: {result.fire_coverage:.2f}% of the image")
+    print(f"Potential drought coverage: {result.drought_coverage:.2f}% of the image")
+    print(f"Carbon coverage: {result.carbon_coverage:.2f}% of the image")
+    print(f"Masks saved in: {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
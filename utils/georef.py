@@ -0,0 +1,62 @@
+import math
+
+import cv2
+import numpy as np
+
+EARTH_RADIUS = 6378137.0
+
+
+def footprint_corners(feature):
+    """Return the four footprint vertices as [top-left, top-right, bottom-right, bottom-left].
+
+    L1 products only carry their footprint polygon, so the image corners are
+    inferred from it: the ring is put in clockwise order and started at its
+    north-west-most vertex. This assumes the image rows run roughly north to
+    south (scene rotation under 45 degrees), which holds for our strips.
+    """
+    ring = np.array(feature["geometry"]["coordinates"][0], dtype=np.float64)
+    if np.allclose(ring[0], ring[-1]):
+        ring = ring[:-1]
+    if len(ring) != 4:
+        raise ValueError(f"Expected a 4-vertex footprint, got {len(ring)} vertices")
+    x, y = ring[:, 0], ring[:, 1]
+    signed_area = np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y) / 2
+    if signed_area > 0:
+        ring = ring[::-1]  # counter-clockwise (RFC 7946) -> clockwise
+    centred = ring - ring.mean(axis=0)
+    start = int(np.argmax(centred[:, 1] - centred[:, 0]))
+    return np.roll(ring, -start, axis=0)
+
+
+def pixel_to_lonlat_matrix(feature, width, height):
+    """Homography mapping pixel (col, row) corners of a width x height raster onto the footprint."""
+    pixels = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    corners = footprint_corners(feature)
+    # Solve in coordinates relative to the first corner to keep the system well conditioned
+    origin = corners[0]
+    matrix = cv2.getPerspectiveTransform(pixels, (corners - origin).astype(np.float32))
+    shift = np.array([[1, 0, origin[0]], [0, 1, origin[1]], [0, 0, 1]])
+    return shift @ matrix
+
+
+def lonlat_to_pixel_matrix(feature, width, height):
+    """Inverse of pixel_to_lonlat_matrix."""
+    return np.linalg.inv(pixel_to_lonlat_matrix(feature, width, height))
+
+
+def apply_matrix(matrix, x, y):
+    """Apply a 3x3 homography to coordinate arrays; returns (x', y')."""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    w = matrix[2, 0] * x + matrix[2, 1] * y + matrix[2, 2]
+    return ((matrix[0, 0] * x + matrix[0, 1] * y + matrix[0, 2]) / w,
+            (matrix[1, 0] * x + matrix[1, 1] * y + matrix[1, 2]) / w)
+
+
+def ground_resolution(matrix, width, height):
+    """Approximate metres per pixel at the raster centre."""
+    lon, lat = apply_matrix(matrix, [width / 2, width / 2 + 1, width / 2], [height / 2, height / 2, height / 2 + 1])
+    metres_per_degree = math.pi * EARTH_RADIUS / 180
+    dx = math.hypot((lon[1] - lon[0]) * math.cos(math.radians(lat[0])), lat[1] - lat[0]) * metres_per_degree
+    dy = math.hypot((lon[2] - lon[0]) * math.cos(math.radians(lat[0])), lat[2] - lat[0]) * metres_per_degree
+    return (dx + dy) / 2
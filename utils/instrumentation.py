@@ -0,0 +1,321 @@
+import argparse
+import contextlib
+import functools
+import json
+import os
+import platform
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_SAMPLE_INTERVAL = 0.05
+DEFAULT_TOP_ALLOCATIONS = 5
+
+_active = None
+_NO_STAGE = contextlib.nullcontext()
+
+
+def _rss_bytes():
+    """Current resident set size, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _max_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    scale = 1 if platform.system() == "Darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def _io_bytes():
+    """(bytes read, bytes written) through read/write calls so far, or (None, None)."""
+    try:
+        with open("/proc/self/io") as io:
+            counters = dict(line.split(": ") for line in io.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _delta(after, before):
+    return None if after is None or before is None else after - before
+
+
+def _allocation_site(traceback):
+    """The innermost frame of the traceback in this repository (else the innermost frame)."""
+    for frame in reversed(traceback):
+        if frame.filename.startswith(str(ROOT_DIR)):
+            return f"{os.path.relpath(frame.filename, ROOT_DIR)}:{frame.lineno}"
+    frame = traceback[-1]
+    return f"{frame.filename}:{frame.lineno}"
+
+
+def stage(name, allocations=True):
+    """Context manager recording `name` in the active Instrumentation (a no-op when none is active).
+
+    Per-tile stages pass allocations=False: a tracemalloc snapshot per tile
+    would cost more than the tile itself.
+    """
+    if _active is None:
+        return _NO_STAGE
+    return _active.stage(name, allocations)
+
+
+def instrument(name=None):
+    """Decorator recording every call of a function as a stage (default name: its qualified name)."""
+    def decorator(func):
+        stage_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Instrumentation:
+    """Per-stage wall/CPU time, peak RSS, I/O bytes and largest NumPy buffers.
+
+    Activate it with `with Instrumentation() as inst:`; code wrapped in
+    `stage(name)` or decorated with `@instrument(name)` is then recorded,
+    aggregated by stage name (tile stages run once per tile). Peak RSS is
+    sampled by a background thread every `sample_interval` seconds. Process
+    CPU time, RSS and I/O counters are process-wide, so stages that overlap
+    (pipeline branches, tile workers, nested stages) share them.
+
+    With track_allocations, NumPy buffers are traced with tracemalloc and
+    the largest ones still alive when a stage ends (its results and
+    anything it keeps around) are reported with their allocation site.
+    Tracing slows allocation-heavy code down noticeably.
+    """
+
+    def __init__(self, track_allocations=False, top_allocations=DEFAULT_TOP_ALLOCATIONS,
+                 sample_interval=DEFAULT_SAMPLE_INTERVAL):
+        self.track_allocations = track_allocations
+        self.top_allocations = top_allocations
+        self.sample_interval = sample_interval
+        self.records = {}
+        self._running = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+        self._previous = None
+        self._started_tracing = False
+        self._start = None
+        self._end = None
+
+    def __enter__(self):
+        global _active
+        self._previous, _active = _active, self
+        self._start = (time.time(), time.perf_counter(), time.process_time())
+        if self.track_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start(16)
+            self._started_tracing = True
+        self._stop.clear()
+        self._sampler = threading.Thread(target=self._sample_loop, name="instrumentation-sampler", daemon=True)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        self._stop.set()
+        self._sampler.join()
+        self._end = (time.perf_counter(), time.process_time())
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        _active = self._previous
+        return False
+
+    def _sample(self):
+        rss = _rss_bytes()
+        if rss is None:
+            return
+        with self._lock:
+            for peak in self._running.values():
+                peak[0] = max(peak[0], rss)
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.sample_interval):
+            self._sample()
+
+    def _largest_allocations(self):
+        numpy_only = tracemalloc.DomainFilter(True, np.lib.tracemalloc_domain)
+        snapshot = tracemalloc.take_snapshot().filter_traces([numpy_only])
+        traces = sorted(snapshot.traces, key=lambda trace: trace.size, reverse=True)[:self.top_allocations]
+        return [{"bytes": trace.size, "site": _allocation_site(trace.traceback)} for trace in traces]
+
+    @contextlib.contextmanager
+    def stage(self, name, allocations=True):
+        token = object()
+        rss = _rss_bytes()
+        with self._lock:
+            self._running[token] = [rss or 0]
+        read, written = _io_bytes()
+        start_time = time.time()
+        wall, cpu, thread_cpu = time.perf_counter(), time.process_time(), time.thread_time()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            thread_cpu = time.thread_time() - thread_cpu
+            read_after, written_after = _io_bytes()
+            self._sample()
+            with self._lock:
+                peak = self._running.pop(token)[0]
+            if allocations and self.track_allocations and tracemalloc.is_tracing():
+                allocations = self._largest_allocations()
+            else:
+                allocations = []
+            self._record(name, {
+                "wall_seconds": wall,
+                "cpu_seconds": cpu,
+                "thread_cpu_seconds": thread_cpu,
+                "peak_rss_bytes": peak if rss is not None else None,
+                "read_bytes": _delta(read_after, read),
+                "written_bytes": _delta(written_after, written),
+            }, start_time, allocations, failed)
+
+    def _record(self, name, values, start_time, allocations, failed):
+        with self._lock:
+            record = self.records.get(name)
+            if record is None:
+                record = self.records[name] = {
+                    "stage": name,
+                    "calls": 0,
+                    "errors": 0,
+                    "first_started": start_time - self._start[0] if self._start else 0.0,
+                    "wall_seconds": 0.0,
+                    "max_wall_seconds": 0.0,
+                    "cpu_seconds": 0.0,
+                    "thread_cpu_seconds": 0.0,
+                    "peak_rss_bytes": None,
+                    "read_bytes": None,
+                    "written_bytes": None,
+                    "largest_allocations": [],
+                }
+            record["calls"] += 1
+            record["errors"] += failed
+            record["max_wall_seconds"] = max(record["max_wall_seconds"], values["wall_seconds"])
+            for key in ("wall_seconds", "cpu_seconds", "thread_cpu_seconds", "read_bytes", "written_bytes"):
+                if values[key] is not None:
+                    record[key] = (record[key] or 0) + values[key]
+            if values["peak_rss_bytes"] is not None:
+                record["peak_rss_bytes"] = max(record["peak_rss_bytes"] or 0, values["peak_rss_bytes"])
+            if allocations:
+                merged = record["largest_allocations"] + allocations
+                record["largest_allocations"] = sorted(merged, key=lambda a: a["bytes"], reverse=True)[
+                    :self.top_allocations]
+
+    def report(self):
+        """The run report: totals for the whole run and one record per stage, in start order."""
+        end_wall, end_cpu = self._end or (time.perf_counter(), time.process_time())
+        with self._lock:
+            stages = sorted((dict(record) for record in self.records.values()), key=lambda r: r["first_started"])
+        return {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "host": platform.node(),
+            "cpu_count": os.cpu_count(),
+            "wall_seconds": end_wall - self._start[1] if self._start else None,
+            "cpu_seconds": end_cpu - self._start[2] if self._start else None,
+            "max_rss_bytes": _max_rss_bytes(),
+            "track_allocations": self.track_allocations,
+            "stages": stages,
+        }
+
+    def write_json(self, path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(json.dumps(self.report(), indent=2))
+        return path
+
+    def write_prometheus(self, path, prefix="pipeline"):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(prometheus_text(self.report(), prefix))
+        return path
+
+
+# (report key, metric suffix, type, help)
+_STAGE_METRICS = [
+    ("calls", "stage_calls_total", "counter", "Times the stage ran."),
+    ("errors", "stage_errors_total", "counter", "Times the stage raised."),
+    ("wall_seconds", "stage_wall_seconds_total", "counter", "Wall-clock time spent in the stage."),
+    ("cpu_seconds", "stage_cpu_seconds_total", "counter", "Process CPU time while the stage ran."),
+    ("peak_rss_bytes", "stage_peak_rss_bytes", "gauge", "Highest sampled resident set size while the stage ran."),
+    ("read_bytes", "stage_read_bytes_total", "counter", "Bytes read by the process while the stage ran."),
+    ("written_bytes", "stage_written_bytes_total", "counter", "Bytes written by the process while the stage ran."),
+]
+_RUN_METRICS = [
+    ("wall_seconds", "run_wall_seconds", "gauge", "Wall-clock time of the run."),
+    ("cpu_seconds", "run_cpu_seconds", "gauge", "Process CPU time of the run."),
+    ("max_rss_bytes", "run_max_rss_bytes", "gauge", "Peak resident set size of the process."),
+]
+
+
+def prometheus_text(report, prefix="pipeline"):
+    """A run report in the Prometheus text exposition format (e.g. for the node exporter textfile collector)."""
+    lines = []
+    for key, suffix, kind, description in _RUN_METRICS:
+        if report.get(key) is not None:
+            lines += [f"# HELP {prefix}_{suffix} {description}", f"# TYPE {prefix}_{suffix} {kind}",
+                      f"{prefix}_{suffix} {report[key]}"]
+    for key, suffix, kind, description in _STAGE_METRICS:
+        samples = [(record["stage"], record[key]) for record in report["stages"] if record.get(key) is not None]
+        if not samples:
+            continue
+        lines += [f"# HELP {prefix}_{suffix} {description}", f"# TYPE {prefix}_{suffix} {kind}"]
+        for name, value in samples:
+            label = name.replace("\\", "\\\\").replace('"', '\\"')
+            lines.append(f'{prefix}_{suffix}{{stage="{label}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def _megabytes(value):
+    return f"{value / 1024 ** 2:9.1f}" if value is not None else f"{'-':>9s}"
+
+
+def print_report(report):
+    print(f"{'stage':28s} {'calls':>6s} {'wall s':>9s} {'cpu s':>9s} {'peak MB':>9s} {'read MB':>9s} "
+          f"{'write MB':>9s}")
+    for record in report["stages"]:
+        print(f"{record['stage']:28s} {record['calls']:6d} {record['wall_seconds']:9.2f} "
+              f"{record['cpu_seconds']:9.2f} {_megabytes(record['peak_rss_bytes'])} {_megabytes(record['read_bytes'])} "
+              f"{_megabytes(record['written_bytes'])}")
+        for allocation in record["largest_allocations"]:
+            print(f"{'':30s}{allocation['bytes'] / 1024 ** 2:9.1f} MB  {allocation['site']}")
+    if report.get("wall_seconds") is not None:
+        print(f"Total: {report['wall_seconds']:.2f}s wall, {report['cpu_seconds']:.2f}s CPU, "
+              f"peak RSS {_megabytes(report['max_rss_bytes']).strip()} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a run report or convert it to Prometheus text format.")
+    parser.add_argument("report", help="Run report JSON (e.g. from run_pipeline.py --report)")
+    parser.add_argument("--prometheus", action="store_true", help="Print the report in Prometheus text format")
+    parser.add_argument("--prefix", default="pipeline", help="Prometheus metric name prefix")
+    args = parser.parse_args()
+
+    report = json.loads(Path(args.report).read_text())
+    if args.prometheus:
+        print(prometheus_text(report, args.prefix), end="")
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
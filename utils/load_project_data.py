@@ -14,3 +14,11 @@ def load_project_data(path=None):
     except json.JSONDecodeError:
         print(f"Error: {path} is not valid JSON.")
         return None
+
+def asset_local_path(feature, asset_key, data_dir=None):
+    """Local path an asset of a STAC feature is (or will be) downloaded to."""
+    if data_dir is None:
+        data_dir = os.path.join(os.path.dirname(__file__), '..', 'figures', 'scenes')
+    href = feature['assets'][asset_key]['href']
+    filename = os.path.basename(href.split('?')[0])
+    return os.path.normpath(os.path.join(data_dir, feature['id'], filename))
@@ -0,0 +1,248 @@
+from pathlib import Path
+
+import numpy as np
+import tifffile
+
+# Tile shape of 1-bit mask TIFFs (multiples of 8 keep tiles byte-aligned)
+TIFF_TILE = (512, 512)
+# Rows unpacked at a time when encoding run lengths
+CHUNK_ROWS = 256
+RLE_SUFFIX = ".rle"
+# File suffix per --mask-format
+MASK_SUFFIXES = {"tiff": ".tif", "rle": RLE_SUFFIX}
+# Set bits per byte value, for NumPy without bitwise_count
+_POPCOUNT_TABLE = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+def popcount(bits):
+    """Number of set bits in a uint8 array."""
+    if hasattr(np, "bitwise_count"):
+        return int(np.bitwise_count(bits).sum(dtype=np.int64))
+    return int(_POPCOUNT_TABLE[bits].sum(dtype=np.int64))
+
+
+def _padding_mask(width):
+    """Bits of the last byte of a row that lie beyond the mask width."""
+    return np.uint8((1 << (-width % 8)) - 1)
+
+
+class PackedMask:
+    """Binary mask stored 8 pixels per byte: rows packed MSB first, as np.packbits and 1-bit TIFFs do.
+
+    Morphology works on the packed rows: a rectangular kernel is separable,
+    so erosion/dilation are ANDs/ORs of bit-shifted copies along each axis,
+    with the same constant border as cv2.morphologyEx (outside counts as set
+    for erosion, clear for dilation). Padding bits beyond the width are kept
+    clear, so popcounts need no correction.
+    """
+
+    def __init__(self, bits, width):
+        self.bits = bits
+        self.width = width
+
+    @classmethod
+    def zeros(cls, shape):
+        height, width = shape
+        return cls(np.zeros((height, -(-width // 8)), dtype=np.uint8), width)
+
+    @classmethod
+    def pack(cls, mask):
+        """Pack the non-zero pixels of a 2-D array."""
+        return cls(np.packbits(np.asarray(mask) > 0, axis=1), mask.shape[1])
+
+    @property
+    def height(self):
+        return self.bits.shape[0]
+
+    @property
+    def shape(self):
+        return (self.height, self.width)
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def unpack(self):
+        """0/1 uint8 array, as the detectors return their masks."""
+        return np.unpackbits(self.bits, axis=1, count=self.width)
+
+    def __getitem__(self, key):
+        """Unpack a [rows, cols] slice (unit steps) without unpacking the rest."""
+        rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+        c0, c1, step = cols.indices(self.width)
+        if step != 1:
+            raise ValueError("PackedMask slices need a unit step")
+        block = self.bits[rows, c0 // 8:-(-c1 // 8)]
+        offset = c0 % 8
+        return np.unpackbits(block, axis=1, count=offset + max(c1 - c0, 0))[:, offset:]
+
+    def set_window(self, row, col, mask):
+        """Write a window of a 0/1 (or 0/255) mask; col and the window width must be byte-aligned."""
+        height, width = mask.shape
+        if col % 8 or (width % 8 and col + width != self.width):
+            raise ValueError("PackedMask windows must start and end on multiples of 8 columns")
+        self.bits[row:row + height, col // 8:col // 8 + -(-width // 8)] = np.packbits(mask > 0, axis=1)
+
+    def count(self):
+        """Number of set pixels."""
+        return popcount(self.bits)
+
+    def coverage(self):
+        """Set pixels as a percentage of the mask."""
+        return self.count() / (self.height * self.width) * 100
+
+    def _new(self, bits):
+        if self.width % 8:
+            bits[:, -1] &= ~_padding_mask(self.width)
+        return PackedMask(bits, self.width)
+
+    def _check(self, other):
+        if self.shape != other.shape:
+            raise ValueError(f"Mask shapes differ: {self.shape} and {other.shape}")
+
+    def __and__(self, other):
+        self._check(other)
+        return PackedMask(self.bits & other.bits, self.width)
+
+    def __or__(self, other):
+        self._check(other)
+        return PackedMask(self.bits | other.bits, self.width)
+
+    def __xor__(self, other):
+        self._check(other)
+        return PackedMask(self.bits ^ other.bits, self.width)
+
+    def __invert__(self):
+        return self._new(~self.bits)
+
+    def _shift_cols(self, bits, shift, fill):
+        """Rows moved so that pixel j holds pixel j + shift; fill enters at the edges."""
+        pad = abs(shift) // 8 + 1
+        padded = np.empty((bits.shape[0], bits.shape[1] + 2 * pad), dtype=np.uint8)
+        padded[:, :pad] = fill
+        padded[:, pad:-pad] = bits
+        padded[:, -pad:] = fill
+        if self.width % 8:
+            # Pixels beyond the width are outside too
+            last = pad + bits.shape[1] - 1
+            padding = _padding_mask(self.width)
+            padded[:, last] = (padded[:, last] & ~padding) | (fill & padding)
+        offset, bit = divmod(shift, 8)
+        start = pad + offset
+        high = padded[:, start:start + bits.shape[1]]
+        if bit == 0:
+            return high.copy()
+        low = padded[:, start + 1:start + 1 + bits.shape[1]]
+        return (high << bit) | (low >> (8 - bit))
+
+    @staticmethod
+    def _shift_rows(bits, shift, fill):
+        """Rows moved so that row i holds row i + shift; fill enters at the edges."""
+        out = np.full_like(bits, fill)
+        if abs(shift) >= len(bits):
+            # Every row comes from outside the mask
+            return out
+        if shift >= 0:
+            out[:len(bits) - shift] = bits[shift:]
+        else:
+            out[-shift:] = bits[:shift]
+        return out
+
+    def _morph(self, kernel_size, erode):
+        fill = np.uint8(0xFF if erode else 0)
+        combine = np.bitwise_and if erode else np.bitwise_or
+        # cv2 anchors the kernel at its centre: offsets -a .. kernel_size - 1 - a
+        anchor = kernel_size // 2
+        offsets = [t for t in range(-anchor, kernel_size - anchor) if t]
+        bits = self.bits
+        result = bits.copy()
+        for t in offsets:
+            combine(result, self._shift_cols(bits, t, fill), out=result)
+        bits = result.copy()
+        for t in offsets:
+            combine(result, self._shift_rows(bits, t, fill), out=result)
+        return self._new(result)
+
+    def erode(self, kernel_size=5):
+        """Erosion with a kernel_size x kernel_size square, as cv2.erode."""
+        return self._morph(kernel_size, erode=True)
+
+    def dilate(self, kernel_size=5):
+        """Dilation with a kernel_size x kernel_size square, as cv2.dilate."""
+        return self._morph(kernel_size, erode=False)
+
+    def open(self, kernel_size=5):
+        return self.erode(kernel_size).dilate(kernel_size)
+
+    def close(self, kernel_size=5):
+        return self.dilate(kernel_size).erode(kernel_size)
+
+    def save(self, path):
+        """Write a tiled, deflate-compressed 1-bit TIFF, or run lengths for a .rle path."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.suffix.lower() == RLE_SUFFIX:
+            runs = self.run_lengths()
+            with open(path, "wb") as f:
+                np.savez_compressed(f, shape=np.array(self.shape, dtype=np.int64), runs=runs)
+            return path
+        tile_h, tile_w = TIFF_TILE
+
+        def tiles():
+            for row in range(0, self.height, tile_h):
+                for col in range(0, self.width, tile_w):
+                    tile = np.zeros(TIFF_TILE, dtype=bool)
+                    block = self[row:row + tile_h, col:col + tile_w]
+                    tile[:block.shape[0], :block.shape[1]] = block
+                    yield tile
+        tifffile.imwrite(path, tiles(), shape=self.shape, dtype=bool, tile=TIFF_TILE,
+                         compression="zlib", photometric="minisblack")
+        return path
+
+    def run_lengths(self):
+        """Alternating run lengths of the row-major pixels, starting with a (possibly empty) run of 0s."""
+        changes = []
+        previous = 0
+        for row in range(0, self.height, CHUNK_ROWS):
+            flat = self[row:row + CHUNK_ROWS].ravel()
+            start = row * self.width
+            if flat[0] != previous:
+                changes.append(np.array([start], dtype=np.int64))
+            changes.append(np.flatnonzero(flat[1:] != flat[:-1]).astype(np.int64) + start + 1)
+            previous = flat[-1]
+        bounds = np.concatenate([[0]] + changes + [[self.height * self.width]])
+        return np.diff(bounds).astype(np.uint32 if self.height * self.width < 2 ** 32 else np.uint64)
+
+    @classmethod
+    def from_run_lengths(cls, runs, shape):
+        values = np.arange(len(runs), dtype=np.uint8) & 1
+        return cls.pack(np.repeat(values, runs).reshape(shape))
+
+    @classmethod
+    def load(cls, path):
+        """Read a mask written by save (or any single-band TIFF/PNG mask, non-zero = set)."""
+        path = Path(path)
+        if path.suffix.lower() == RLE_SUFFIX:
+            with np.load(path) as data:
+                return cls.from_run_lengths(data["runs"], tuple(data["shape"]))
+        from utils.cog_reader import COGReader
+        with COGReader(str(path)) as reader:
+            mask = cls.zeros((reader.height, reader.width))
+            for row in range(0, reader.height, CHUNK_ROWS):
+                block = reader.read_window(row, 0, CHUNK_ROWS, reader.width)
+                if block.ndim == 3:
+                    block = block[:, :, 0]
+                mask.set_window(row, 0, block)
+        return mask
+
+
+def count_pixels(mask):
+    """Set pixels of a PackedMask or a plain array."""
+    return mask.count() if isinstance(mask, PackedMask) else int(np.count_nonzero(mask))
+
+
+def save_mask(mask, path):
+    """Write a mask as 1-bit TIFF or run lengths (by suffix), packing plain arrays first."""
+    if not isinstance(mask, PackedMask):
+        mask = PackedMask.pack(mask)
+    return mask.save(path)
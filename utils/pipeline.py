@@ -0,0 +1,107 @@
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from utils.instrumentation import stage as instrumented
+
+# What a stage function receives: the results of its dependencies by name,
+# the subset of its outputs that was requested, and whether any downstream
+# stage consumes its result
+StageRun = namedtuple("StageRun", ["inputs", "outputs", "consumed"])
+Stage = namedtuple("Stage", ["name", "func", "deps", "outputs"])
+
+
+class Pipeline:
+    """A DAG of stages run in one process with results handed over in memory.
+
+    Stages run on a thread pool as soon as their dependencies are done, so
+    independent branches overlap (the heavy work is in NumPy/OpenCV, which
+    release the GIL). A result is dropped as soon as its last consumer has
+    finished, and only stages needed for the requested outputs run.
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name, func, deps=(), outputs=()):
+        """Register func(StageRun) as a stage; outputs are the files it can write."""
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dep}")
+        self.stages[name] = Stage(name, func, tuple(deps), tuple(outputs))
+        return func
+
+    def outputs(self):
+        """{output name: stage name} over all stages."""
+        return {output: stage.name for stage in self.stages.values() for output in stage.outputs}
+
+    def plan(self, targets):
+        """Stages needed for the target outputs (or stage names), in dependency order."""
+        owners = self.outputs()
+        needed = set()
+
+        def visit(name):
+            if name in needed:
+                return
+            for dep in self.stages[name].deps:
+                visit(dep)
+            needed.add(name)
+
+        for target in targets:
+            if target in owners:
+                visit(owners[target])
+            elif target in self.stages:
+                visit(target)
+            else:
+                raise ValueError(f"Unknown output or stage: {target}")
+        return [name for name in self.stages if name in needed]
+
+    def run(self, targets=None, workers=None):
+        """Run the stages needed for targets (default: every output); returns {stage: seconds}."""
+        targets = list(self.outputs()) if targets is None else list(targets)
+        order = self.plan(targets)
+        requested = set(targets)
+        consumers = {name: [other for other in order if name in self.stages[other].deps] for name in order}
+        remaining = {name: len(consumers[name]) for name in order}
+        results, timings = {}, {}
+        waiting = list(order)
+        running = {}
+        error = None
+
+        def execute(stage, run):
+            start = time.time()
+            with instrumented(stage.name):
+                result = stage.func(run)
+            return result, time.time() - start
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while waiting or running:
+                if error is None:
+                    for name in [n for n in waiting if all(dep in results for dep in self.stages[n].deps)]:
+                        stage = self.stages[name]
+                        outputs = [o for o in stage.outputs if o in requested or name in requested]
+                        run = StageRun({dep: results[dep] for dep in stage.deps}, outputs, bool(consumers[name]))
+                        print(f"[INFO] Stage {name} started")
+                        running[pool.submit(execute, stage, run)] = name
+                        waiting.remove(name)
+                elif not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        result, timings[name] = future.result()
+                    except Exception as e:
+                        print(f"[ERROR] Stage {name} failed: {e}")
+                        error = error or e
+                        continue
+                    print(f"[INFO] Stage {name} done in {timings[name]:.2f}s")
+                    results[name] = result if consumers[name] else None
+                    # Release inputs nobody else is waiting for
+                    for dep in self.stages[name].deps:
+                        remaining[dep] -= 1
+                        if remaining[dep] == 0:
+                            results[dep] = None
+        if error is not None:
+            raise error
+        return timings
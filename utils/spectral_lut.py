@@ -0,0 +1,227 @@
+import threading
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+# All 2**24 RGB colours are evaluated in blocks of this many red values
+_BUILD_BLOCK = 16
+# Images are gathered in row chunks so the index temporaries stay small
+CHUNK_ROWS = 256
+# Parameterised tables (16 MB each for the RGB masks) kept per function: enough for
+# the configured parameters plus a few overrides without holding every table ever built
+TABLE_CACHE_SIZE = 4
+_build_lock = threading.Lock()
+
+
+def supports_lut(image):
+    """True for 8-bit RGB images, whose indices are functions of the byte values."""
+    return image.dtype == np.uint8 and image.ndim == 3 and image.shape[2] == 3
+
+
+def color_index(image, out=None):
+    """Pack the RGB bytes of every pixel into one table index (r << 16 | g << 8 | b).
+
+    Indices are np.intp so np.take gathers without converting them first.
+    """
+    if out is None:
+        out = np.empty(image.shape[:2], dtype=np.intp)
+    np.copyto(out, image[:, :, 0], casting="unsafe")
+    out <<= 8
+    np.bitwise_or(out, image[:, :, 1], out=out)
+    out <<= 8
+    np.bitwise_or(out, image[:, :, 2], out=out)
+    return out
+
+
+def gather(lut, index, out=None, dtype=None):
+    """Evaluate a lookup table at every index into a (preallocated) output."""
+    if out is None:
+        out = np.empty(index.shape, dtype=dtype or lut.dtype)
+    np.take(lut, index, out=out)
+    return out
+
+
+def _by_rows(func, image, out, dtype):
+    """Run func(image_rows, out_rows) over row chunks of the image into out."""
+    if out is None:
+        out = np.empty(image.shape[:2], dtype=dtype)
+    for row in range(0, image.shape[0], CHUNK_ROWS):
+        func(image[row:row + CHUNK_ROWS], out[row:row + CHUNK_ROWS])
+    return out
+
+
+def gather_colors(lut, image, out=None):
+    """Evaluate a 2**24-entry colour table for every pixel of an 8-bit RGB image."""
+    index = np.empty((min(CHUNK_ROWS, image.shape[0]), image.shape[1]), dtype=np.intp)
+
+    def chunk(rows, out_rows):
+        gather(lut, color_index(rows, index[:len(rows)]), out_rows)
+    return _by_rows(chunk, image, out, lut.dtype)
+
+
+def _all_colors(red_start, red_stop):
+    """The RGB image of all colours with red in [red_start, red_stop)."""
+    red, green, blue = np.meshgrid(
+        np.arange(red_start, red_stop, dtype=np.uint8),
+        np.arange(256, dtype=np.uint8),
+        np.arange(256, dtype=np.uint8),
+        indexing="ij",
+    )
+    return np.stack([red.ravel(), green.ravel(), blue.ravel()], axis=-1)[None]
+
+
+def _build_color_lut(func):
+    """Tabulate func(rgb image) -> per-pixel values over all 2**24 colours."""
+    lut = None
+    for red in range(0, 256, _BUILD_BLOCK):
+        values = func(_all_colors(red, red + _BUILD_BLOCK))[0]
+        if lut is None:
+            lut = np.empty(1 << 24, dtype=values.dtype)
+        lut[red << 16:(red + _BUILD_BLOCK) << 16] = values
+    return lut
+
+
+# --- Drought -----------------------------------------------------------------
+
+@lru_cache(maxsize=None)
+def ndvi_table():
+    """Pseudo-NDVI of every (red, green) pair, computed exactly like the float pipeline."""
+    red = np.arange(256, dtype=float)[:, None]
+    green = np.arange(256, dtype=float)[None, :]
+    epsilon = 1e-10
+    pseudo_ndvi = (green - red) / (green + red + epsilon)
+    return (pseudo_ndvi + 1) / 2
+
+
+@lru_cache(maxsize=None)
+def brown_lut():
+    """Brown/yellow HSV test of every RGB colour (uint8 0/1, indexed by color_index)."""
+    def brown(image):
+        img_hsv = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
+        hue = img_hsv[:, :, 0].astype(float) / 179.0
+        saturation = img_hsv[:, :, 1].astype(float) / 255.0
+        value = img_hsv[:, :, 2].astype(float) / 255.0
+        return ((hue >= 0.05) & (hue <= 0.15) & (saturation >= 0.2) & (value >= 0.4)).view(np.uint8)
+    with _build_lock:
+        return _build_color_lut(brown)
+
+
+@lru_cache(maxsize=TABLE_CACHE_SIZE)
+def severity_table(ndvi_weight, color_weight):
+    """Drought severity indexed by [brown, red, green] (float64, as the float pipeline)."""
+    term = (1 - ndvi_table()) * ndvi_weight
+    return np.stack([term + 0.0 * color_weight, term + 1.0 * color_weight])
+
+
+@lru_cache(maxsize=TABLE_CACHE_SIZE)
+def drought_mask_lut(ndvi_weight, color_weight, threshold):
+    """Thresholded drought severity of every RGB colour (uint8 0/1)."""
+    above = (severity_table(ndvi_weight, color_weight) > threshold).view(np.uint8)
+    brown = brown_lut().reshape(256, 256, 256)
+    red = np.arange(256)[:, None, None]
+    green = np.arange(256)[None, :, None]
+    return above[brown, red, green].ravel()
+
+
+@lru_cache(maxsize=TABLE_CACHE_SIZE)
+def drought_viz_tables(ndvi_weight, color_weight):
+    """Red and green of the drought visualisation, indexed by [brown, red, green]."""
+    severity = severity_table(ndvi_weight, color_weight)
+    viz_red = np.clip(150 + 105 * severity, 0, 255).astype(np.uint8)
+    viz_green = np.clip(150 - 150 * severity, 0, 255).astype(np.uint8)
+    return viz_red, viz_green
+
+
+def _drought_keys(params):
+    return float(params["ndvi_weight"]), float(params["color_weight"])
+
+
+def _brown_pair_index(image):
+    """Index into the [brown, red, green] tables for every pixel."""
+    index = color_index(image)
+    brown = gather(brown_lut(), index, dtype=np.uint8)
+    index >>= 8  # r << 8 | g
+    np.bitwise_or(index, brown.astype(np.intp) << 16, out=index)
+    return index
+
+
+def drought_severity(image, params, out=None):
+    """Drought severity of an 8-bit RGB image as float32, by table gather."""
+    table = severity_table(*_drought_keys(params)).astype(np.float32).ravel()
+    return _by_rows(lambda rows, out_rows: gather(table, _brown_pair_index(rows), out_rows),
+                    image, out, np.float32)
+
+
+def drought_raw_mask(image, params, out=None):
+    """severity > drought_threshold (uint8 0/1) by a single table gather."""
+    lut = drought_mask_lut(*_drought_keys(params), float(params["drought_threshold"]))
+    return gather_colors(lut, image, out)
+
+
+def drought_visualization(image, params):
+    """The yellow-to-brown severity colouring of detect_drought, by table gather."""
+    viz_red, viz_green = drought_viz_tables(*_drought_keys(params))
+    drought_viz = np.zeros_like(image)
+    for row in range(0, image.shape[0], CHUNK_ROWS):
+        index = _brown_pair_index(image[row:row + CHUNK_ROWS])
+        drought_viz[row:row + CHUNK_ROWS, :, 0] = gather(viz_red.ravel(), index)
+        drought_viz[row:row + CHUNK_ROWS, :, 1] = gather(viz_green.ravel(), index)
+    return drought_viz
+
+
+# --- Fire --------------------------------------------------------------------
+
+@lru_cache(maxsize=None)
+def red_ratio_table():
+    """2 * red / (green + blue + 1) in float32, indexed by [red, green + blue]."""
+    red = np.arange(256, dtype=np.float32)[:, None]
+    green_blue = np.arange(511, dtype=np.float32)[None, :]
+    return 2 * (red / (green_blue + 1))
+
+
+def _fire_intensity_float(image):
+    """The float32 fire intensity of calculate_fire_intensity, used to build the tables."""
+    img_float = image.astype(np.float32)
+    red_channel = img_float[:, :, 0]
+    green_channel = img_float[:, :, 1]
+    blue_channel = img_float[:, :, 2]
+    red_ratio = red_channel / (green_channel + blue_channel + 1)
+    intensity = (2 * red_ratio + (red_channel - green_channel) + (red_channel - blue_channel)) / 4
+    return np.clip(intensity, 0, 1)
+
+
+@lru_cache(maxsize=TABLE_CACHE_SIZE)
+def fire_mask_lut(threshold):
+    """Thresholded fire intensity of every RGB colour (uint8 0/1)."""
+    with _build_lock:
+        return _build_color_lut(lambda image: (_fire_intensity_float(image) > threshold).view(np.uint8))
+
+
+def fire_intensity(image, out=None):
+    """
+    Fire intensity of an 8-bit RGB image into a float32 output. The red ratio
+    comes from a (red, green + blue) table; the remaining terms are summed in
+    place in the same order as calculate_fire_intensity, so the result is
+    bit-identical.
+    """
+    table = red_ratio_table().ravel()
+
+    def chunk(rows, out_rows):
+        red = rows[:, :, 0]
+        index = np.multiply(red, 511, dtype=np.intp)
+        np.add(index, rows[:, :, 1], out=index)
+        np.add(index, rows[:, :, 2], out=index)
+        gather(table, index, out_rows)
+        difference = np.subtract(red, rows[:, :, 1], dtype=np.float32)
+        out_rows += difference
+        np.subtract(red, rows[:, :, 2], out=difference, dtype=np.float32)
+        out_rows += difference
+        out_rows /= 4
+        np.clip(out_rows, 0, 1, out=out_rows)
+    return _by_rows(chunk, image, out, np.float32)
+
+
+def fire_raw_mask(image, threshold, out=None):
+    """intensity > threshold (uint8 0/1) by a single table gather."""
+    return gather_colors(fire_mask_lut(float(threshold)), image, out)
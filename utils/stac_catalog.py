@@ -0,0 +1,311 @@
+import argparse
+import json
+import os
+import sqlite3
+
+from utils.load_project_data import asset_local_path
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+DEFAULT_JSON = os.path.normpath(os.path.join(BASE_DIR, 'project_data.json'))
+DEFAULT_DB = os.path.normpath(os.path.join(BASE_DIR, 'project_data.sqlite'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS items (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT UNIQUE NOT NULL,
+    collection TEXT,
+    datetime TEXT,
+    platform TEXT,
+    level TEXT,
+    gsd REAL,
+    acquisition TEXT,
+    feature TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS assets (
+    item_rowid INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    href TEXT NOT NULL,
+    type TEXT,
+    PRIMARY KEY (item_rowid, key)
+) WITHOUT ROWID;
+CREATE VIRTUAL TABLE IF NOT EXISTS items_rtree USING rtree(rowid, min_x, max_x, min_y, max_y);
+CREATE INDEX IF NOT EXISTS items_datetime ON items (datetime);
+CREATE INDEX IF NOT EXISTS items_platform ON items (platform, datetime);
+CREATE INDEX IF NOT EXISTS items_level ON items (level);
+CREATE INDEX IF NOT EXISTS items_gsd ON items (gsd);
+CREATE INDEX IF NOT EXISTS items_acquisition ON items (acquisition, level);
+"""
+
+ITEM_COLUMNS = ["id", "collection", "datetime", "platform", "level", "gsd"]
+# Bumped when indexing changes, so catalogs built by older code are rebuilt
+INDEX_VERSION = 2
+
+
+def feature_bbox(feature):
+    """Return (min_x, min_y, max_x, max_y) from the feature bbox or its geometry."""
+    if feature.get("bbox"):
+        bbox = feature["bbox"]
+        # 2D bboxes are [min_x, min_y, max_x, max_y], 3D ones [min_x, min_y, min_z, max_x, max_y, max_z]
+        n = len(bbox) // 2
+        return bbox[0], bbox[1], bbox[n], bbox[n + 1]
+    coords = []
+    stack = [feature["geometry"]["coordinates"]]
+    while stack:
+        item = stack.pop()
+        if item and isinstance(item[0], (int, float)):
+            coords.append(item)
+        else:
+            stack.extend(item)
+    xs = [c[0] for c in coords]
+    ys = [c[1] for c in coords]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def acquisition_key(feature):
+    """Key shared by the L1A/L1B/L1C/... products of the same acquisition."""
+    props = feature.get("properties", {})
+    session = props.get("opencosmos:session_id")
+    start = props.get("start_datetime") or props.get("datetime")
+    if session is not None and start:
+        return f"{props.get('platform')}:{session}:{start}"
+    level = props.get("processing:level")
+    return feature["id"].replace(f"_{level}_", "_") if level else feature["id"]
+
+
+def _end_of_day(value):
+    """Make date-only upper bounds inclusive of the whole day."""
+    return value + "T23:59:59Z" if value and "T" not in value else value
+
+
+class STACCatalog:
+    """Local SQLite index of STAC features with an R-tree over their footprints."""
+
+    def __init__(self, db_path=DEFAULT_DB):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_features(self, features):
+        """Insert or replace STAC features (and their assets) in the catalog."""
+        with self.conn:
+            for feature in features:
+                props = feature.get("properties", {})
+                existing = self.conn.execute("SELECT rowid FROM items WHERE id = ?", (feature["id"],)).fetchone()
+                if existing is not None:
+                    self._delete(existing["rowid"])
+                cursor = self.conn.execute(
+                    "INSERT INTO items (id, collection, datetime, platform, level, gsd, acquisition, feature) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        feature["id"],
+                        feature.get("collection"),
+                        props.get("datetime"),
+                        props.get("platform"),
+                        props.get("processing:level"),
+                        props.get("gsd"),
+                        acquisition_key(feature),
+                        json.dumps(feature, separators=(",", ":")),
+                    ),
+                )
+                rowid = cursor.lastrowid
+                min_x, min_y, max_x, max_y = feature_bbox(feature)
+                self.conn.execute(
+                    "INSERT INTO items_rtree (rowid, min_x, max_x, min_y, max_y) VALUES (?, ?, ?, ?, ?)",
+                    (rowid, min_x, max_x, min_y, max_y),
+                )
+                self.conn.executemany(
+                    "INSERT INTO assets (item_rowid, key, href, type) VALUES (?, ?, ?, ?)",
+                    [(rowid, key, asset["href"], asset.get("type")) for key, asset in feature.get("assets", {}).items()],
+                )
+
+    def _delete(self, rowid):
+        self.conn.execute("DELETE FROM items WHERE rowid = ?", (rowid,))
+        self.conn.execute("DELETE FROM items_rtree WHERE rowid = ?", (rowid,))
+        self.conn.execute("DELETE FROM assets WHERE item_rowid = ?", (rowid,))
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM items")
+            self.conn.execute("DELETE FROM items_rtree")
+            self.conn.execute("DELETE FROM assets")
+
+    def get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def set_meta(self, key, value):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+    def search(self, bbox=None, start=None, end=None, platform=None, level=None, max_gsd=None,
+               dedup=False, limit=None):
+        """Find items by footprint bbox (min_x, min_y, max_x, max_y), time range and properties.
+
+        With dedup=True only the highest processing level of each acquisition is returned.
+        """
+        clauses, args = [], []
+        source = "items"
+        if bbox is not None:
+            source = "items JOIN items_rtree r ON r.rowid = items.rowid"
+            clauses.append("r.min_x <= ? AND r.max_x >= ? AND r.min_y <= ? AND r.max_y >= ?")
+            args.extend([bbox[2], bbox[0], bbox[3], bbox[1]])
+        if start:
+            clauses.append("datetime >= ?")
+            args.append(start)
+        if end:
+            clauses.append("datetime <= ?")
+            args.append(_end_of_day(end))
+        if platform:
+            clauses.append("platform = ?")
+            args.append(platform)
+        if level:
+            clauses.append("level = ?")
+            args.append(level)
+        if max_gsd is not None:
+            clauses.append("gsd <= ?")
+            args.append(max_gsd)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        columns = ", ".join(f"items.{c}" for c in ITEM_COLUMNS)
+
+        if dedup:
+            query = (
+                f"SELECT {', '.join(ITEM_COLUMNS)} FROM ("
+                f"SELECT {columns}, ROW_NUMBER() OVER "
+                f"(PARTITION BY items.acquisition ORDER BY items.level DESC) AS rank "
+                f"FROM {source} {where}) WHERE rank = 1 ORDER BY datetime"
+            )
+        else:
+            query = f"SELECT {columns} FROM {source} {where} ORDER BY items.datetime"
+        if limit:
+            query += " LIMIT ?"
+            args.append(limit)
+        return [dict(row) for row in self.conn.execute(query, args)]
+
+    def get_feature(self, item_id):
+        """Return the full STAC feature for an item id (or None)."""
+        row = self.conn.execute("SELECT feature FROM items WHERE id = ?", (item_id,)).fetchone()
+        return json.loads(row["feature"]) if row else None
+
+    def find_by_source(self, source, asset_key="TCI", data_dir=None):
+        """Return the feature whose asset_key asset is source (a path or URL), or None.
+
+        A source matches an asset by its href or by its downloaded copy
+        (asset_local_path). Files placed anywhere else, like
+        figures/TCI_COG.tiff, match nothing: every TCI asset has the same
+        file name, so the name alone cannot tell the scenes apart.
+        """
+        source = str(source)
+        is_file = os.path.exists(source)
+        rows = self.conn.execute(
+            "SELECT i.id, a.href FROM assets a JOIN items i ON i.rowid = a.item_rowid WHERE a.key = ?",
+            (asset_key,),
+        )
+        for row in rows:
+            if source.split("?")[0] == row["href"].split("?")[0]:
+                return self.get_feature(row["id"])
+            stub = {"id": row["id"], "assets": {asset_key: {"href": row["href"]}}}
+            local = asset_local_path(stub, asset_key, data_dir)
+            if is_file and os.path.exists(local) and os.path.samefile(source, local):
+                return self.get_feature(row["id"])
+        return None
+
+    def asset_href(self, item_id, asset_key):
+        """Resolve the href of one asset of an item (or None)."""
+        row = self.conn.execute(
+            "SELECT a.href FROM assets a JOIN items i ON i.rowid = a.item_rowid WHERE i.id = ? AND a.key = ?",
+            (item_id, asset_key),
+        ).fetchone()
+        return row["href"] if row else None
+
+    def assets(self, item_id):
+        """Return {asset key: href} for an item."""
+        rows = self.conn.execute(
+            "SELECT a.key, a.href FROM assets a JOIN items i ON i.rowid = a.item_rowid WHERE i.id = ?",
+            (item_id,),
+        )
+        return {row["key"]: row["href"] for row in rows}
+
+
+def _source_key(json_path):
+    stat = os.stat(json_path)
+    return f"{os.path.abspath(json_path)}:{stat.st_size}:{stat.st_mtime_ns}:v{INDEX_VERSION}"
+
+
+def build_catalog(json_path=DEFAULT_JSON, db_path=DEFAULT_DB):
+    """(Re)build the catalog from a saved STAC search response."""
+    with open(json_path, 'r') as f:
+        project_data = json.load(f)
+    catalog = STACCatalog(db_path)
+    catalog.clear()
+    catalog.add_features(project_data.get("features", []))
+    catalog.set_meta("source", _source_key(json_path))
+    return catalog
+
+
+def open_catalog(db_path=DEFAULT_DB, json_path=DEFAULT_JSON):
+    """Open the catalog, rebuilding it only when project_data.json has changed."""
+    catalog = STACCatalog(db_path)
+    if not os.path.exists(json_path):
+        return catalog
+    if catalog.get_meta("source") != _source_key(json_path):
+        catalog.close()
+        catalog = build_catalog(json_path, db_path)
+    return catalog
+
+
+def resolve_feature(feature_id=None, source=None, asset_key="TCI"):
+    """The feature with feature_id, else the one whose asset source is (see find_by_source); None if neither."""
+    with open_catalog() as catalog:
+        if feature_id:
+            return catalog.get_feature(feature_id)
+        if source is not None:
+            return catalog.find_by_source(source, asset_key)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the local STAC catalog built from project_data.json.")
+    parser.add_argument("--db", default=DEFAULT_DB)
+    parser.add_argument("--json", default=DEFAULT_JSON)
+    parser.add_argument("--rebuild", action="store_true", help="Force a rebuild from the JSON file")
+    parser.add_argument("--bbox", nargs=4, type=float, metavar=("MIN_X", "MIN_Y", "MAX_X", "MAX_Y"))
+    parser.add_argument("--start", help="Start datetime (ISO 8601)")
+    parser.add_argument("--end", help="End datetime (ISO 8601, date-only is inclusive)")
+    parser.add_argument("--platform")
+    parser.add_argument("--level", help="Processing level, e.g. L1B")
+    parser.add_argument("--max-gsd", type=float)
+    parser.add_argument("--dedup", action="store_true", help="Keep only the highest level per acquisition")
+    parser.add_argument("--asset", help="Print the href of this asset instead of item ids")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        catalog = build_catalog(args.json, args.db)
+    else:
+        catalog = open_catalog(args.db, args.json)
+    with catalog:
+        items = catalog.search(args.bbox, args.start, args.end, args.platform, args.level,
+                               args.max_gsd, dedup=args.dedup)
+        for item in items:
+            if args.asset:
+                print(catalog.asset_href(item["id"], args.asset))
+            else:
+                print(f"{item['datetime']}  {item['level']}  {item['gsd']}m  {item['id']}")
+        print(f"[INFO] {len(items)} of {catalog.count()} items matched")
+
+
+if __name__ == "__main__":
+    main()
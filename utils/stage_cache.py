@@ -0,0 +1,332 @@
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+DEFAULT_DIR = Path(__file__).resolve().parent.parent / "figures" / "cache"
+DEFAULT_MAX_BYTES = 8 * 1024 ** 3
+# Stage cache settings shared by the module configs, which override only what differs:
+# outputs keyed by input bytes, code and parameters, LRU-evicted by size
+CACHE_DEFAULTS = {
+    "enabled": True,
+    "directory": DEFAULT_DIR,
+    "max_bytes": DEFAULT_MAX_BYTES,
+}
+DIGEST_SIZE = 20
+_READ_BLOCK = 1 << 22
+
+
+def _hasher():
+    return hashlib.blake2b(digest_size=DIGEST_SIZE)
+
+
+def code_version(*objects):
+    """Hash of the source of the functions/modules a stage runs (bytecode when no source).
+
+    Strings (e.g. other code versions) are hashed as they are.
+    """
+    h = _hasher()
+    for obj in objects:
+        if isinstance(obj, str):
+            h.update(obj.encode())
+            continue
+        try:
+            h.update(inspect.getsource(obj).encode())
+        except (OSError, TypeError):
+            h.update(obj.__code__.co_code)
+    return h.hexdigest()
+
+
+def array_digest(array):
+    """Hash of an array's dtype, shape and bytes."""
+    h = _hasher()
+    array = np.asarray(array)
+    h.update(f"{array.dtype.str}{array.shape}".encode())
+    if array.ndim:
+        # Row blocks keep the contiguous copy of (possibly memory-mapped) inputs small
+        rows = max(1, _READ_BLOCK // max(array[0].nbytes, 1))
+        for row in range(0, array.shape[0], rows):
+            h.update(np.ascontiguousarray(array[row:row + rows]).data)
+    else:
+        h.update(array.tobytes())
+    return h.hexdigest()
+
+
+def _entry_size(path):
+    if path.is_dir():
+        return sum(f.stat().st_size for f in path.iterdir())
+    return path.stat().st_size
+
+
+class StageCache:
+    """Content-addressed on-disk cache of pipeline stage outputs.
+
+    A stage's key hashes its inputs (file bytes, arrays or the keys of the
+    stages it consumes), the source of its code and its slice of the config,
+    so changing one parameter only recomputes the stages downstream of it.
+    Entries are .npy files (a directory of them for tuple results) or copies
+    of output files; they are memory-mapped on load and evicted least
+    recently used first once the cache outgrows max_bytes.
+    """
+
+    def __init__(self, directory=DEFAULT_DIR, max_bytes=DEFAULT_MAX_BYTES, enabled=True):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._digests = None
+        if enabled:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    # --- Keys ------------------------------------------------------------
+
+    def _digest_memo(self):
+        if self._digests is None:
+            try:
+                with open(self.directory / "digests.json") as f:
+                    self._digests = json.load(f)
+            except (OSError, ValueError):
+                self._digests = {}
+        return self._digests
+
+    def file_key(self, path):
+        """Hash of a file's bytes, remembered per (path, size, mtime) across runs."""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        memo_key = f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+        memo = self._digest_memo() if self.enabled else {}
+        if memo_key in memo:
+            return memo[memo_key]
+        h = _hasher()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(_READ_BLOCK), b""):
+                h.update(block)
+        digest = h.hexdigest()
+        if self.enabled:
+            with self._lock:
+                memo = {k: v for k, v in memo.items() if not k.startswith(f"{path}:")}
+                memo[memo_key] = digest
+                self._digests = memo
+                self._write_json("digests.json", memo)
+        return digest
+
+    def key(self, stage, inputs=(), params=None, version=None):
+        """Key of a stage run; inputs are upstream keys (str), paths or arrays (None when disabled)."""
+        if not self.enabled:
+            return None
+        h = _hasher()
+        h.update(stage.encode())
+        h.update(str(version).encode())
+        h.update(json.dumps(params, sort_keys=True, default=str).encode())
+        for item in inputs:
+            if isinstance(item, str):
+                h.update(item.encode())
+            elif isinstance(item, os.PathLike):
+                h.update(self.file_key(item).encode())
+            else:
+                h.update(array_digest(item).encode())
+        return h.hexdigest()
+
+    # --- Entries ---------------------------------------------------------
+
+    def _path(self, stage, key, suffix=""):
+        return self.directory / stage / f"{key}{suffix}"
+
+    def _count(self, stage, name, amount=1):
+        with self._lock:
+            counts = self.stats.setdefault(stage, {"hits": 0, "misses": 0, "stores": 0, "evictions": 0})
+            counts[name] += amount
+
+    def _touch(self, path):
+        # Access order is kept in the mtime (atime is often not updated)
+        now = time.time()
+        os.utime(path, (now, now))
+
+    def get(self, stage, key):
+        """Cached result of a stage run, or None (counted as a hit or miss)."""
+        path = self._path(stage, key)
+        try:
+            if path.is_dir():
+                count = len(list(path.glob("*.npy")))
+                result = tuple(self._load(path / f"{i}.npy") for i in range(count))
+            else:
+                result = self._load(path.with_suffix(".npy"))
+                path = path.with_suffix(".npy")
+        except (OSError, ValueError):
+            self._count(stage, "misses")
+            return None
+        self._touch(path)
+        self._count(stage, "hits")
+        return result
+
+    def _load(self, path):
+        array = np.load(path, mmap_mode="r")
+        return array[()] if array.ndim == 0 else array
+
+    def put(self, stage, key, result):
+        """Store an array (or a tuple of arrays/scalars) for a stage run."""
+        path = self._path(stage, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(result, tuple):
+            temp = Path(tempfile.mkdtemp(dir=path.parent))
+            for i, item in enumerate(result):
+                np.save(temp / f"{i}.npy", np.asarray(item))
+            try:
+                os.replace(temp, path)
+            except OSError:
+                shutil.rmtree(temp, ignore_errors=True)  # stored concurrently by another run
+        else:
+            fd, temp = tempfile.mkstemp(dir=path.parent, suffix=".npy")
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, np.asarray(result))
+            os.replace(temp, path.with_suffix(".npy"))
+        self._count(stage, "stores")
+        self.evict()
+        return result
+
+    def run(self, stage, func, inputs=(), params=None, version=None):
+        """Return (result, key): the cached result or func() stored under the key.
+
+        Cached arrays come back as read-only memory maps.
+        """
+        if not self.enabled:
+            return func(), None
+        key = self.key(stage, inputs, params, version)
+        result = self.get(stage, key)
+        if result is None:
+            result = self.put(stage, key, func())
+        return result, key
+
+    def run_file(self, stage, func, output_path, inputs=(), params=None, version=None):
+        """Like run for stages that write a file: func(output_path) runs only on a miss,
+        a hit copies the cached file to output_path. Returns the key."""
+        if not self.enabled:
+            func(output_path)
+            return None
+        key = self.key(stage, inputs, params, version)
+        path = self._path(stage, key, Path(output_path).suffix)
+        if path.is_file():
+            self._touch(path)
+            self._count(stage, "hits")
+            shutil.copyfile(path, output_path)
+            return key
+        self._count(stage, "misses")
+        func(output_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=path.parent, suffix=path.suffix)
+        os.close(fd)
+        shutil.copyfile(output_path, temp)
+        os.replace(temp, path)
+        self._count(stage, "stores")
+        self.evict()
+        return key
+
+    def entries(self):
+        """[(last use, size, stage, path)] of every entry, oldest first."""
+        entries = []
+        for stage_dir in self.directory.iterdir() if self.directory.exists() else []:
+            if not stage_dir.is_dir():
+                continue
+            for path in stage_dir.iterdir():
+                if path.name.startswith("tmp"):
+                    continue
+                try:
+                    entries.append((path.stat().st_mtime, _entry_size(path), stage_dir.name, path))
+                except OSError:
+                    continue
+        return sorted(entries)
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes."""
+        entries = self.entries()
+        total = sum(entry[1] for entry in entries)
+        for _, size, stage, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink(missing_ok=True)
+            total -= size
+            self._count(stage, "evictions")
+        return total
+
+    def clear(self):
+        for _, _, _, path in self.entries():
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink(missing_ok=True)
+
+    # --- Statistics ------------------------------------------------------
+
+    def _write_json(self, name, data):
+        fd, temp = tempfile.mkstemp(dir=self.directory, suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=4)
+        os.replace(temp, self.directory / name)
+
+    def load_stats(self):
+        """Hit/miss counters accumulated over all runs, per stage."""
+        try:
+            with open(self.directory / "stats.json") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def report(self):
+        """Print this run's per-stage hits/misses and add them to the stored totals."""
+        if not self.enabled:
+            return
+        for stage, counts in sorted(self.stats.items()):
+            print(f"[INFO] cache {stage}: {counts['hits']} hit(s), {counts['misses']} miss(es)")
+        with self._lock:
+            totals = self.load_stats()
+            for stage, counts in self.stats.items():
+                stage_totals = totals.setdefault(stage, {})
+                for name, value in counts.items():
+                    stage_totals[name] = stage_totals.get(name, 0) + value
+            self._write_json("stats.json", totals)
+            self.stats = {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear the pipeline stage cache.")
+    parser.add_argument("--directory", default=str(DEFAULT_DIR))
+    parser.add_argument("--max-bytes", type=int, help="Evict down to this size")
+    parser.add_argument("--clear", action="store_true", help="Remove every cached stage output")
+    args = parser.parse_args()
+
+    cache = StageCache(args.directory)
+    if args.clear:
+        cache.clear()
+    if args.max_bytes is not None:
+        cache.max_bytes = args.max_bytes
+        cache.evict()
+
+    sizes = {}
+    for _, size, stage, _ in cache.entries():
+        count, total = sizes.get(stage, (0, 0))
+        sizes[stage] = (count + 1, total + size)
+    stats = cache.load_stats()
+    for stage in sorted(set(sizes) | set(stats)):
+        count, total = sizes.get(stage, (0, 0))
+        counts = stats.get(stage, {})
+        hits, misses = counts.get("hits", 0), counts.get("misses", 0)
+        ratio = hits / (hits + misses) if hits + misses else 0.0
+        print(f"{stage}: {count} entries, {total / 1024 ** 2:.1f} MiB, "
+              f"{hits} hits / {misses} misses ({ratio:.0%}), {counts.get('evictions', 0)} evictions")
+    print(f"Total: {sum(total for _, total in sizes.values()) / 1024 ** 2:.1f} MiB in {cache.directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+import argparse
+import email.utils
+import json
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from utils.cog_reader import COGReader
+from utils.georef import apply_matrix, ground_resolution, lonlat_to_pixel_matrix, pixel_to_lonlat_matrix
+from utils.stac_catalog import resolve_feature
+
+TILE_SIZE = 256
+FIGURES_DIR = Path(__file__).resolve().parent.parent / "figures"
+TILES_DIR = FIGURES_DIR / "tiles"
+
+# name: (path, kind, colour for masks)
+DEFAULT_LAYERS = {
+    "enhanced": (FIGURES_DIR / "enhanced_TCI_COG.tiff", "image", None),
+    "fire": (FIGURES_DIR / "png" / "fire_mask.png", "mask", (255, 0, 0)),
+    "drought": (FIGURES_DIR / "png" / "drought_mask.png", "mask", (165, 42, 42)),
+    "carbon": (FIGURES_DIR / "CARBON_mask_TCI_COG.tiff", "mask", (153, 52, 4)),
+}
+
+
+def lonlat_to_tile(lon, lat, zoom):
+    """Fractional XYZ (Web Mercator) tile coordinates of a point."""
+    n = 2 ** zoom
+    lat = max(min(lat, 85.05112878), -85.05112878)
+    x = (lon + 180) / 360 * n
+    y = (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n
+    return x, y
+
+
+def tile_pixel_lonlat(zoom, tx, ty, size=TILE_SIZE):
+    """Longitude/latitude of every pixel centre of an XYZ tile."""
+    n = 2 ** zoom * size
+    offsets = np.arange(size) + 0.5
+    lon = (tx * size + offsets) / n * 360 - 180
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (ty * size + offsets) / n))))
+    return np.meshgrid(lon, lat)
+
+
+class RasterSource:
+    """A raster placed on the map through its STAC footprint.
+
+    TIFFs are read window by window from the overview level closest to the
+    requested zoom; other formats (PNG) are decoded once.
+    """
+
+    def __init__(self, path, feature, kind="image", color=None, value_range=None):
+        self.path = str(path)
+        self.kind = kind
+        self.color = color
+        if self.path.lower().endswith((".tif", ".tiff")):
+            first = COGReader(self.path)
+            self.levels = [first] + [COGReader(self.path, level=k) for k in range(1, first.num_levels)]
+            self.image = None
+            self.height, self.width = first.height, first.width
+            self.dtype = first.dtype
+        else:
+            self.levels = []
+            self.image = cv2.imread(self.path, cv2.IMREAD_UNCHANGED)
+            if self.image is None:
+                raise FileNotFoundError(self.path)
+            if self.image.ndim == 3:
+                self.image = cv2.cvtColor(self.image, cv2.COLOR_BGR2RGB if self.image.shape[2] == 3 else cv2.COLOR_BGRA2RGBA)
+            self.height, self.width = self.image.shape[:2]
+            self.dtype = self.image.dtype
+        if value_range is None:
+            value_range = (0.0, 1.0) if np.issubdtype(self.dtype, np.floating) else (0, np.iinfo(self.dtype).max)
+        self.value_range = value_range
+        self.to_lonlat = pixel_to_lonlat_matrix(feature, self.width, self.height)
+        self.to_pixel = lonlat_to_pixel_matrix(feature, self.width, self.height)
+
+    def close(self):
+        for reader in self.levels:
+            reader.close()
+
+    def bounds(self):
+        """(west, south, east, north) of the placed raster."""
+        lon, lat = apply_matrix(self.to_lonlat, [0, self.width, self.width, 0], [0, 0, self.height, self.height])
+        return float(lon.min()), float(lat.min()), float(lon.max()), float(lat.max())
+
+    def zoom_range(self, levels_below=6):
+        """Native zoom (map pixels no larger than source pixels) and a default minimum."""
+        resolution = ground_resolution(self.to_lonlat, self.width, self.height)
+        west, south, east, north = self.bounds()
+        latitude = math.radians((south + north) / 2)
+        native = 2 * math.pi * 6378137.0 * math.cos(latitude) / TILE_SIZE / resolution
+        max_zoom = max(0, math.ceil(math.log2(native)))
+        return max(0, max_zoom - levels_below), max_zoom
+
+    def _read(self, level, row0, col0, row1, col1):
+        if self.image is not None:
+            return self.image[row0:row1, col0:col1]
+        return self.levels[level].read_window(row0, col0, row1 - row0, col1 - col0)
+
+    def render(self, zoom, tx, ty):
+        """RGBA tile (or None when the tile has nothing to show)."""
+        lon, lat = tile_pixel_lonlat(zoom, tx, ty)
+        cols, rows = apply_matrix(self.to_pixel, lon, lat)
+        inside = (cols >= 0) & (cols < self.width) & (rows >= 0) & (rows < self.height)
+        if not inside.any():
+            return None
+
+        # Read from the overview whose pixels best match the tile resolution
+        level = 0
+        if self.levels:
+            step = max(np.abs(np.diff(cols[TILE_SIZE // 2])).mean(), np.abs(np.diff(rows[:, TILE_SIZE // 2])).mean())
+            level = int(min(max(math.floor(math.log2(max(step, 1))), 0), len(self.levels) - 1))
+        scale = 2 ** level
+        cols, rows = cols / scale, rows / scale
+        height, width = (self.levels[level].height, self.levels[level].width) if self.levels else (self.height, self.width)
+        row0 = int(max(math.floor(rows[inside].min()) - 2, 0))
+        col0 = int(max(math.floor(cols[inside].min()) - 2, 0))
+        row1 = int(min(math.ceil(rows[inside].max()) + 3, height))
+        col1 = int(min(math.ceil(cols[inside].max()) + 3, width))
+        window = np.ascontiguousarray(self._read(level, row0, col0, row1, col1))
+
+        map_x = (cols - col0).astype(np.float32)
+        map_y = (rows - row0).astype(np.float32)
+        tile = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+        if self.kind == "mask":
+            values = cv2.remap(window if window.ndim == 2 else window[..., 0], map_x, map_y, cv2.INTER_NEAREST)
+            shown = inside & (values > 0)
+            if not shown.any():
+                return None
+            tile[shown] = tuple(self.color) + (255,)
+            return tile
+
+        values = cv2.remap(window, map_x, map_y, cv2.INTER_LINEAR)
+        low, high = self.value_range
+        values = np.clip((values.astype(np.float32) - low) * (255.0 / (high - low)), 0, 255).astype(np.uint8)
+        if values.ndim == 2:
+            values = values[..., None]
+        tile[..., :3] = values[..., :3] if values.shape[2] >= 3 else values[..., :1]
+        tile[..., 3] = np.where(inside, 255, 0)
+        return tile
+
+
+def tile_range(bounds, zoom):
+    """Inclusive XYZ tile index range covering (west, south, east, north)."""
+    west, south, east, north = bounds
+    x0, y0 = lonlat_to_tile(west, north, zoom)
+    x1, y1 = lonlat_to_tile(east, south, zoom)
+    return int(x0), int(y0), int(x1), int(y1)
+
+
+def build_pyramid(source, output_dir, min_zoom=None, max_zoom=None, workers=None):
+    """Write z/x/y.png tiles for one layer plus a TileJSON; returns {zoom: tiles written}."""
+    output_dir = Path(output_dir)
+    default_min, default_max = source.zoom_range()
+    min_zoom = default_min if min_zoom is None else min_zoom
+    max_zoom = default_max if max_zoom is None else max_zoom
+    bounds = source.bounds()
+
+    def write_tile(zoom, tx, ty):
+        tile = source.render(zoom, tx, ty)
+        if tile is None:
+            return 0
+        path = output_dir / str(zoom) / str(tx) / f"{ty}.png"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        cv2.imwrite(str(path), cv2.cvtColor(tile, cv2.COLOR_RGBA2BGRA))
+        return 1
+
+    written = {}
+    for zoom in range(min_zoom, max_zoom + 1):
+        x0, y0, x1, y1 = tile_range(bounds, zoom)
+        # Each level is rendered on its own pool; cv2.remap and the TIFF decoders release the GIL
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(lambda xy: write_tile(zoom, *xy),
+                               [(tx, ty) for tx in range(x0, x1 + 1) for ty in range(y0, y1 + 1)])
+            written[zoom] = sum(results)
+        print(f"[INFO] {output_dir.name} z{zoom}: {written[zoom]} of {(x1 - x0 + 1) * (y1 - y0 + 1)} tiles")
+
+    tilejson = {
+        "tilejson": "2.2.0",
+        "name": output_dir.name,
+        "tiles": [f"{output_dir.name}/{{z}}/{{x}}/{{y}}.png"],
+        "bounds": list(bounds),
+        "center": [(bounds[0] + bounds[2]) / 2, (bounds[1] + bounds[3]) / 2, min_zoom],
+        "minzoom": min_zoom,
+        "maxzoom": max_zoom,
+    }
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with open(output_dir / "tiles.json", "w") as f:
+        json.dump(tilejson, f, indent=4)
+    return written
+
+
+class TileRequestHandler(SimpleHTTPRequestHandler):
+    """Static tile handler with caching headers; missing (empty) tiles answer 204."""
+
+    max_age = 3600
+
+    def end_headers(self):
+        self.send_header("Access-Control-Allow-Origin", "*")
+        super().end_headers()
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", f"public, max-age={self.max_age}")
+                self.end_headers()
+                return None
+            f = open(path, "rb")
+            self.send_response(200)
+            self.send_header("Content-Type", self.guess_type(path))
+            self.send_header("Content-Length", str(stat.st_size))
+            self.send_header("Last-Modified", email.utils.formatdate(stat.st_mtime, usegmt=True))
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", f"public, max-age={self.max_age}")
+            self.end_headers()
+            return f
+        if path.endswith(".png"):
+            self.send_response(204)
+            self.send_header("Cache-Control", f"public, max-age={self.max_age}")
+            self.end_headers()
+            return None
+        return super().send_head()
+
+
+def serve_tiles(directory=TILES_DIR, host="127.0.0.1", port=8000):
+    """Serve a tile directory over HTTP until interrupted."""
+    handler = partial(TileRequestHandler, directory=str(directory))
+    with ThreadingHTTPServer((host, port), handler) as server:
+        print(f"[INFO] Serving {directory} at http://{host}:{port}/<layer>/{{z}}/{{x}}/{{y}}.png")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and serve XYZ tile pyramids of the detection outputs.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Render layers into z/x/y PNG tiles")
+    build.add_argument("--feature-id", help="STAC feature placing the rasters (default: the one --source belongs to)")
+    build.add_argument("--source", default=str(FIGURES_DIR / "TCI_COG.tiff"),
+                       help="Scene the layers were rendered from, as downloaded TCI asset or its href")
+    build.add_argument("--layer", action="append", metavar="NAME=PATH[:image|:mask]",
+                       help="Layer to render (default: enhanced image and fire/drought/carbon masks)")
+    build.add_argument("--min-zoom", type=int)
+    build.add_argument("--max-zoom", type=int)
+    build.add_argument("--workers", type=int, default=None)
+    build.add_argument("--output-dir", default=str(TILES_DIR))
+    serve = sub.add_parser("serve", help="Serve a tile directory with caching headers")
+    serve.add_argument("--directory", default=str(TILES_DIR))
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve_tiles(args.directory, args.host, args.port)
+        return
+
+    feature = resolve_feature(args.feature_id, args.source)
+    if feature is None:
+        if args.feature_id:
+            print(f"Error: STAC feature {args.feature_id} not found!")
+        else:
+            print(f"Error: {args.source} is not a downloaded TCI asset of any STAC feature; "
+                  "pass --feature-id of the scene the layers were rendered from")
+        return
+
+    layers = DEFAULT_LAYERS
+    if args.layer:
+        layers = {}
+        for spec in args.layer:
+            name, _, path = spec.partition("=")
+            kind = "image"
+            if path.endswith((":image", ":mask")):
+                path, _, kind = path.rpartition(":")
+            layers[name] = (path, kind, DEFAULT_LAYERS.get(name, (None, None, (255, 0, 0)))[2] or (255, 0, 0))
+
+    for name, (path, kind, color) in layers.items():
+        if not os.path.exists(path):
+            print(f"[WARN] Skipping layer {name}: {path} not found")
+            continue
+        source = RasterSource(path, feature, kind, color)
+        try:
+            build_pyramid(source, Path(args.output_dir) / name, args.min_zoom, args.max_zoom, args.workers)
+        finally:
+            source.close()
+    print(f"Tiles saved in: {args.output_dir}")
+    print(f"Serve them with: python utils/tile_pyramid.py serve --directory {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+from drought_detection.utils.drought_detection import calculate_ndvi_approximation
+from utils.cog_reader import window_grid
+from utils.georef import apply_matrix, pixel_to_lonlat_matrix
+from utils.spectral_lut import ndvi_table, supports_lut
+from utils.stac_catalog import feature_bbox
+
+FIGURES_DIR = Path(__file__).resolve().parent.parent / "figures"
+DEFAULT_STORE = FIGURES_DIR / "tile_stats"
+DEFAULT_TILE = 512
+# Pseudo-NDVI (0-1) histogram bins per tile
+NDVI_BINS = 16
+
+# Column name -> dtype; ndvi_hist has one column per bin
+COLUMNS = {
+    "row": np.int32,
+    "col": np.int32,
+    "height": np.int32,
+    "width": np.int32,
+    "pixels": np.int64,
+    "fire_pixels": np.int64,
+    "drought_pixels": np.int64,
+    "carbon_pixels": np.int64,
+    "severity_sum": np.float64,
+    "ndvi_hist": np.uint32,
+}
+GROUPS = ("all", "scene", "month", "day")
+COLUMN_FILE = "columns.bin"
+
+
+@lru_cache(maxsize=None)
+def _ndvi_bin_table(bins):
+    """Histogram bin of the pseudo-NDVI of every (red, green) byte pair."""
+    return np.minimum((ndvi_table() * bins).astype(np.uint8), bins - 1)
+
+
+def ndvi_bins(image, bins=NDVI_BINS):
+    """Pseudo-NDVI histogram bin (0..bins-1) of every pixel of an RGB image."""
+    if supports_lut(image):
+        return _ndvi_bin_table(bins)[image[:, :, 0], image[:, :, 1]]
+    ndvi = calculate_ndvi_approximation(image)
+    return np.clip((ndvi * bins).astype(np.int64), 0, bins - 1)
+
+
+def _overlap(window, row, col, height, width):
+    """Slices of the block at (row, col) and of the window covering their intersection, or None."""
+    top, left = max(window.row, row), max(window.col, col)
+    bottom = min(window.row + window.height, row + height)
+    right = min(window.col + window.width, col + width)
+    if top >= bottom or left >= right:
+        return None
+    return slice(top - row, bottom - row), slice(left - col, right - col)
+
+
+class TileStats:
+    """Per-tile aggregates of one scene: one row per tile of a regular grid.
+
+    Pixel counts of the fire, drought and carbon masks, the drought severity
+    sum and a pseudo-NDVI histogram are kept per tile, so coverage, mean
+    severity and vegetation distributions can be recomputed over any set of
+    tiles without the imagery. Blocks need not be aligned with the grid;
+    every quantity is a sum and is accumulated over the overlap.
+    """
+
+    def __init__(self, height, width, tile_size=DEFAULT_TILE, bins=NDVI_BINS):
+        self.height, self.width = height, width
+        self.tile_size = tile_size
+        self.bins = bins
+        self.carbon_scale = 1
+        self.windows = window_grid(height, width, tile_size)
+        count = len(self.windows)
+        self.columns = {name: np.zeros(count, dtype=dtype) for name, dtype in COLUMNS.items()}
+        self.columns["ndvi_hist"] = np.zeros((count, bins), dtype=COLUMNS["ndvi_hist"])
+        for name in ("row", "col", "height", "width"):
+            self.columns[name][:] = [getattr(window, name) for window in self.windows]
+        self.columns["pixels"][:] = self.columns["height"].astype(np.int64) * self.columns["width"]
+
+    def add_image(self, image, severity, row=0, col=0):
+        """Accumulate the pseudo-NDVI histograms and severity sums of an RGB block placed at (row, col)."""
+        height, width = image.shape[:2]
+        for i, window in enumerate(self.windows):
+            overlap = _overlap(window, row, col, height, width)
+            if overlap is None:
+                continue
+            self.columns["ndvi_hist"][i] += np.bincount(
+                ndvi_bins(image[overlap], self.bins).ravel(), minlength=self.bins
+            ).astype(COLUMNS["ndvi_hist"])
+            self.columns["severity_sum"][i] += severity[overlap].sum(dtype=np.float64)
+
+    def add_masks(self, fire_mask=None, drought_mask=None, carbon_mask=None, carbon_scale=1):
+        """Count the non-zero pixels of full-scene masks per tile.
+
+        The carbon mask is computed on the upscaled image, carbon_scale times
+        the scene size; its tiles are scaled accordingly.
+        """
+        self.carbon_scale = carbon_scale
+        for name, mask, scale in (("fire", fire_mask, 1), ("drought", drought_mask, 1),
+                                  ("carbon", carbon_mask, carbon_scale)):
+            if mask is None:
+                continue
+            column = self.columns[f"{name}_pixels"]
+            for i, window in enumerate(self.windows):
+                column[i] = np.count_nonzero(mask[window.row * scale:(window.row + window.height) * scale,
+                                                  window.col * scale:(window.col + window.width) * scale])
+
+
+def _segment_name(scene_id, asset=None):
+    name = f"{scene_id}__{asset}" if asset else str(scene_id)
+    return re.sub(r"[^A-Za-z0-9._-]", "_", name)
+
+
+def _end_of_day(value):
+    """Make date-only upper bounds inclusive of the whole day."""
+    return value + "T23:59:59Z" if value and "T" not in value else value
+
+
+class TileStatsStore:
+    """Column store of TileStats: one directory per scene (and asset).
+
+    The columns of a scene are stored one after the other in columns.bin,
+    with their dtype, shape and offset in a meta.json next to it that also
+    holds the scene id, datetime and footprint. Queries filter scenes on the
+    metadata and memory-map a single file per scene. Segments are written to
+    a temporary directory and moved into place, so concurrent batch workers
+    never expose half-written scenes.
+    """
+
+    def __init__(self, directory=DEFAULT_STORE):
+        self.directory = Path(directory)
+
+    def write(self, scene_id, stats, asset=None, datetime=None, geometry=None, source=None):
+        """Store the stats of a scene, replacing any earlier segment; returns its directory."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        target = self.directory / _segment_name(scene_id, asset)
+        meta = {
+            "scene_id": scene_id,
+            "asset": asset,
+            "datetime": datetime,
+            "geometry": geometry,
+            "source": str(source) if source else None,
+            "height": stats.height,
+            "width": stats.width,
+            "tile_size": stats.tile_size,
+            "tiles": len(stats.windows),
+            "ndvi_bins": stats.bins,
+            "carbon_scale": stats.carbon_scale,
+            "columns": {},
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+        staging = Path(tempfile.mkdtemp(prefix=".tmp-", dir=self.directory))
+        try:
+            with open(staging / COLUMN_FILE, "wb") as f:
+                for name, values in stats.columns.items():
+                    # Keep every column 8-byte aligned for the memory-mapped views
+                    f.write(b"\0" * (-f.tell() % 8))
+                    meta["columns"][name] = {"dtype": values.dtype.str, "shape": list(values.shape),
+                                             "offset": f.tell()}
+                    f.write(np.ascontiguousarray(values).tobytes())
+            with open(staging / "meta.json", "w") as f:
+                json.dump(meta, f, indent=4)
+            old = None
+            if target.exists():
+                old = self.directory / f".old-{os.getpid()}-{target.name}"
+                os.replace(target, old)
+            os.replace(staging, target)
+            if old is not None:
+                shutil.rmtree(old, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        return target
+
+    def scenes(self):
+        """meta.json of every stored segment, ordered by datetime."""
+        if not self.directory.is_dir():
+            return []
+        metas = []
+        for path in self.directory.glob("*/meta.json"):
+            if path.parent.name.startswith("."):
+                continue
+            with open(path) as f:
+                meta = json.load(f)
+            meta["path"] = str(path.parent)
+            metas.append(meta)
+        return sorted(metas, key=lambda meta: (meta.get("datetime") or "", meta["scene_id"]))
+
+    def load(self, meta, names=None):
+        """Read-only views of the columns of a segment, backed by one memory map."""
+        data = np.memmap(Path(meta["path"]) / COLUMN_FILE, dtype=np.uint8, mode="r")
+        columns = {}
+        for name in names or meta["columns"]:
+            column = meta["columns"][name]
+            dtype = np.dtype(column["dtype"])
+            count = int(np.prod(column["shape"]))
+            columns[name] = np.frombuffer(data, dtype, count, column["offset"]).reshape(column["shape"])
+        return columns
+
+    def query(self, start=None, end=None, bbox=None, scene_ids=None, assets=None):
+        """Per-scene sums over the tiles matching a time range, bbox and scene/asset filter."""
+        records = []
+        for meta in self.scenes():
+            if scene_ids and meta["scene_id"] not in scene_ids:
+                continue
+            if assets and meta.get("asset") not in assets:
+                continue
+            moment = meta.get("datetime") or ""
+            if (start and moment < start) or (end and moment > _end_of_day(end)):
+                continue
+            columns = self.load(meta)
+            selected = np.ones(meta["tiles"], dtype=bool)
+            if bbox is not None:
+                if not meta.get("geometry"):
+                    continue
+                selected = tiles_in_bbox(meta, columns, bbox)
+                if not selected.any():
+                    continue
+            records.append(_scene_record(meta, columns, selected))
+        return records
+
+
+def tiles_in_bbox(meta, columns, bbox):
+    """Boolean selection of the tiles whose footprint intersects (min_x, min_y, max_x, max_y)."""
+    feature = {"geometry": meta["geometry"]}
+    try:
+        matrix = pixel_to_lonlat_matrix(feature, meta["width"], meta["height"])
+    except ValueError:
+        # Not a 4-corner footprint: fall back to the scene bbox for every tile
+        min_x, min_y, max_x, max_y = feature_bbox(feature)
+        hit = min_x <= bbox[2] and max_x >= bbox[0] and min_y <= bbox[3] and max_y >= bbox[1]
+        return np.full(meta["tiles"], hit)
+    top, left = np.asarray(columns["row"], dtype=np.float64), np.asarray(columns["col"], dtype=np.float64)
+    bottom, right = top + columns["height"], left + columns["width"]
+    lon, lat = apply_matrix(matrix, np.stack([left, right, right, left]), np.stack([top, top, bottom, bottom]))
+    return ((lon.min(axis=0) <= bbox[2]) & (lon.max(axis=0) >= bbox[0])
+            & (lat.min(axis=0) <= bbox[3]) & (lat.max(axis=0) >= bbox[1]))
+
+
+def _scene_record(meta, columns, selected):
+    scale = meta.get("carbon_scale", 1)
+    pixels = int(columns["pixels"][selected].sum())
+    return {
+        "scene_id": meta["scene_id"],
+        "asset": meta.get("asset"),
+        "datetime": meta.get("datetime"),
+        "tiles": int(selected.sum()),
+        "pixels": pixels,
+        "fire_pixels": int(columns["fire_pixels"][selected].sum()),
+        "drought_pixels": int(columns["drought_pixels"][selected].sum()),
+        # Carbon is counted on the upscaled image; express it in scene pixels
+        "carbon_pixels": int(columns["carbon_pixels"][selected].sum()) / scale ** 2,
+        "fire_tiles": int(np.count_nonzero(columns["fire_pixels"][selected])),
+        "severity_sum": float(columns["severity_sum"][selected].sum()),
+        "ndvi_hist": columns["ndvi_hist"][selected].sum(axis=0, dtype=np.int64),
+    }
+
+
+def _group_key(record, by):
+    moment = record["datetime"] or ""
+    if by == "scene":
+        return f"{record['scene_id']}/{record['asset']}" if record["asset"] else record["scene_id"]
+    if by == "month":
+        return moment[:7]
+    if by == "day":
+        return moment[:10]
+    return "all"
+
+
+def aggregate(records, by="all"):
+    """Sum per-scene records into groups with coverage percentages, mean severity and mean pseudo-NDVI."""
+    groups = {}
+    for record in records:
+        key = _group_key(record, by)
+        group = groups.setdefault(key, {"group": key, "scenes": 0, "tiles": 0, "pixels": 0, "fire_pixels": 0,
+                                        "drought_pixels": 0, "carbon_pixels": 0, "fire_tiles": 0,
+                                        "severity_sum": 0.0, "ndvi_hist": 0})
+        group["scenes"] += 1
+        for name in ("tiles", "pixels", "fire_pixels", "drought_pixels", "carbon_pixels", "fire_tiles",
+                     "severity_sum", "ndvi_hist"):
+            group[name] = group[name] + record[name]
+
+    results = []
+    for group in groups.values():
+        pixels = max(group["pixels"], 1)
+        hist = np.asarray(group.pop("ndvi_hist"), dtype=np.int64)
+        centres = (np.arange(len(hist)) + 0.5) / len(hist)
+        group["fire_coverage"] = group["fire_pixels"] / pixels * 100
+        group["drought_coverage"] = group["drought_pixels"] / pixels * 100
+        group["carbon_coverage"] = group["carbon_pixels"] / pixels * 100
+        group["mean_severity"] = group.pop("severity_sum") / pixels
+        # Bin centres: within half a bin of the true mean
+        group["mean_ndvi"] = float(hist @ centres / max(hist.sum(), 1))
+        group["ndvi_hist"] = hist.tolist()
+        results.append(group)
+    return sorted(results, key=lambda group: group["group"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the per-tile fire/drought/carbon statistics store.")
+    parser.add_argument("command", nargs="?", choices=["query", "list"], default="query")
+    parser.add_argument("--store", default=str(DEFAULT_STORE))
+    parser.add_argument("--start", help="Only scenes acquired at or after this datetime")
+    parser.add_argument("--end", help="Only scenes acquired at or before this datetime")
+    parser.add_argument("--bbox", nargs=4, type=float, metavar=("MIN_X", "MIN_Y", "MAX_X", "MAX_Y"),
+                        help="Only tiles intersecting this lon/lat box")
+    parser.add_argument("--scene", nargs="+", help="Only these feature ids")
+    parser.add_argument("--asset", nargs="+", help="Only these assets")
+    parser.add_argument("--by", choices=GROUPS, default="all", help="Group the totals")
+    parser.add_argument("--json", action="store_true", help="Print the groups as JSON")
+    args = parser.parse_args()
+
+    store = TileStatsStore(args.store)
+    if args.command == "list":
+        for meta in store.scenes():
+            print(f"{meta['scene_id']:48s} {meta.get('asset') or '-':6s} {meta.get('datetime') or '-':24s} "
+                  f"{meta['width']}x{meta['height']} {meta['tiles']} tiles")
+        return
+
+    start = time.perf_counter()
+    records = store.query(args.start, args.end, args.bbox, args.scene, args.asset)
+    groups = aggregate(records, args.by)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    if args.json:
+        print(json.dumps(groups, indent=4))
+    else:
+        print(f"{'group':40s} {'scenes':>6s} {'tiles':>7s} {'fire %':>8s} {'drought %':>9s} {'carbon %':>8s} "
+              f"{'severity':>8s} {'ndvi':>6s}")
+        for group in groups:
+            print(f"{group['group']:40s} {group['scenes']:6d} {group['tiles']:7d} {group['fire_coverage']:8.3f} "
+                  f"{group['drought_coverage']:9.3f} {group['carbon_coverage']:8.3f} "
+                  f"{group['mean_severity']:8.3f} {group['mean_ndvi']:6.3f}")
+    print(f"[INFO] {len(records)} scenes aggregated in {elapsed:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
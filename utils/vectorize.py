@@ -0,0 +1,349 @@
+import argparse
+import json
+import os
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from utils.cog_reader import COGReader
+from utils.georef import apply_matrix, ground_resolution, pixel_to_lonlat_matrix
+from utils.packed_mask import RLE_SUFFIX, PackedMask
+from utils.stac_catalog import resolve_feature
+
+FIGURES_DIR = Path(__file__).resolve().parent.parent / "figures"
+VECTOR_DIR = FIGURES_DIR / "vectors"
+DEFAULT_LAYERS = {
+    "fire": FIGURES_DIR / "png" / "fire_mask.png",
+    "drought": FIGURES_DIR / "png" / "drought_mask.png",
+    "carbon": FIGURES_DIR / "png" / "carbon_mask.png",
+}
+# Rows decoded and labelled at a time
+STRIP_ROWS = 512
+DEFAULT_MIN_AREA = 16
+# Douglas-Peucker tolerance in pixels
+DEFAULT_TOLERANCE = 1.0
+FORMATS = {"geojson": ".geojson", "geojsonseq": ".geojsonl"}
+
+
+class MaskSource:
+    """Rows of a mask raster: TIFFs are read window by window, other formats (PNG) decoded once.
+
+    Run-length files and PackedMask sources stay bit-packed and are unpacked one strip at a time.
+    """
+
+    def __init__(self, source):
+        self.reader = None
+        self.image = None
+        if isinstance(source, (np.ndarray, PackedMask)):
+            self.image = source
+        elif str(source).lower().endswith(RLE_SUFFIX):
+            self.image = PackedMask.load(source)
+        elif str(source).lower().endswith((".tif", ".tiff")):
+            self.reader = COGReader(str(source))
+        else:
+            self.image = cv2.imread(str(source), cv2.IMREAD_UNCHANGED)
+            if self.image is None:
+                raise FileNotFoundError(source)
+        if self.reader is not None:
+            self.height, self.width = self.reader.height, self.reader.width
+        else:
+            self.height, self.width = self.image.shape[:2]
+
+    def read_rows(self, row, count):
+        """0/1 uint8 mask of rows [row, row + count); multi-band masks use their first band."""
+        if self.reader is not None:
+            block = self.reader.read_window(row, 0, count, self.width)
+        else:
+            block = self.image[row:row + count]
+        if block.ndim == 3:
+            block = block[:, :, 0]
+        return (block > 0).astype(np.uint8)
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+
+
+def edge_grid(mask):
+    """The mask on a grid of pixel corners, edges and centres: pixel (r, c) covers cells [2r, 2r + 2] x [2c, 2c + 2].
+
+    Boundary cells of the grid lie on pixel edges, so contours traced on it
+    follow the pixel edges instead of running through pixel centres.
+    """
+    height, width = mask.shape
+    grid = np.zeros((2 * height + 1, 2 * width + 1), dtype=np.uint8)
+    for dy in range(3):
+        for dx in range(3):
+            grid[dy:dy + 2 * height:2, dx:dx + 2 * width:2] |= mask
+    return grid
+
+
+def _edge_ring(contour):
+    """Pixel-edge ring (in pixels) of a contour traced on an edge_grid.
+
+    8-connected tracing cuts concave corners with a diagonal step between
+    two edge cells; the cut corner is the candidate on a pixel corner (both
+    grid coordinates even). Points in the middle of straight runs are dropped.
+    """
+    points = contour[:, 0, :]
+    following = np.concatenate([points[1:], points[:1]])
+    diagonal = np.flatnonzero((points[:, 0] != following[:, 0]) & (points[:, 1] != following[:, 1]))
+    corners = np.where((points[diagonal, :1] % 2 == 0),
+                       np.stack([points[diagonal, 0], following[diagonal, 1]], axis=1),
+                       np.stack([following[diagonal, 0], points[diagonal, 1]], axis=1))
+    points = np.insert(points, diagonal + 1, corners, axis=0)
+    after = np.diff(points, axis=0, append=points[:1])
+    before = np.concatenate([after[-1:], after[:-1]])
+    turns = before[:, 0] * after[:, 1] - before[:, 1] * after[:, 0] != 0
+    return points[turns] / 2
+
+
+def _polygons(mask, labels, stats, row_offset, min_area):
+    """Outer rings and their holes of the blobs in mask, along the pixel edges in scene coordinates.
+
+    A blob of n pixels has exactly area n minus its holes. Blobs joined
+    only at a pixel corner give a ring that touches itself at that corner.
+    """
+    contours, hierarchy = cv2.findContours(edge_grid(mask), cv2.RETR_CCOMP, cv2.CHAIN_APPROX_NONE)
+    if hierarchy is None:
+        return
+    hierarchy = hierarchy[0]
+    for index, contour in enumerate(contours):
+        # With RETR_CCOMP the top level holds the outer boundaries, their children the holes
+        if hierarchy[index][3] != -1:
+            continue
+        # The trace starts at the top-left corner of the blob's first pixel
+        x, y = contour[0, 0] // 2
+        pixels = int(stats[labels[y, x], cv2.CC_STAT_AREA])
+        if pixels < min_area:
+            continue
+        rings = [contour]
+        child = hierarchy[index][2]
+        while child != -1:
+            rings.append(contours[child])
+            child = hierarchy[child][0]
+        offset = np.array([0, row_offset])
+        yield [_edge_ring(ring) + offset for ring in rings], pixels
+
+
+def trace_blobs(source, min_area=DEFAULT_MIN_AREA, strip_rows=STRIP_ROWS):
+    """Yield (rings, pixel count) for every 8-connected blob of a MaskSource, strip by strip.
+
+    Strips span the full width, so blobs only continue across the seam
+    below. A blob touching the last row decoded so far is kept for the next
+    strip; all others are complete, traced and dropped. Only the rows from
+    the top of the highest unfinished blob down are held in memory, and the
+    polygons are exactly those of a whole-scene trace.
+    """
+    buffer = np.zeros((0, source.width), dtype=np.uint8)
+    start = 0
+    for row in range(0, source.height, strip_rows):
+        strip = source.read_rows(row, min(strip_rows, source.height - row))
+        buffer = np.concatenate([buffer, strip]) if len(buffer) else strip
+        last = row + len(strip) == source.height
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(buffer, connectivity=8)
+        bottom = stats[:, cv2.CC_STAT_TOP] + stats[:, cv2.CC_STAT_HEIGHT]
+        unfinished = (bottom == len(buffer)) & (not last)
+        unfinished[0] = False
+        finished = ~unfinished
+        finished[0] = False
+        if finished.any():
+            done = finished[labels].view(np.uint8)
+            yield from _polygons(done, labels, stats, start, min_area)
+        # Keep the unfinished blobs only, from the top of the highest one
+        keep = len(buffer)
+        if unfinished.any():
+            keep = int(stats[unfinished, cv2.CC_STAT_TOP].min())
+            buffer = unfinished[labels[keep:]].view(np.uint8)
+        else:
+            buffer = buffer[keep:]
+        start += keep
+
+
+def _orientation(a, b, c):
+    return np.sign((b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0]))
+
+
+def edges_cross(rings, chunk=64):
+    """Whether any two edges of the rings cross at a point inside both (touching at a vertex is allowed)."""
+    starts = np.concatenate(rings)
+    ends = np.concatenate([np.concatenate([ring[1:], ring[:1]]) for ring in rings])
+    # Sweep along x: edges sorted by their left end are only compared with those starting before they end
+    low, high = np.minimum(starts, ends), np.maximum(starts, ends)
+    order = np.argsort(low[:, 0], kind="stable")
+    starts, ends, low, high = starts[order], ends[order], low[order], high[order]
+    for i in range(0, len(starts), chunk):
+        stop = int(np.searchsorted(low[:, 0], high[i:i + chunk, 0].max(), side="right"))
+        # Only edges with overlapping bounding boxes can cross
+        overlap = (low[i:i + chunk, None] <= high[None, i:stop]) & (high[i:i + chunk, None] >= low[None, i:stop])
+        first, second = np.nonzero(overlap[:, :, 0] & overlap[:, :, 1])
+        a, b = starts[first + i], ends[first + i]
+        c, d = starts[second + i], ends[second + i]
+        if np.any((_orientation(a, b, c) * _orientation(a, b, d) < 0)
+                  & (_orientation(c, d, a) * _orientation(c, d, b) < 0)):
+            return True
+    return False
+
+
+def simplify_rings(rings, tolerance=DEFAULT_TOLERANCE):
+    """Douglas-Peucker simplification that falls back to the original rings where it would break the polygon.
+
+    Rings that would collapse below three vertices or to no area stay as
+    they are. The simplified polygon is used only if no two edges cross and
+    every hole starts inside the outer ring; otherwise the simplified outer
+    ring with the original holes, and failing that the original rings.
+    """
+    if tolerance <= 0:
+        return rings
+
+    def simplify(ring):
+        simple = cv2.approxPolyDP(ring.astype(np.float32), tolerance, True)[:, 0, :].astype(np.float64)
+        return simple if len(simple) >= 3 and _signed_area(simple) != 0 else ring
+
+    def valid(candidate):
+        contour = candidate[0].astype(np.float32)
+        return (all(cv2.pointPolygonTest(contour, (float(hole[0, 0]), float(hole[0, 1])), False) >= 0
+                    for hole in candidate[1:])
+                and not edges_cross(candidate))
+
+    outer = simplify(rings[0])
+    for candidate in ([outer] + [simplify(hole) for hole in rings[1:]], [outer] + rings[1:]):
+        if valid(candidate):
+            return candidate
+    return rings
+
+
+def _signed_area(ring):
+    x, y = ring[:, 0], ring[:, 1]
+    return np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y) / 2
+
+
+def to_geometry(rings, matrix=None, precision=8):
+    """GeoJSON Polygon of pixel rings, through the pixel -> lon/lat homography if given.
+
+    Rings are closed and oriented as RFC 7946 asks: outer counter-clockwise, holes clockwise.
+    """
+    coordinates = []
+    for index, ring in enumerate(rings):
+        if matrix is not None:
+            ring = np.stack(apply_matrix(matrix, ring[:, 0], ring[:, 1]), axis=1)
+        if (_signed_area(ring) > 0) != (index == 0):
+            ring = ring[::-1]
+        ring = np.round(np.concatenate([ring, ring[:1]]), precision)
+        coordinates.append(ring.tolist())
+    return {"type": "Polygon", "coordinates": coordinates}
+
+
+class FeatureWriter:
+    """Write GeoJSON features one at a time, as a FeatureCollection or as GeoJSONSeq (one per line).
+
+    Output goes to a temporary file that replaces the target on close, so
+    readers never see a truncated collection.
+    """
+
+    def __init__(self, path, sequence=False):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.temp = self.path.with_name(self.path.name + ".tmp")
+        self.sequence = sequence
+        self.count = 0
+        self.file = open(self.temp, "w")
+        if not sequence:
+            self.file.write('{"type": "FeatureCollection", "features": [\n')
+
+    def write(self, feature):
+        if self.sequence:
+            self.file.write(json.dumps(feature) + "\n")
+        else:
+            self.file.write((",\n" if self.count else "") + json.dumps(feature))
+        self.count += 1
+
+    def close(self):
+        if not self.sequence:
+            self.file.write("\n]}\n")
+        self.file.close()
+        os.replace(self.temp, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            os.remove(self.temp)
+
+
+def vectorize_mask(source, output, feature=None, layer=None, min_area=DEFAULT_MIN_AREA,
+                   tolerance=DEFAULT_TOLERANCE, sequence=False, strip_rows=STRIP_ROWS):
+    """Trace the blobs of a mask (path or array) into polygons written to output; returns the polygon count.
+
+    With the STAC feature the polygons are placed through its footprint in
+    lon/lat and get an approximate area in square metres; without it they
+    stay in pixel coordinates.
+    """
+    mask = MaskSource(source)
+    try:
+        matrix = None
+        pixel_area = None
+        if feature is not None:
+            matrix = pixel_to_lonlat_matrix(feature, mask.width, mask.height)
+            pixel_area = ground_resolution(matrix, mask.width, mask.height) ** 2
+        with FeatureWriter(output, sequence) as writer:
+            for rings, pixels in trace_blobs(mask, min_area, strip_rows):
+                properties = {"layer": layer, "pixels": pixels}
+                if pixel_area is not None:
+                    properties["area_m2"] = round(pixels * pixel_area, 1)
+                writer.write({
+                    "type": "Feature",
+                    "id": writer.count,
+                    "properties": properties,
+                    "geometry": to_geometry(simplify_rings(rings, tolerance), matrix),
+                })
+            return writer.count
+    finally:
+        mask.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vectorize the fire/drought/carbon masks into GeoJSON polygons.")
+    parser.add_argument("--feature-id", help="STAC feature placing the masks (default: the one --source belongs to)")
+    parser.add_argument("--source", default=str(FIGURES_DIR / "TCI_COG.tiff"),
+                        help="Scene the masks were computed from (a downloaded TCI asset or its href)")
+    parser.add_argument("--layer", action="append", metavar="NAME=PATH",
+                        help="Mask to vectorize (default: fire, drought and carbon masks)")
+    parser.add_argument("--min-area", type=int, default=DEFAULT_MIN_AREA, help="Drop blobs below this many pixels")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Simplification tolerance in pixels (0 keeps every vertex)")
+    parser.add_argument("--format", choices=list(FORMATS), default="geojson")
+    parser.add_argument("--strip-rows", type=int, default=STRIP_ROWS)
+    parser.add_argument("--output-dir", default=str(VECTOR_DIR))
+    args = parser.parse_args()
+
+    feature = resolve_feature(args.feature_id, args.source)
+    if feature is None:
+        if args.feature_id:
+            print(f"Error: STAC feature {args.feature_id} not found!")
+        else:
+            print(f"Error: {args.source} is not a downloaded TCI asset of any STAC feature; "
+                  "pass --feature-id of the scene the masks were computed from")
+        return
+
+    layers = DEFAULT_LAYERS
+    if args.layer:
+        layers = dict(spec.split("=", 1) for spec in args.layer)
+
+    for name, path in layers.items():
+        if not os.path.exists(path):
+            print(f"[WARN] Skipping layer {name}: {path} not found")
+            continue
+        output = Path(args.output_dir) / f"{name}{FORMATS[args.format]}"
+        count = vectorize_mask(path, output, feature, name, args.min_area, args.tolerance,
+                               args.format == "geojsonseq", args.strip_rows)
+        print(f"{name}: {count} polygons saved as {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+import argparse
+import http.client
+import itertools
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Only the standard library is imported here so the module mains can act as
+# thin clients; the detectors are loaded once, by the service process.
+
+DEFAULT_ADDRESS = "http://127.0.0.1:8765"
+ADDRESS_ENV = "WORKER_SERVICE"  # URL or Unix socket path of the service
+KEEP_FINISHED = 1000
+
+
+class ServiceBusy(Exception):
+    """The service queue is full (HTTP 429)."""
+
+
+# --- Service -----------------------------------------------------------------
+
+class WorkerService:
+    """Runs pipeline jobs on a fixed pool of warm worker threads.
+
+    Jobs wait in a bounded queue; when it is full submit() raises queue.Full
+    so callers can push back instead of piling work up in memory.
+    """
+
+    def __init__(self, workers=2, queue_size=16, stage_workers=None):
+        import run_pipeline
+        from image_enhancement.config import CACHE_PARAMS
+        from utils.stage_cache import StageCache
+
+        self.pipeline = run_pipeline
+        self.cache = StageCache(**CACHE_PARAMS)
+        self.stage_workers = stage_workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.jobs = OrderedDict()
+        self._events = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def warm_up(self, fire_params, drought_params):
+        """Build the colour lookup tables for the configured thresholds ahead of the first job."""
+        from utils.spectral_lut import drought_mask_lut, drought_viz_tables, fire_mask_lut
+        fire_mask_lut(float(fire_params["intensity_threshold"]))
+        drought_mask_lut(float(drought_params["ndvi_weight"]), float(drought_params["color_weight"]),
+                         float(drought_params["drought_threshold"]))
+        drought_viz_tables(float(drought_params["ndvi_weight"]), float(drought_params["color_weight"]))
+
+    def _resolve(self, job):
+        """Scene path and STAC feature (if any) of a job, from the job itself or its STAC item."""
+        if job.get("stac_id"):
+            from utils.load_project_data import asset_local_path
+            from utils.stac_catalog import open_catalog
+            with open_catalog() as catalog:
+                feature = catalog.get_feature(job["stac_id"])
+            if feature is None:
+                raise ValueError(f"Unknown STAC item: {job['stac_id']}")
+            return asset_local_path(feature, job.get("asset", "TCI"), job.get("data_dir")), feature
+        return job.get("scene"), None
+
+    def submit(self, job):
+        """Queue a job; returns its record (raises queue.Full when the queue is full)."""
+        if not (job.get("scene") or job.get("stac_id") or job.get("enhanced")):
+            raise ValueError("A job needs a scene, stac_id or enhanced image")
+        with self._lock:
+            job_id = str(next(self._ids))
+            record = {"id": job_id, "status": "queued", "job": job, "submitted": time.time()}
+            self.jobs[job_id] = record
+            self._events[job_id] = threading.Event()
+            try:
+                self.queue.put_nowait(job_id)
+            except queue.Full:
+                del self.jobs[job_id]
+                del self._events[job_id]
+                raise
+            # Forget the oldest finished jobs
+            finished = [i for i, r in self.jobs.items() if r["status"] in ("done", "failed")]
+            for old in finished[:max(len(finished) - KEEP_FINISHED, 0)]:
+                del self.jobs[old]
+                self._events.pop(old, None)
+            return dict(record)
+
+    def get(self, job_id, wait=None):
+        """Copy of a job record (None if unknown); with wait, block up to that many seconds for it to finish."""
+        event = self._events.get(job_id)
+        if event is not None and wait:
+            event.wait(wait)
+        # Workers update records under the lock, so the copy is never half-written
+        with self._lock:
+            record = self.jobs.get(job_id)
+            return dict(record) if record is not None else None
+
+    def _update(self, record, **fields):
+        with self._lock:
+            record.update(fields)
+
+    def status(self):
+        with self._lock:
+            counts = {}
+            for record in self.jobs.values():
+                counts[record["status"]] = counts.get(record["status"], 0) + 1
+        return {"workers": len(self.threads), "capacity": self.queue.maxsize, "queued": self.queue.qsize(), **counts}
+
+    def _work(self):
+        while True:
+            job_id = self.queue.get()
+            record = self.jobs[job_id]
+            started = time.time()
+            self._update(record, status="running", started=started)
+            try:
+                result = dict(self._run(job_id, record["job"]), status="done")
+            except Exception as e:
+                traceback.print_exc()
+                result = {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+            result["queued_seconds"] = round(started - record["submitted"], 3)
+            result["run_seconds"] = round(time.time() - started, 3)
+            self._update(record, **result)
+            print(f"[INFO] Job {job_id} {result['status']} in {result['run_seconds']}s")
+            self._events[job_id].set()
+            self.queue.task_done()
+
+    def _run(self, job_id, job):
+        params = self.pipeline.merge_params(job.get("params"))
+        # Concurrent jobs must not overwrite each other's outputs
+        output_dir = job.get("output_dir") or os.path.join(self.pipeline.FIGURES_DIR, "jobs", job_id)
+        scene, feature = self._resolve(job)
+        if scene and not os.path.exists(scene):
+            raise FileNotFoundError(f"Input image {scene} not found")
+        summary = {}
+        pipeline = self.pipeline.build_pipeline(scene, self.cache, params, output_dir, job.get("enhanced"), summary,
+                                                feature)
+        timings = pipeline.run(job.get("outputs"), workers=self.stage_workers)
+        outputs = {}
+        for name in job.get("outputs") or self.pipeline.OUTPUTS:
+            for output in ([name] if name in self.pipeline.OUTPUTS else pipeline.stages[name].outputs):
+                target = self.pipeline.output_path(output, output_dir)
+                if target.exists():
+                    outputs[output] = str(target)
+        return {
+            "scene": scene,
+            "outputs": outputs,
+            "summary": summary,
+            "timings": {name: round(seconds, 3) for name, seconds in timings.items()},
+        }
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """JSON API: POST /jobs, GET /jobs/<id>, GET /health."""
+
+    service = None
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/health":
+            self._send(200, self.service.status())
+        elif url.path.startswith("/jobs/"):
+            wait = float(query.get("wait", [0])[0])
+            record = self.service.get(url.path[len("/jobs/"):], wait)
+            self._send(200 if record else 404, record or {"error": "unknown job"})
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/jobs":
+            self._send(404, {"error": "not found"})
+            return
+        try:
+            job = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            record = self.service.submit(job)
+        except queue.Full:
+            self._send(429, {"error": "queue full", **self.service.status()}, {"Retry-After": "1"})
+            return
+        except ValueError as e:
+            self._send(400, {"error": str(e)})
+            return
+        wait = float(parse_qs(url.query).get("wait", [0])[0])
+        if wait:
+            record = self.service.get(record["id"], wait)
+        self._send(200 if record["status"] in ("done", "failed") else 202, record)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(address=DEFAULT_ADDRESS, workers=2, queue_size=16, stage_workers=None, warm=True):
+    """Run the service at an http:// URL or a Unix socket path until interrupted."""
+    service = WorkerService(workers, queue_size, stage_workers)
+    if warm:
+        from drought_detection.config import DROUGHT_PARAMS
+        from fire_detection.config import FIRE_PARAMS
+        service.warm_up(FIRE_PARAMS, DROUGHT_PARAMS)
+    handler = type("Handler", (ServiceHandler,), {"service": service})
+    if address.startswith("http://"):
+        url = urlparse(address)
+        server = ThreadingHTTPServer((url.hostname, url.port), handler)
+    else:
+        if os.path.exists(address):
+            os.unlink(address)
+        server = ThreadingUnixHTTPServer(address, handler)
+    print(f"[INFO] Worker service listening on {address} ({workers} workers, queue of {queue_size})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.cache.report()
+        if not address.startswith("http://"):
+            os.unlink(address)
+
+
+# --- Client ------------------------------------------------------------------
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def _connection(address, timeout=None):
+    if address.startswith("http://"):
+        url = urlparse(address)
+        return http.client.HTTPConnection(url.hostname, url.port, timeout=timeout)
+    return UnixHTTPConnection(address, timeout=timeout)
+
+
+def request(method, path, payload=None, address=None, timeout=None):
+    """One JSON request to the service; returns (status, payload)."""
+    connection = _connection(address or os.environ.get(ADDRESS_ENV, DEFAULT_ADDRESS), timeout)
+    try:
+        body = json.dumps(payload).encode() if payload is not None else None
+        connection.request(method, path, body, {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read() or b"{}")
+    finally:
+        connection.close()
+
+
+def submit_job(job, address=None, wait=3600, retries=30):
+    """Submit a job and wait for its result, backing off while the queue is full."""
+    path = f"/jobs?wait={wait}" if wait else "/jobs"
+    for attempt in range(retries + 1):
+        status, record = request("POST", path, job, address)
+        if status != 429:
+            break
+        time.sleep(min(2 ** attempt * 0.1, 5))
+    else:
+        raise ServiceBusy("worker service queue is full")
+    if status == 400:
+        raise ValueError(record.get("error"))
+    return record
+
+
+def wait_job(job_id, address=None, wait=60):
+    """Poll a job until it is done or failed."""
+    while True:
+        status, record = request("GET", f"/jobs/{job_id}?wait={wait}", address=address)
+        if status == 404:
+            raise RuntimeError(f"Worker service lost job {job_id}")
+        if record["status"] in ("done", "failed"):
+            return record
+
+
+def run_remote(job, address=None):
+    """Run a job on the worker service if one is listening; None when there is none."""
+    try:
+        status, health = request("GET", "/health", address=address, timeout=1)
+        if status != 200 or "capacity" not in health:
+            return None
+    except (OSError, ValueError, http.client.HTTPException):
+        return None
+    record = submit_job(job, address)
+    if record["status"] not in ("done", "failed"):
+        print(f"[INFO] Job {record['id']} is still {record['status']} on the worker service, waiting")
+        record = wait_job(record["id"], address)
+    print(f"[INFO] Job {record['id']} ran on the worker service "
+          f"({record.get('queued_seconds', 0)}s queued, {record.get('run_seconds', 0)}s running)")
+    if record["status"] == "failed":
+        raise RuntimeError(f"Worker service job failed: {record.get('error')}")
+    return record
+
+
+def print_result(record):
+    """Print the coverage numbers, outputs and stage timings of a finished job."""
+    for name, value in record.get("summary", {}).items():
+        print(f"{name.replace('_', ' ').capitalize()}: {value:.2f}% of the image")
+    for name, path in record.get("outputs", {}).items():
+        print(f"{name} saved as: {path}")
+    timings = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in record.get("timings", {}).items())
+    print(f"Stage timings: {timings}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm worker service for the processing pipeline.")
+    parser.add_argument("--address", default=os.environ.get(ADDRESS_ENV, DEFAULT_ADDRESS),
+                        help="http://host:port or a Unix socket path")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve_parser = sub.add_parser("serve", help="Run the service")
+    serve_parser.add_argument("--workers", type=int, default=2, help="Jobs run concurrently")
+    serve_parser.add_argument("--queue-size", type=int, default=16, help="Jobs waiting before 429 responses")
+    serve_parser.add_argument("--stage-workers", type=int, default=None, help="Concurrent stages per job")
+    serve_parser.add_argument("--no-warm", action="store_true", help="Skip building the lookup tables at start")
+    submit_parser = sub.add_parser("submit", help="Submit a job and print its result")
+    submit_parser.add_argument("scene", nargs="?", help="Scene path")
+    submit_parser.add_argument("--stac-id")
+    submit_parser.add_argument("--asset", default="TCI")
+    submit_parser.add_argument("--enhanced", help="Use this enhanced image for carbon detection")
+    submit_parser.add_argument("--outputs", nargs="+", help="Outputs or stages (default: all)")
+    submit_parser.add_argument("--params", type=json.loads, help='Overrides, e.g. \'{"fire": {"intensity_threshold": 0.5}}\'')
+    submit_parser.add_argument("--output-dir")
+    submit_parser.add_argument("--no-wait", action="store_true", help="Return the job id without waiting")
+    sub.add_parser("health", help="Print queue and job counts")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.address, args.workers, args.queue_size, args.stage_workers, not args.no_warm)
+    elif args.command == "health":
+        print(json.dumps(request("GET", "/health", address=args.address)[1], indent=4))
+    else:
+        job = {key: value for key, value in {
+            "scene": os.path.abspath(args.scene) if args.scene else None,
+            "stac_id": args.stac_id,
+            "asset": args.asset,
+            "enhanced": os.path.abspath(args.enhanced) if args.enhanced else None,
+            "outputs": args.outputs,
+            "params": args.params,
+            "output_dir": args.output_dir,
+        }.items() if value is not None}
+        print(json.dumps(submit_job(job, args.address, wait=0 if args.no_wait else 3600), indent=4, default=str))
+
+
+if __name__ == "__main__":
+    main()
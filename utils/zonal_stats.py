@@ -0,0 +1,297 @@
+import argparse
+import csv
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from fire_detection.utils.fire_detection import calculate_fire_intensity
+from utils.cog_reader import open_cog, window_grid
+from utils.georef import apply_matrix, lonlat_to_pixel_matrix
+
+FIGURES_DIR = Path(__file__).resolve().parent.parent / "figures"
+
+# Per-zone sums; coverage and means are derived from them
+ZONE_COLUMNS = {
+    "pixels": np.int64,
+    "fire_pixels": np.int64,
+    "fire_intensity_sum": np.float64,
+    "drought_pixels": np.int64,
+    "drought_severity_sum": np.float64,
+    "carbon_pixels": np.int64,
+}
+
+
+def _polygons(geometry):
+    """Rings of every polygon of a Polygon/MultiPolygon (or GeometryCollection) geometry."""
+    if geometry is None:
+        return []
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    if geometry["type"] == "MultiPolygon":
+        return list(geometry["coordinates"])
+    if geometry["type"] == "GeometryCollection":
+        return [polygon for part in geometry["geometries"] for polygon in _polygons(part)]
+    return []
+
+
+def load_zones(path, id_property=None):
+    """Zone features of a GeoJSON file (FeatureCollection, Feature or bare geometry).
+
+    Each zone gets an "id": the id_property, else the feature id, else its
+    "id" or "name" property, else its position in the file.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("type") == "FeatureCollection":
+        features = data["features"]
+    elif data.get("type") == "Feature":
+        features = [data]
+    else:
+        features = [{"type": "Feature", "properties": {}, "geometry": data}]
+
+    zones = []
+    for index, feature in enumerate(features):
+        props = feature.get("properties") or {}
+        if id_property:
+            zone_id = props.get(id_property)
+        else:
+            zone_id = feature.get("id", props.get("id", props.get("name")))
+        zones.append({**feature, "id": index if zone_id is None else zone_id, "properties": props})
+    return zones
+
+
+def _edges(rings):
+    """(x0, y0, x1, y1) of every edge of a set of rings, closing them if needed."""
+    edges = []
+    for ring in rings:
+        if len(ring) > 1 and np.array_equal(ring[0], ring[-1]):
+            ring = ring[:-1]
+        if len(ring) >= 3:
+            edges.append(np.concatenate([ring, np.roll(ring, -1, axis=0)], axis=1))
+    return np.concatenate(edges) if edges else np.empty((0, 4))
+
+
+def scanline_mask(edges, row, col, height, width):
+    """Pixels of a window whose centres lie inside the edges (even-odd rule, so holes stay empty).
+
+    Crossings of each pixel-centre row with the edges are sorted and paired
+    into spans, and the spans are filled through a difference array. The
+    test only depends on the pixel centre, so a window gives exactly the
+    pixels a whole-scene raster would.
+    """
+    ys = row + np.arange(height) + 0.5
+    x0, y0, x1, y1 = edges.T
+    # Half-open in y, so a vertex on a scanline is crossed once
+    rows, index = np.nonzero((y0 <= ys[:, None]) != (y1 <= ys[:, None]))
+    t = (ys[rows] - y0[index]) / (y1[index] - y0[index])
+    xs = x0[index] + t * (x1[index] - x0[index])
+    order = np.lexsort((xs, rows))
+    rows, xs = rows[order], xs[order]
+    # Every row is crossed an even number of times: consecutive crossings bound the spans
+    starts = np.clip(np.ceil(xs[0::2] - 0.5) - col, 0, width).astype(np.intp)
+    stops = np.clip(np.ceil(xs[1::2] - 0.5) - col, 0, width).astype(np.intp)
+    rows = rows[0::2]
+    size = height * (width + 1)
+    diff = (np.bincount(rows * (width + 1) + starts, minlength=size)
+            - np.bincount(rows * (width + 1) + stops, minlength=size))
+    return np.cumsum(diff.reshape(height, width + 1)[:, :width], axis=1) > 0
+
+
+class ZoneRaster:
+    """Zone polygons mapped into the pixel space of a scene, rasterised window by window.
+
+    Vertices are projected once through the footprint homography of the
+    STAC feature; each window then only fills the zones whose pixel bounds
+    intersect it, within those bounds, so thousands of zones are labelled
+    in one pass over the scene. Labels are 1-based (0 = no zone); where
+    zones overlap the later one wins.
+    """
+
+    def __init__(self, zones, feature, width, height):
+        self.zones = zones
+        self.width, self.height = width, height
+        matrix = lonlat_to_pixel_matrix(feature, width, height)
+        self.edges = []
+        bounds = []
+        for zone in zones:
+            rings = []
+            for polygon in _polygons(zone.get("geometry")):
+                for ring in polygon:
+                    ring = np.asarray(ring, dtype=np.float64)[:, :2]
+                    rings.append(np.stack(apply_matrix(matrix, ring[:, 0], ring[:, 1]), axis=1))
+            edges = _edges(rings)
+            self.edges.append(edges)
+            if len(edges):
+                bounds.append([edges[:, 1].min(), edges[:, 0].min(), edges[:, 1].max(), edges[:, 0].max()])
+            else:
+                bounds.append([np.inf, np.inf, -np.inf, -np.inf])
+        # (top, left, bottom, right) in pixels
+        self.bounds = np.array(bounds, dtype=np.float64).reshape(-1, 4)
+
+    def __len__(self):
+        return len(self.zones)
+
+    def candidates(self, row, col, height, width):
+        """Indices of the zones whose pixel bounds intersect a window."""
+        top, left, bottom, right = self.bounds.T
+        hit = (top < row + height) & (bottom > row) & (left < col + width) & (right > col)
+        return np.flatnonzero(hit)
+
+    def labels(self, row, col, height, width):
+        """Zone label of every pixel of a window (np.intp), or None if no zone touches it."""
+        candidates = self.candidates(row, col, height, width)
+        if len(candidates) == 0:
+            return None
+        labels = np.zeros((height, width), dtype=np.intp)
+        for index in candidates:
+            top, left, bottom, right = self.bounds[index]
+            # Restrict the fill to the zone bounds within the window
+            r0, c0 = max(row, int(np.floor(top))), max(col, int(np.floor(left)))
+            r1, c1 = min(row + height, int(np.ceil(bottom))), min(col + width, int(np.ceil(right)))
+            if r0 >= r1 or c0 >= c1:
+                continue
+            inside = scanline_mask(self.edges[index], r0, c0, r1 - r0, c1 - c0)
+            labels[r0 - row:r1 - row, c0 - col:c1 - col][inside] = index + 1
+        return labels
+
+
+class ZonalStats:
+    """Per-zone sums of the detection layers, accumulated tile by tile with bincount.
+
+    The label tiles of add_tile are kept (in the smallest integer type that
+    holds the zone count) until add_carbon, whose mask is only known after
+    the pass, so every tile is rasterised once.
+    """
+
+    def __init__(self, raster):
+        self.raster = raster
+        self.sums = {name: np.zeros(len(raster) + 1, dtype=dtype) for name, dtype in ZONE_COLUMNS.items()}
+        self._labels = {}
+        self._dtype = np.min_scalar_type(len(raster))
+
+    def _window_labels(self, row, col, height, width):
+        key = (row, col, height, width)
+        if key in self._labels:
+            return self._labels.pop(key)
+        return self.raster.labels(row, col, height, width)
+
+    def _count(self, name, labels, mask):
+        self.sums[name] += np.bincount(labels[mask > 0], minlength=len(self.sums[name]))
+
+    def add_tile(self, row, col, image, fire_mask, drought_mask, drought_severity):
+        """Add the fire intensity, masks and drought severity of an RGB block placed at (row, col)."""
+        height, width = image.shape[:2]
+        labels = self.raster.labels(row, col, height, width)
+        self._labels[(row, col, height, width)] = None if labels is None else labels.astype(self._dtype)
+        if labels is None:
+            return
+        size = len(self.sums["pixels"])
+        self.sums["pixels"] += np.bincount(labels.ravel(), minlength=size)
+        self._count("fire_pixels", labels, fire_mask)
+        self._count("drought_pixels", labels, drought_mask)
+        self.sums["fire_intensity_sum"] += np.bincount(
+            labels.ravel(), weights=calculate_fire_intensity(image).ravel(), minlength=size)
+        self.sums["drought_severity_sum"] += np.bincount(
+            labels.ravel(), weights=np.asarray(drought_severity).ravel(), minlength=size)
+
+    def add_carbon(self, carbon_mask, tile_size=1024):
+        """Count the carbon mask (at scene resolution) per zone, tile by tile."""
+        height, width = carbon_mask.shape[:2]
+        for window in window_grid(height, width, tile_size):
+            labels = self._window_labels(window.row, window.col, window.height, window.width)
+            if labels is not None:
+                self._count("carbon_pixels", labels, carbon_mask[window.row:window.row + window.height,
+                                                                 window.col:window.col + window.width])
+        self._labels.clear()
+
+    def results(self):
+        """One record per zone: pixel counts, coverage percentages and mean intensity/severity."""
+        records = []
+        for index, zone in enumerate(self.raster.zones, start=1):
+            pixels = int(self.sums["pixels"][index])
+            total = max(pixels, 1)
+            records.append({
+                "id": zone["id"],
+                "pixels": pixels,
+                "fire_pixels": int(self.sums["fire_pixels"][index]),
+                "fire_coverage": self.sums["fire_pixels"][index] / total * 100,
+                "mean_fire_intensity": self.sums["fire_intensity_sum"][index] / total,
+                "drought_pixels": int(self.sums["drought_pixels"][index]),
+                "drought_coverage": self.sums["drought_pixels"][index] / total * 100,
+                "mean_drought_severity": self.sums["drought_severity_sum"][index] / total,
+                "carbon_pixels": int(self.sums["carbon_pixels"][index]),
+                "carbon_coverage": self.sums["carbon_pixels"][index] / total * 100,
+            })
+        return records
+
+
+def save_zonal_stats(zones, records, path):
+    """Write the records as CSV, or as the zone GeoJSON with the statistics in its properties."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix.lower() == ".csv":
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(records[0]) if records else ["id"])
+            writer.writeheader()
+            writer.writerows(records)
+        return path
+    features = []
+    for zone, record in zip(zones, records):
+        stats = {key: value for key, value in record.items() if key != "id"}
+        features.append({"type": "Feature", "id": zone["id"], "geometry": zone.get("geometry"),
+                         "properties": {**zone["properties"], **stats}})
+    with open(path, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+    return path
+
+
+def main():
+    from carbon_detection.config import CARBON_DETECTION
+    from drought_detection.config import DROUGHT_PARAMS
+    from fire_detection.config import FIRE_PARAMS
+    from utils.fused_detection import run_fused_detection
+    from utils.load_project_data import asset_local_path
+    from utils.stac_catalog import open_catalog
+
+    parser = argparse.ArgumentParser(description="Fire, drought and carbon coverage per GeoJSON zone of a scene.")
+    parser.add_argument("zones", help="GeoJSON polygons (farms, parcels, districts, ...)")
+    parser.add_argument("feature_id", help="STAC feature whose footprint places the scene")
+    parser.add_argument("--asset", default="TCI")
+    parser.add_argument("--input", help="Scene file (default: the downloaded asset of the feature)")
+    parser.add_argument("--data-dir", default=None, help="Directory holding downloaded assets")
+    parser.add_argument("--id-property", help="Zone property to use as its id")
+    parser.add_argument("--tile-size", type=int, default=1024)
+    parser.add_argument("--output", help="Output .geojson or .csv (default: figures/zonal/<feature id>.geojson)")
+    args = parser.parse_args()
+
+    with open_catalog() as catalog:
+        feature = catalog.get_feature(args.feature_id)
+    if feature is None:
+        print(f"Error: Feature {args.feature_id} not in the catalog!")
+        return
+    source = args.input or asset_local_path(feature, args.asset, args.data_dir)
+    if not os.path.exists(source):
+        print(f"Error: Input image {source} not found!")
+        return
+
+    zones = load_zones(args.zones, args.id_property)
+    with open_cog(source) as reader:
+        zonal = ZonalStats(ZoneRaster(zones, feature, reader.width, reader.height))
+        run_fused_detection(reader, FIRE_PARAMS, DROUGHT_PARAMS, CARBON_DETECTION, tile_size=args.tile_size,
+                            zones=zonal, packed=True)
+    records = zonal.results()
+    output = args.output or FIGURES_DIR / "zonal" / f"{args.feature_id}.geojson"
+    save_zonal_stats(zones, records, output)
+
+    covered = [record for record in records if record["pixels"]]
+    print(f"Zonal statistics completed: {len(covered)} of {len(zones)} zones inside the scene")
+    for record in sorted(covered, key=lambda r: r["drought_coverage"], reverse=True)[:10]:
+        print(f"  {str(record['id']):32s} drought {record['drought_coverage']:6.2f}%  "
+              f"fire {record['fire_coverage']:6.2f}%  carbon {record['carbon_coverage']:6.2f}%")
+    print(f"Zonal statistics saved as: {output}")
+
+
+if __name__ == "__main__":
+    main()